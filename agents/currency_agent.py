@@ -1,38 +1,38 @@
 
 import os
+import time
+import asyncio
 import logging
-import requests
+import threading
 from typing import Optional
-from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 from core.agent_state import AgentState
+from core.instrumentation import record_history
+from core.deadline import with_deadline
+from utils.circuit_breaker import CircuitOpenError
+from core.llm import get_llm
+from utils.gazetteer import gazetteer
+from utils.popularity import popularity
+from utils.http_client import http_get, ahttp_get
 
 # ----- Configure logging -----
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Load environment variables -----
-# This loads environment variables from a .env file, typically containing sensitive information like API keys.
-load_dotenv(dotenv_path='env')
-
-# ----- Global LLM instance -----
-# Initializes the language model for currency extraction. 
-# The model used here is GPT-3.5-turbo, which is ideal for text processing and extraction tasks.
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 # ----- Prompt Template for currency extraction -----
 # This is the template used to instruct the language model to extract currency codes (ISO 4217 format) from the given text.
 # The prompt is written in Spanish but will be used to parse any input text in the same format.
 currency_extraction_template = """
-Eres un asistente que extrae dos códigos de divisas (ISO 4217) desde el texto dado. 
+Eres un asistente que extrae los códigos de divisas (ISO 4217) desde el texto dado: primero la divisa de origen y después las de destino. 
 Responde únicamente con los códigos separados por coma. No uses símbolos ni explicaciones.
 
 Ejemplo:
 Texto: "¿Cuánto vale un dólar en pesos mexicanos?" -> USD, MXN
+Texto: "Un dólar en pesos mexicanos, euros y yenes" -> USD, MXN, EUR, JPY
 Texto: "{text}"
 """
 
@@ -41,36 +41,199 @@ currency_extraction_prompt = PromptTemplate(
     template=currency_extraction_template  # The prompt template for extraction.
 )
 
+# ----- Exchange rate endpoint -----
+# Overridable to point the agent at a stand-in (see benchmarks/e2e.py)
+EXCHANGE_URL = os.getenv("EXCHANGE_URL", "https://v6.exchangerate-api.com/v6/{api_key}/latest/{base_currency}")
+
+# ----- Rate table cache settings -----
+# A table younger than EXCHANGE_RATES_TTL seconds is served as fresh. Older tables are still
+# served (and refreshed in the background) until they reach EXCHANGE_RATES_MAX_STALE seconds.
+EXCHANGE_RATES_TTL = float(os.getenv("EXCHANGE_RATES_TTL", "3600"))
+EXCHANGE_RATES_MAX_STALE = float(os.getenv("EXCHANGE_RATES_MAX_STALE", "86400"))
+
+# ----- Rate matrix cache -----
+class RateTableCache:
+    """
+    TTL cache of full `conversion_rates` tables, keyed by base currency.
+
+    Any pair A -> B can be answered from a cached table of another base C as
+    rate(C -> B) / rate(C -> A), so one upstream call serves every pair whose
+    currencies appear in that table.
+    """
+
+    def __init__(self, ttl: float = EXCHANGE_RATES_TTL, max_stale: float = EXCHANGE_RATES_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self._tables: dict[str, tuple[float, dict[str, float]]] = {}
+        self._refreshing: set[str] = set()
+        self._lock = threading.Lock()
+        self.stats = {"direct": 0, "derived": 0, "stale": 0, "misses": 0, "refreshes": 0}
+
+    def store(self, base: str, rates: dict[str, float]) -> None:
+        """
+        Stores (or replaces) the rate table fetched for `base`.
+        """
+        with self._lock:
+            self._tables[base] = (time.monotonic(), rates)
+            self._refreshing.discard(base)
+
+    def lookup(self, base: str, target: str) -> Optional[tuple[float, str, bool]]:
+        """
+        Resolves base -> target from the cached tables.
+
+        Returns:
+        Optional[tuple[float, str, bool]]: (rate, base of the table used, whether that table is stale),
+        or None if no usable table contains both currencies.
+        """
+        now = time.monotonic()
+        best = None
+        with self._lock:
+            # Try the table of the requested base first, then every other table.
+            candidates = [base] + [b for b in self._tables if b != base]
+            for source in candidates:
+                entry = self._tables.get(source)
+                if entry is None:
+                    continue
+                age = now - entry[0]
+                if age > self.max_stale:
+                    continue
+                rates = entry[1]
+                if target not in rates or base not in rates or not rates[base]:
+                    continue
+                stale = age > self.ttl
+                best = (rates[target] / rates[base], source, stale)
+                if not stale:
+                    break
+
+            if best is None:
+                self.stats["misses"] += 1
+            else:
+                self.stats["direct" if best[1] == base else "derived"] += 1
+                if best[2]:
+                    self.stats["stale"] += 1
+        return best
+
+    def expires_in(self, base: str) -> Optional[float]:
+        """
+        Seconds until the table of `base` goes stale (negative once it has), or None if not cached.
+        """
+        with self._lock:
+            entry = self._tables.get(base)
+        return None if entry is None else self.ttl - (time.monotonic() - entry[0])
+
+    def claim_refresh(self, base: str) -> bool:
+        """
+        Marks `base` as being refreshed. Returns False if a refresh is already in flight.
+        """
+        with self._lock:
+            if base in self._refreshing:
+                return False
+            self._refreshing.add(base)
+            self.stats["refreshes"] += 1
+            return True
+
+    def release_refresh(self, base: str) -> None:
+        with self._lock:
+            self._refreshing.discard(base)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._tables.clear()
+            self._refreshing.clear()
+
+
+# Shared cache for every exchange query in the process
+rate_cache = RateTableCache()
+
+# Keeps a reference to the background refresh tasks so they are not garbage collected
+_background_tasks: set = set()
+
+# ----- Function to parse the LLM answer into currency codes -----
+def _split_codes(codes) -> Optional[tuple[str, list[str]]]:
+    """
+    Splits a list of distinct currency codes into (base, [targets]).
+
+    Parameters:
+    codes: ISO 4217 codes, the base first (e.g. the planner's "currencies" entity).
+
+    Returns:
+    Optional[tuple[str, list[str]]]: The base and target codes, or None if there are fewer than two.
+    """
+    if not codes or len(codes) < 2:
+        return None
+    return codes[0], list(codes[1:])
+
+def _parse_currencies(result: str) -> Optional[tuple[str, list[str]]]:
+    """
+    Parses the raw LLM answer into a base currency and its target currencies.
+
+    Parameters:
+    result (str): The stripped LLM response, expected as "XXX, YYY[, ZZZ...]".
+
+    Returns:
+    Optional[tuple[str, list[str]]]: The base and target codes, or None if the format is unexpected.
+    """
+    # Split the result into its parts (currency codes), dropping repeated codes
+    parts = list(dict.fromkeys(p.strip().upper() for p in result.split(",")))
+
+    # Check if the result contains at least two 3-letter currency codes
+    if len(parts) >= 2 and all(len(code) == 3 for code in parts):
+        logger.info("Successfully extracted currency codes: %s", parts)
+        return _split_codes(parts)
+
+    logger.warning("Unexpected format in the response: %s", result)
+    return None
+
 # ----- Function to extract currencies using the language model (LLM) -----
-def extract_currencies_with_llm(text: str) -> Optional[tuple[str, str]]:
+def extract_currencies_with_llm(text: str) -> Optional[tuple[str, list[str]]]:
     """
-    Extracts two currency codes from a given text using the pre-defined language model prompt.
+    Extracts the base and target currency codes from a given text using the pre-defined language model prompt.
     
     Parameters:
     text (str): The input text containing the currencies to be extracted.
     
     Returns:
-    Optional[tuple[str, str]]: A tuple containing two ISO 4217 currency codes (or None if extraction fails).
+    Optional[tuple[str, list[str]]]: The base ISO 4217 code and the target codes (or None if extraction fails).
     """
     try:
         # Format the prompt with the provided text
         prompt = currency_extraction_prompt.format(text=text)
-        logger.debug(f"Prompt sent to LLM: {prompt}")
+        log_prompt(logger, "Prompt sent to LLM: %s", prompt)
         
         # Get the response from the LLM
-        response = llm.invoke([HumanMessage(content=prompt)])
+        response = invoke_cached(get_llm("exchange"), [HumanMessage(content=prompt)], node="exchange")
         result = response.content.strip()
-        logger.debug(f"LLM response: {result}")
+        log_prompt(logger, "LLM response: %s", result)
 
-        # Split the result into two parts (currency codes)
-        parts = [p.strip().upper() for p in result.split(",")]
+        return _parse_currencies(result)
 
-        # Check if the result contains exactly two 3-letter currency codes
-        if len(parts) == 2 and all(len(code) == 3 for code in parts):
-            logger.info(f"Successfully extracted currency codes: {parts}")
-            return parts[0], parts[1]
-        else:
-            logger.warning(f"Unexpected format in the response: {result}")
+    except Exception as e:
+        # Log the error if extraction fails
+        logger.exception("Error during currency extraction")
+
+    return None
+
+async def aextract_currencies_with_llm(text: str) -> Optional[tuple[str, list[str]]]:
+    """
+    Async version of `extract_currencies_with_llm`, awaiting the model with `ainvoke`.
+
+    Parameters:
+    text (str): The input text containing the currencies to be extracted.
+
+    Returns:
+    Optional[tuple[str, list[str]]]: The base ISO 4217 code and the target codes (or None if extraction fails).
+    """
+    try:
+        # Format the prompt with the provided text
+        prompt = currency_extraction_prompt.format(text=text)
+        log_prompt(logger, "Prompt sent to LLM: %s", prompt)
+
+        # Await the response from the LLM
+        response = await ainvoke_cached(get_llm("exchange"), [HumanMessage(content=prompt)], node="exchange")
+        result = response.content.strip()
+        log_prompt(logger, "LLM response: %s", result)
+
+        return _parse_currencies(result)
 
     except Exception as e:
         # Log the error if extraction fails
@@ -78,10 +241,218 @@ def extract_currencies_with_llm(text: str) -> Optional[tuple[str, str]]:
 
     return None
 
+# ----- Helpers shared by the sync and async exchange nodes -----
+def _no_currencies_update() -> dict:
+    """
+    State update returned when no currencies could be detected in the message.
+    """
+    msg = "No currencies detected in the message."
+    logger.warning(msg)
+    return {
+        "error": {"exchange": msg},
+        "task_completed":{"exchange": True} 
+    }
+
+def _missing_api_key_update() -> dict:
+    """
+    State update returned when the exchange rate API key is not configured.
+    """
+    logger.error("API Key not set in the environment.")
+    return {
+        "error": {"exchange": "API Key not configured in the system."},
+        "task_completed":{"exchange": True} 
+    }
+
+def _rates_url(base_currency: str, api_key: str) -> str:
+    """
+    Builds the exchange rate API URL that returns the full table for `base_currency`.
+    """
+    url = EXCHANGE_URL.format(api_key=api_key, base_currency=base_currency)
+    logger.debug("Querying external API: %s", url)
+    return url
+
+def _store_rates_response(base_currency: str, response) -> Optional[dict]:
+    """
+    Stores the `conversion_rates` table of a successful API response in the rate cache.
+
+    Parameters:
+    base_currency (str): ISO 4217 code of the base currency that was queried.
+    response: The httpx response from exchangerate-api.com.
+
+    Returns:
+    Optional[dict]: None if the table was stored, otherwise the error state update.
+    """
+    # Check if the response from the API is successful
+    if response.status_code != 200:
+        logger.error("Error in API response: %s", response.status_code)
+        return {
+            "error": {"exchange": f"API error: {response.status_code}"},
+            "task_completed":{"exchange": False} 
+        }
+
+    # Parse the JSON data from the API response and keep the whole table
+    data = response.json()
+    rates = data.get('conversion_rates', {})
+    if rates:
+        rate_cache.store(base_currency, rates)
+    return None
+
+def _rate_message(base_currency: str, target_currency: str, rate: float) -> str:
+    return f"1 {base_currency} = {round(rate, 6)} {target_currency}"
+
+def _rates_update(base_currency: str, target_currencies: list[str], rates: dict[str, float]) -> dict:
+    """
+    Formats the rates of every target currency into the state update for the exchange task.
+    Targets missing from the rate table are reported after the rates; the task only fails
+    when none of them was found.
+    """
+    missing = [target for target in target_currencies if target not in rates]
+    if len(missing) == len(target_currencies):
+        return _rate_not_found_update(missing[0])
+
+    messages = [_rate_message(base_currency, target, rates[target]) for target in target_currencies if target in rates]
+    logger.info("Exchange rate obtained: %s", ", ".join(messages))
+    for target in missing:
+        logger.warning("Exchange rate for %s not available in the response.", target)
+
+    # Return the exchange rate results in the updated state
+    return {
+        "results": {"exchange": messages + [f"Exchange rate for {target} not found." for target in missing]},
+        "task_completed":{"exchange": True} 
+    }
+
+def _rate_not_found_update(target_currency: str) -> dict:
+    """
+    State update returned when the target currency is missing from the rate table.
+    """
+    logger.warning("Exchange rate for %s not available in the response.", target_currency)
+    return {
+        "error": {"exchange": f"Exchange rate for {target_currency} not found."},
+        "task_completed":{"exchange": True} 
+    }
+
+def _refresh_rates(base_currency: str, api_key: str) -> None:
+    """
+    Re-fetches the table for `base_currency`; runs in a background thread.
+    """
+    try:
+        _store_rates_response(base_currency, http_get(_rates_url(base_currency, api_key)))
+    except Exception:
+        logger.exception("Background refresh of %s rates failed", base_currency)
+    finally:
+        rate_cache.release_refresh(base_currency)
+
+async def _arefresh_rates(base_currency: str, api_key: str) -> None:
+    """
+    Async version of `_refresh_rates`; runs as a background task on the event loop.
+    """
+    try:
+        _store_rates_response(base_currency, await ahttp_get(_rates_url(base_currency, api_key)))
+    except Exception:
+        logger.exception("Background refresh of %s rates failed", base_currency)
+    finally:
+        rate_cache.release_refresh(base_currency)
+
+def refresh_rates(base_currency: str) -> None:
+    """
+    Fetches the full table for `base_currency` now and stores it (used by the prefetcher).
+    """
+    api_key = os.getenv("EXCHANGE_API_KEY")
+    if not api_key:
+        return
+    error = _store_rates_response(base_currency, http_get(_rates_url(base_currency, api_key)))
+    if error:
+        raise RuntimeError(error["error"]["exchange"])
+
+def _schedule_refresh(source_base: str, api_key: str) -> None:
+    """
+    Starts a background refresh of a stale table, unless one is already running.
+    """
+    if not rate_cache.claim_refresh(source_base):
+        return
+    logger.info("Refreshing stale %s rate table in the background", source_base)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        threading.Thread(target=_refresh_rates, args=(source_base, api_key), daemon=True).start()
+        return
+    task = loop.create_task(_arefresh_rates(source_base, api_key))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+def _cached_rates(base_currency: str, target_currencies: list[str], api_key: str) -> dict[str, float]:
+    """
+    Answers every target it can from the rate cache, scheduling a refresh of each stale table used.
+
+    Returns:
+    dict[str, float]: Rate per target currency found in the cache (possibly empty).
+    """
+    rates = {}
+    for target_currency in target_currencies:
+        cached = rate_cache.lookup(base_currency, target_currency)
+        if cached is None:
+            continue
+
+        rate, source_base, stale = cached
+        logger.debug("Rate %s->%s served from the %s table (stale=%s)", base_currency, target_currency, source_base, stale)
+        if stale:
+            _schedule_refresh(source_base, api_key)
+        rates[target_currency] = rate
+    return rates
+
+def _fetched_rates_update(base_currency: str, target_currencies: list[str], rates: dict[str, float], response) -> dict:
+    """
+    Stores a freshly fetched table and answers the targets the cache could not from it.
+    """
+    error = _store_rates_response(base_currency, response)
+    if error and not rates:
+        return error
+
+    for target_currency in target_currencies:
+        if error or target_currency in rates:
+            continue
+        cached = rate_cache.lookup(base_currency, target_currency)
+        if cached is not None:
+            rates[target_currency] = cached[0]
+    return _rates_update(base_currency, target_currencies, rates)
+
+def _exchange_error_update(e: Exception) -> dict:
+    """
+    State update returned when an unexpected exception interrupts the exchange task.
+    """
+    logger.exception("Unexpected error while getting exchange rate")
+    return {
+        "error": {"exchange": f"Error obtaining exchange rate: {str(e)}"},
+        "task_completed":{"exchange": False} 
+    }
+
+def _cached_rate(state: AgentState) -> Optional[str]:
+    """
+    Rates for the query's currencies from the cached tables, resolved without calling the
+    LLM or the API. Used when the exchange task misses its deadline.
+    """
+    entities = state.get("entities") or {}
+    if "currencies" in entities:
+        currencies = _split_codes(entities["currencies"])
+    else:
+        currencies = gazetteer.match_exchange(state["messages"][-1].content)
+    if not currencies:
+        return None
+    base_currency, target_currencies = currencies
+    messages = []
+    for target_currency in target_currencies:
+        cached = rate_cache.lookup(base_currency, target_currency)
+        if cached:
+            messages.append(_rate_message(base_currency, target_currency, cached[0]))
+    return ", ".join(messages) or None
+
 # ----- Function to get exchange rate -----
+@record_history("task_exchange")
+@with_deadline("exchange", _cached_rate, upstream="exchangerate")
 def get_exchange_rate(state: AgentState) -> AgentState:
     """
-    Processes the user's message to detect currencies and fetches the exchange rate between them.
+    Processes the user's message to detect a base currency and one or more target currencies,
+    and answers every target from the base currency's rate table.
     
     Parameters:
     state (dict): The current state of the agent, which contains the user's message and other context.
@@ -89,77 +460,107 @@ def get_exchange_rate(state: AgentState) -> AgentState:
     Returns:
     dict: The updated state dictionary containing either the results or error messages.
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_exchange")
     try:
         # Get the input text from the state (the user's message)
         input_text = state["messages"][-1].content
-        logger.info(f"Processing user message: {input_text}")
+        logger.info("Processing user message: %s", input_text)
 
         # Extract the currency codes from the user's input
-        currencies = extract_currencies_with_llm(input_text)
+        entities = state.get("entities") or {}
+        if "currencies" in entities:
+            # The planner already extracted the currencies; skip the extraction call
+            currencies = _split_codes(entities["currencies"])
+        else:
+            # Known currencies resolve locally; the LLM is only asked when there is no confident match
+            currencies = gazetteer.match_exchange(input_text, strict=True) or extract_currencies_with_llm(input_text)
         
         # If no currencies are detected, return an error
         if not currencies:
-            msg = "No currencies detected in the message."
-            logger.warning(msg)
-            return {
-                "error": {"exchange": msg},
-                "task_completed":{"exchange": True} 
-            }
+            return _no_currencies_update()
 
         # Extract base and target currencies
-        base_currency, target_currency = currencies
-        logger.info(f"Detected currencies: {base_currency} -> {target_currency}")
+        base_currency, target_currencies = currencies
+        logger.info("Detected currencies: %s -> %s", base_currency, ", ".join(target_currencies))
+        popularity.record("exchange", base_currency)
 
         # Retrieve the API key for the exchange rate service from environment variables
         api_key = os.getenv("EXCHANGE_API_KEY")
         if not api_key:
-            logger.error("API Key not set in the environment.")
-            return {
-                "error": {"exchange": "API Key not configured in the system."},
-                "task_completed":{"exchange": True} 
-            }
-
-        # Construct the API URL to get the exchange rates
-        url = f"https://v6.exchangerate-api.com/v6/{api_key}/latest/{base_currency}"
-        logger.debug(f"Querying external API: {url}")
-        response = requests.get(url)
-
-        # Check if the response from the API is successful
-        if response.status_code != 200:
-            logger.error(f"Error in API response: {response.status_code}")
-            return {
-                "error": {"exchange": f"API error: {response.status_code}"},
-                "task_completed":{"exchange": False} 
-            }
-
-        # Parse the JSON data from the API response
-        data = response.json()
-
-        # Check if the target currency's exchange rate is available
-        if target_currency not in data.get('conversion_rates', {}):
-            logger.warning(f"Exchange rate for {target_currency} not available in the response.")
-            return {
-                "error": {"exchange": f"Exchange rate for {target_currency} not found."},
-                "task_completed":{"exchange": True} 
-            }
-
-        # Get the exchange rate for the target currency and format the response message
-        rate = data['conversion_rates'][target_currency]
-        message = f"1 {base_currency} = {rate} {target_currency}"
-        logger.info(f"Exchange rate obtained: {message}")
-
-        # Return the exchange rate result in the updated state
-        return {
-            "results": {"exchange": [message]},
-            "task_completed":{"exchange": True} 
-        }
+            return _missing_api_key_update()
+
+        # Answer from the cached rate tables (direct or triangulated) when possible
+        rates = _cached_rates(base_currency, target_currencies, api_key)
+        if len(rates) == len(target_currencies):
+            return _rates_update(base_currency, target_currencies, rates)
+
+        # Otherwise fetch the full table for the base currency once; it answers every target
+        response = http_get(_rates_url(base_currency, api_key))
+
+        return _fetched_rates_update(base_currency, target_currencies, rates, response)
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
 
     except Exception as e:
         # Handle any unexpected errors and return them in the state
-        logger.exception("Unexpected error while getting exchange rate")
-        return {
-            "error": {"exchange": f"Error obtaining exchange rate: {str(e)}"},
-            "task_completed":{"exchange": False} 
-        }
+        return _exchange_error_update(e)
+
+# ----- Async function to get exchange rate -----
+@record_history("task_exchange")
+@with_deadline("exchange", _cached_rate, upstream="exchangerate")
+async def aget_exchange_rate(state: AgentState) -> AgentState:
+    """
+    Async version of `get_exchange_rate`. The currency extraction is awaited with `ainvoke`
+    and the exchange rate API is queried through the pooled async client, so this node does not
+    block the event loop while LangGraph runs the other agents.
+
+    Parameters:
+    state (dict): The current state of the agent, which contains the user's message and other context.
+
+    Returns:
+    dict: The updated state dictionary containing either the results or error messages.
+    """
+    try:
+        # Get the input text from the state (the user's message)
+        input_text = state["messages"][-1].content
+        logger.info("Processing user message: %s", input_text)
+
+        # Extract the currency codes from the user's input
+        entities = state.get("entities") or {}
+        if "currencies" in entities:
+            # The planner already extracted the currencies; skip the extraction call
+            currencies = _split_codes(entities["currencies"])
+        else:
+            # Known currencies resolve locally; the LLM is only asked when there is no confident match
+            currencies = gazetteer.match_exchange(input_text, strict=True) or await aextract_currencies_with_llm(input_text)
+
+        # If no currencies are detected, return an error
+        if not currencies:
+            return _no_currencies_update()
+
+        # Extract base and target currencies
+        base_currency, target_currencies = currencies
+        logger.info("Detected currencies: %s -> %s", base_currency, ", ".join(target_currencies))
+        popularity.record("exchange", base_currency)
+
+        # Retrieve the API key for the exchange rate service from environment variables
+        api_key = os.getenv("EXCHANGE_API_KEY")
+        if not api_key:
+            return _missing_api_key_update()
+
+        # Answer from the cached rate tables (direct or triangulated) when possible
+        rates = _cached_rates(base_currency, target_currencies, api_key)
+        if len(rates) == len(target_currencies):
+            return _rates_update(base_currency, target_currencies, rates)
+
+        # Otherwise fetch the full table for the base currency once; it answers every target
+        response = await ahttp_get(_rates_url(base_currency, api_key))
+
+        return _fetched_rates_update(base_currency, target_currencies, rates, response)
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
+
+    except Exception as e:
+        # Handle any unexpected errors and return them in the state
+        return _exchange_error_update(e)
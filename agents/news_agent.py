@@ -1,34 +1,35 @@
 
 import os
+import asyncio
 import logging
-import requests
-from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 from core.agent_state import AgentState
+from core.instrumentation import record_history
+from core.deadline import with_deadline
+from utils.circuit_breaker import CircuitOpenError
+from core.llm import get_llm
+from utils.gazetteer import gazetteer
+from utils.popularity import popularity
+from utils.http_client import http_get, ahttp_get
+from utils.response_cache import ResponseCache, normalize_key
 
 # ----- Configure logging -----
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Load environment variables -----
-# Loads environment variables from the .env file, typically containing API keys like the News API key.
-load_dotenv(dotenv_path='env')
-
-# ----- Global LLM instance -----
-# This initializes the LLM (language model) from OpenAI with the "gpt-3.5-turbo" model.
-# It's used for natural language understanding and extracting country codes from text.
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 # ----- Prompt Template for country extraction -----
-# This is the prompt used by the LLM to extract the country code (ISO 3166-1 alpha-2) from the provided text.
-# The prompt asks for a 2-letter country code and returns only that code.
+# This is the prompt used by the LLM to extract the country codes (ISO 3166-1 alpha-2) from the provided text.
+# The prompt asks for 2-letter country codes separated by commas and returns only those codes.
 country_extraction_template = """
-You are an assistant that extracts the country (in ISO 3166-1 alpha-2 code, like 'MX', 'US', 'FR') from the following text.
-Respond only with the country code. If no country is mentioned, respond with ' '.
+You are an assistant that extracts the countries (in ISO 3166-1 alpha-2 code, like 'MX', 'US', 'FR') from the following text.
+Respond only with the country codes separated by commas, in the order they appear. If no country is mentioned, respond with ' '.
 
 Text: "{text}"
 """
@@ -39,42 +40,266 @@ country_extraction_prompt = PromptTemplate(
     template=country_extraction_template  # The actual template for extraction.
 )
 
-# ----- Function to extract country from the text using the LLM -----
-def extract_country_with_llm(text: str) -> str:
+# ----- News API endpoint -----
+# Overridable to point the agent at a stand-in (see benchmarks/e2e.py)
+NEWS_URL = os.getenv("NEWS_URL", "https://newsapi.org/v2/top-headlines?country={country_code}&apiKey={api_key}")
+
+# ----- News response cache -----
+# Headlines are keyed by country code; only successful lookups are cached.
+news_cache = ResponseCache(
+    "news",
+    ttl=float(os.getenv("NEWS_CACHE_TTL", "900")),
+    stale_ttl=float(os.getenv("NEWS_CACHE_STALE_TTL", "600")),
+    max_entries=int(os.getenv("NEWS_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("NEWS_CACHE_MAX_BYTES", "1000000")),
+    cache_if=lambda update: "results" in update,
+)
+
+# ----- Per-country fan-out -----
+# The sync node fetches several countries at once on these threads (the async node uses gather)
+NEWS_FANOUT_WORKERS = int(os.getenv("NEWS_FANOUT_WORKERS", "8"))
+_fanout = ThreadPoolExecutor(max_workers=NEWS_FANOUT_WORKERS, thread_name_prefix="news")
+
+# ----- Function to validate the country code returned by the LLM -----
+def _parse_country(country: str) -> str:
     """
-    Extracts the country code from the provided text using the LLM.
+    Validates that the LLM answer is a 2-letter country code.
 
     Parameters:
-    text (str): The input text containing a country mention.
+    country (str): The normalized (lowercase) LLM response.
 
     Returns:
-    str: The ISO 3166-1 alpha-2 country code extracted from the text (or ' ' if no country is mentioned).
+    str: The country code, or None if the response is invalid.
+    """
+    if len(country) != 2 or not country.isalpha():
+        logger.warning("Invalid response from LLM")
+        return None  # Return a blank space if the response is invalid
+    return country
+
+def _parse_countries(content: str) -> list[str]:
+    """
+    Splits the normalized (lowercase) LLM answer into valid, distinct country codes.
+    """
+    countries = []
+    for part in content.split(","):
+        country = _parse_country(part.strip())
+        if country and country not in countries:
+            countries.append(country)
+    return countries
+
+# ----- Function to extract countries from the text using the LLM -----
+def extract_countries_with_llm(text: str) -> list[str]:
+    """
+    Extracts the country codes from the provided text using the LLM.
+
+    Parameters:
+    text (str): The input text containing country mentions.
+
+    Returns:
+    list[str]: The ISO 3166-1 alpha-2 country codes extracted from the text (empty if no country is mentioned).
     """
     try:
         # Format the prompt with the provided text
         prompt = country_extraction_prompt.format(text=text)
-        logger.debug(f"Prompt sent to LLM: {prompt}")
+        log_prompt(logger, "Prompt sent to LLM: %s", prompt)
         
         # Get the response from the LLM
-        response = llm.invoke([HumanMessage(content=prompt)])
-        country = response.content.strip().lower()  # Normalize the country code (convert to lowercase)
-        logger.debug(f"LLM response: {country}")
+        response = invoke_cached(get_llm("news"), [HumanMessage(content=prompt)], node="news")
+        content = response.content.strip().lower()  # Normalize the country codes (convert to lowercase)
+        log_prompt(logger, "LLM response: %s", content)
 
-        # Validate that the response is a valid 2-letter country code
-        if len(country) != 2 or not country.isalpha():
-            logger.warning("Invalid response from LLM")
-            return None  # Return a blank space if the response is invalid
-        return country
+        # Keep only valid 2-letter country codes
+        return _parse_countries(content)
 
     except Exception as e:
         # Log any exception that occurs during country extraction
         logger.exception("Error during country extraction")
-        return None  # Return 'None' as a default fallback
+        return []  # No countries as a default fallback
+
+async def aextract_countries_with_llm(text: str) -> list[str]:
+    """
+    Async version of `extract_countries_with_llm`, awaiting the model with `ainvoke`.
+
+    Parameters:
+    text (str): The input text containing country mentions.
+
+    Returns:
+    list[str]: The ISO 3166-1 alpha-2 country codes extracted from the text (empty if extraction fails).
+    """
+    try:
+        # Format the prompt with the provided text
+        prompt = country_extraction_prompt.format(text=text)
+        log_prompt(logger, "Prompt sent to LLM: %s", prompt)
+
+        # Await the response from the LLM
+        response = await ainvoke_cached(get_llm("news"), [HumanMessage(content=prompt)], node="news")
+        content = response.content.strip().lower()  # Normalize the country codes (convert to lowercase)
+        log_prompt(logger, "LLM response: %s", content)
+
+        # Keep only valid 2-letter country codes
+        return _parse_countries(content)
+
+    except Exception as e:
+        # Log any exception that occurs during country extraction
+        logger.exception("Error during country extraction")
+        return []  # No countries as a default fallback
+
+# ----- Helpers shared by the sync and async news nodes -----
+def _missing_api_key_update() -> dict:
+    """
+    State update returned when the News API key is not configured.
+    """
+    msg = "News API Key is not configured."
+    logger.error(msg)
+    return {
+            "error": {"news": msg},
+           "task_completed": {"news": False}
+    }
+
+def _missing_country_update() -> dict:
+    """
+    State update returned when no country could be detected in the message.
+    """
+    msg = "Country could not be identified in the message."
+    logger.warning(msg)
+    return {
+        "error": {"news": msg},
+        "task_completed": {"news": False}
+    }
+
+def _build_news_update(country_code: str, response) -> dict:
+    """
+    Turns the News API response into the state update for the news task.
+
+    Parameters:
+    country_code (str): The ISO 3166-1 alpha-2 code that was queried.
+    response: The httpx response from newsapi.org.
+
+    Returns:
+    dict: A dictionary containing the news headlines or error information.
+    """
+    # Handle non-200 HTTP responses from the News API
+    if response.status_code != 200:
+        msg = f"Error in News API: {response.status_code}"
+        logger.error(msg)
+        return {
+            "error": {"news": msg},
+            "task_completed": {"news": False}
+        }
+
+    # Parse the JSON response from the News API
+    data = response.json()
+
+    # Check if the 'articles' key exists in the response and has data
+    if "articles" not in data or not data["articles"]:
+        msg = f"No news found for {country_code}."
+        logger.warning(msg)
+        return {
+            "error": {"news": msg},
+            "task_completed": {"news": False}
+               }
+
+    # Extract the titles of the top 3 articles from the response
+    titles = ", ".join([article["title"] for article in data["articles"][:3]])
+    headlines = f"Headlines in {country_code.upper()}: {titles}"
+
+    logger.info("Found headlines: %s", headlines)
+
+    # Return the news headlines as a dictionary
+    return {"results": {"news": [headlines]},
+            "task_completed": {"news": True}
+}
+
+def _news_error_update(e: Exception) -> dict:
+    """
+    State update returned when an unexpected exception interrupts the news task.
+    """
+    logger.exception("Unexpected error while fetching news")
+    return {
+        "error": {"news": f"Error fetching news: {str(e)}"},
+        "task_completed": {"news" : False}
+        }
+
+def _combine_news(updates: list[dict]) -> dict:
+    """
+    Merges the per-country updates into one update for the news task. The errors of the
+    countries that failed are listed after the headlines; the task fails only if every country did.
+    """
+    headlines = [update["results"]["news"][0] for update in updates if "results" in update]
+    if not headlines:
+        return updates[0]
+    failures = [update["error"]["news"] for update in updates if "error" in update]
+    return {
+        "results": {"news": headlines + failures},
+        "task_completed": {"news": True}
+    }
+
+def _news_url(country_code: str, api_key: str) -> str:
+    return NEWS_URL.format(country_code=country_code, api_key=api_key)
+
+def _country_news(country_code: str, api_key: str) -> dict:
+    """
+    Headlines of one country, from the cache or the News API.
+    """
+    def load_headlines():
+        url = _news_url(country_code, api_key)
+        logger.debug("Querying News API: %s", url)
+        return _build_news_update(country_code, http_get(url))
+
+    return news_cache.get_or_load(normalize_key(country_code), load_headlines)
+
+async def _acountry_news(country_code: str, api_key: str) -> dict:
+    """
+    Async version of `_country_news`.
+    """
+    async def load_headlines():
+        url = _news_url(country_code, api_key)
+        logger.debug("Querying News API: %s", url)
+        return _build_news_update(country_code, await ahttp_get(url))
+
+    return await news_cache.aget_or_load(normalize_key(country_code), load_headlines)
+
+def _planned_countries(state: AgentState) -> Optional[list[str]]:
+    """
+    Country codes extracted by the planner, or None if the planner did not run.
+    """
+    entities = state.get("entities") or {}
+    if "countries" not in entities:
+        return None
+    return list(entities["countries"] or [])
+
+def _cached_news(state: AgentState) -> Optional[str]:
+    """
+    Last cached headlines for the query's countries, resolved without calling the LLM or the API.
+    Used when the news task misses its deadline.
+    """
+    countries = _planned_countries(state)
+    if countries is None:
+        countries = gazetteer.match_countries(state["messages"][-1].content)
+    headlines = []
+    for country_code in countries:
+        cached = news_cache.peek(normalize_key(country_code))
+        if cached and "results" in cached[0]:
+            headlines.append(cached[0]["results"]["news"][0])
+    return " ".join(headlines) or None
+
+def refresh_news(country_code: str) -> None:
+    """
+    Fetches the headlines for `country_code` now and stores them in the cache (used by the prefetcher).
+    """
+    api_key = os.getenv("NEWS_API_KEY")
+    if not api_key:
+        return
+    url = _news_url(country_code, api_key)
+    news_cache.refresh(normalize_key(country_code), lambda: _build_news_update(country_code, http_get(url)))
 
 # ----- News fetching function -----
+@record_history("task_news")
+@with_deadline("news", _cached_news, upstream="newsapi")
 def get_news(state: AgentState) -> AgentState:
     """
-    Processes the input text to detect the country and fetches news headlines for that country.
+    Processes the input text to detect the countries and fetches news headlines for each of them.
+    Several countries are fetched concurrently, one News API call per country not in the cache.
 
     Parameters:
     input_text (str): The input text containing user query or message.
@@ -82,69 +307,91 @@ def get_news(state: AgentState) -> AgentState:
     Returns:
     dict: A dictionary containing the news headlines or error information.
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_news")
     
     # Get the input text from the state (the user's message)
     input_text = state["messages"][-1].content
     try:
-        logger.info(f"Processing user message: {input_text}")
+        logger.info("Processing user message: %s", input_text)
 
-        # Extract the country code from the user's message
-        country_code = extract_country_with_llm(input_text)
-        logger.info(f"Detected country code: {country_code}")
+        # The planner may have already extracted the country codes; then the extraction call is skipped
+        countries = _planned_countries(state)
+        if countries is None:
+            # Known countries resolve locally; the LLM is only asked when there is no confident match
+            countries = gazetteer.match_countries(input_text, strict=True) or extract_countries_with_llm(input_text)
+        logger.info("Detected country codes: %s", countries)
+        if not countries:
+            return _missing_country_update()
+        for country_code in countries:
+            popularity.record("news", normalize_key(country_code), country_code)
 
         # Retrieve the News API key from the environment variables
         api_key = os.getenv("NEWS_API_KEY")
         if not api_key:
-            msg = "News API Key is not configured."
-            logger.error(msg)
-            return {
-                    "error": {"news": msg},
-                   "task_completed": {"news": False}
-            }
-
-        # Construct the API URL to get news headlines for the detected country
-        url = f"https://newsapi.org/v2/top-headlines?country={country_code}&apiKey={api_key}"
-        logger.debug(f"Querying News API: {url}")
-        response = requests.get(url)
-
-        # Handle non-200 HTTP responses from the News API
-        if response.status_code != 200:
-            msg = f"Error in News API: {response.status_code}"
-            logger.error(msg)
-            return {
-                "error": {"news": msg},
-                "task_completed": {"news": False}
-            }
-
-        # Parse the JSON response from the News API
-        data = response.json()
-
-        # Check if the 'articles' key exists in the response and has data
-        if "articles" not in data or not data["articles"]:
-            msg = f"No news found for {country_code}."
-            logger.warning(msg)
-            return {
-                "error": {"news": msg},
-                "task_completed": {"news": False}
-                   }
-
-        # Extract the titles of the top 3 articles from the response
-        titles = ", ".join([article["title"] for article in data["articles"][:3]])
-        headlines = f"Headlines in {country_code.upper()}: {titles}"
-
-        logger.info(f"Found headlines: {headlines}")
-
-        # Return the news headlines as a dictionary
-        return {"results": {"news": [headlines]},
-                "task_completed": {"news": True}
-}
+            return _missing_api_key_update()
+
+        if len(countries) == 1:
+            return _country_news(countries[0], api_key)
+
+        # One thread per country; each carries the logging and metrics context of the request
+        futures = [
+            _fanout.submit(contextvars.copy_context().run, _country_news, country_code, api_key)
+            for country_code in countries
+        ]
+        return _combine_news([future.result() for future in futures])
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
 
     except Exception as e:
         # Handle any unexpected errors during the news retrieval process
-        logger.exception("Unexpected error while fetching news")
-        return {
-            "error": {"news": f"Error fetching news: {str(e)}"},
-            "task_completed": {"news" : False}
-            }
+        return _news_error_update(e)
+
+# ----- Async news fetching function -----
+@record_history("task_news")
+@with_deadline("news", _cached_news, upstream="newsapi")
+async def aget_news(state: AgentState) -> AgentState:
+    """
+    Async version of `get_news`. The country extraction is awaited with `ainvoke` and the
+    News API is queried through the pooled async client, one concurrent call per country, so
+    this node runs concurrently with the other agents under `app.ainvoke`.
+
+    Parameters:
+    state (AgentState): The current state, whose last message is the user's query.
+
+    Returns:
+    dict: A dictionary containing the news headlines or error information.
+    """
+
+    # Get the input text from the state (the user's message)
+    input_text = state["messages"][-1].content
+    try:
+        logger.info("Processing user message: %s", input_text)
+
+        # The planner may have already extracted the country codes; then the extraction call is skipped
+        countries = _planned_countries(state)
+        if countries is None:
+            # Known countries resolve locally; the LLM is only asked when there is no confident match
+            countries = gazetteer.match_countries(input_text, strict=True) or await aextract_countries_with_llm(input_text)
+        logger.info("Detected country codes: %s", countries)
+        if not countries:
+            return _missing_country_update()
+        for country_code in countries:
+            popularity.record("news", normalize_key(country_code), country_code)
+
+        # Retrieve the News API key from the environment variables
+        api_key = os.getenv("NEWS_API_KEY")
+        if not api_key:
+            return _missing_api_key_update()
+
+        if len(countries) == 1:
+            return await _acountry_news(countries[0], api_key)
+
+        updates = await asyncio.gather(*(_acountry_news(country_code, api_key) for country_code in countries))
+        return _combine_news(list(updates))
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
+
+    except Exception as e:
+        # Handle any unexpected errors during the news retrieval process
+        return _news_error_update(e)
@@ -1,145 +1,442 @@
 
-from dotenv import load_dotenv
 import os
-import requests
-import logging
+import asyncio
 from typing import Optional
-from langchain_core.messages import BaseMessage, HumanMessage
-from langgraph.graph.message import add_messages
-from langchain.prompts import PromptTemplate
-from langchain_openai import ChatOpenAI
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import PromptTemplate
 from core.agent_state import AgentState
+from core.instrumentation import record_history
+from core.deadline import with_deadline
+from utils.circuit_breaker import CircuitOpenError
+from core.llm import get_llm
+from utils.gazetteer import gazetteer
+from utils.popularity import popularity
+from utils.http_client import http_get, ahttp_get
+from utils.response_cache import ResponseCache, normalize_key
 
+from utils.llm_cache import invoke_cached, ainvoke_cached
 from utils.logging import setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Load environment variables -----
-load_dotenv(dotenv_path='env')
-
-# Global LLM instance
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 # ----- Prompt Template -----
 city_extraction_template = """
-Eres un asistente que extrae el nombre de la ciudad en inglés americano del siguiente texto. 
-Responde solo con el nombre de la ciudad, sin comillas ni símbolos extra.
+Eres un asistente que extrae los nombres de las ciudades en inglés americano del siguiente texto. 
+Responde solo con los nombres de las ciudades separados por coma, sin comillas ni símbolos extra.
 
 Ejemplo:
 Texto: "¿Cómo está el clima en Nueva York?" -> New York
+Texto: "Clima en Madrid, Roma y Londres" -> Madrid, Rome, London
 Texto: "{text}"
 """
 
 city_extraction_prompt = PromptTemplate(input_variables=["text"], template=city_extraction_template)
 
+# ----- OpenWeatherMap endpoint -----
+# Overridable to point the agent at a stand-in (see benchmarks/e2e.py)
+WEATHER_URL = os.getenv("WEATHER_URL", "https://api.openweathermap.org/data/2.5/weather")
+# Current weather for several city IDs in one call (at most WEATHER_GROUP_MAX_IDS per call)
+WEATHER_GROUP_URL = os.getenv("WEATHER_GROUP_URL", "https://api.openweathermap.org/data/2.5/group")
+WEATHER_GROUP_MAX_IDS = 20
+
+# ----- Weather response cache -----
+# Reports are keyed by normalized city name; only successful reports are cached.
+weather_cache = ResponseCache(
+    "weather",
+    ttl=float(os.getenv("WEATHER_CACHE_TTL", "600")),
+    stale_ttl=float(os.getenv("WEATHER_CACHE_STALE_TTL", "300")),
+    max_entries=int(os.getenv("WEATHER_CACHE_MAX_ENTRIES", "2048")),
+    max_bytes=int(os.getenv("WEATHER_CACHE_MAX_BYTES", "1000000")),
+    cache_if=lambda update: "results" in update,
+)
+
 # ----- LLM-based city extractor -----
-def extract_city_with_llm(text: str) -> Optional[str]:
+def _validate_city(city: str) -> Optional[str]:
     """
-    Extracts the name of the city from the given text using a language model.
+    Validates the raw city name returned by the language model.
 
     Args:
-    - text (str): The input text that may contain a city name.
+    - city (str): The stripped model response.
 
     Returns:
-    - str or None: Returns the city name if successfully extracted, otherwise None.
+    - str or None: The city name if it looks valid, otherwise None.
     """
-    logger.debug(f"Extracting city from text: '{text}'")
+    if not city or len(city) < 2 or any(c in city for c in ['{', '}', '[', ']']):
+        logger.warning("Invalid city detected: '%s'", city)
+        return None
+
+    return city
+
+def _parse_cities(content: str) -> list[str]:
+    """
+    Splits the model's comma-separated answer into valid, distinct city names.
+    """
+    cities = []
+    for part in content.split(","):
+        city = _validate_city(part.strip())
+        if city and city not in cities:
+            cities.append(city)
+    return cities
+
+def extract_cities_with_llm(text: str) -> list[str]:
+    """
+    Extracts the names of the cities in the given text using a language model.
+
+    Args:
+    - text (str): The input text that may contain city names.
+
+    Returns:
+    - list[str]: The city names in order of appearance (empty if none could be extracted).
+    """
+    logger.debug("Extracting cities from text: '%s'", text)
     prompt = city_extraction_prompt.format(text=text)
 
     try:
-        response = llm.invoke([HumanMessage(content=prompt)])
-        city = response.content.strip()
-        logger.info(f"City extracted: '{city}'")
+        response = invoke_cached(get_llm("weather"), [HumanMessage(content=prompt)], node="weather")
+        content = response.content.strip()
+        logger.info("Cities extracted: '%s'", content)
     except Exception as e:
         logger.exception("Error invoking the model for city extraction.")
-        return None
+        return []
 
-    if not city or len(city) < 2 or any(c in city for c in ['{', '}', '[', ']']):
-        logger.warning(f"Invalid city detected: '{city}'")
+    return _parse_cities(content)
+
+async def aextract_cities_with_llm(text: str) -> list[str]:
+    """
+    Async version of `extract_cities_with_llm`, awaiting the model with `ainvoke`.
+
+    Args:
+    - text (str): The input text that may contain city names.
+
+    Returns:
+    - list[str]: The city names in order of appearance (empty if none could be extracted).
+    """
+    logger.debug("Extracting cities from text: '%s'", text)
+    prompt = city_extraction_prompt.format(text=text)
+
+    try:
+        response = await ainvoke_cached(get_llm("weather"), [HumanMessage(content=prompt)], node="weather")
+        content = response.content.strip()
+        logger.info("Cities extracted: '%s'", content)
+    except Exception as e:
+        logger.exception("Error invoking the model for city extraction.")
+        return []
+
+    return _parse_cities(content)
+
+# ----- Weather report helpers -----
+def _weather_error(msg: str) -> AgentState:
+    """
+    Builds the state update returned when the weather task fails.
+    """
+    return {
+        "error": {"weather": msg},
+        "task_completed": {"weather": False}
+    }
+
+def _weather_params(city: str, api_key: str) -> dict:
+    """
+    Builds the OpenWeatherMap query parameters for a city.
+    """
+    return {
+        "q": city,
+        "appid": api_key,
+        "units": "metric"
+    }
+
+def _group_params(city_ids: list[int], api_key: str) -> dict:
+    """
+    Builds the OpenWeatherMap group query parameters for several city IDs.
+    """
+    return {
+        "id": ",".join(str(city_id) for city_id in city_ids),
+        "appid": api_key,
+        "units": "metric"
+    }
+
+def _report_update(city: str, location_data: dict) -> AgentState:
+    """
+    Turns one OpenWeatherMap current-weather payload into the state update for the weather task.
+    """
+    try:
+        weather_desc = location_data["weather"][0]["description"]
+        temperature = location_data["main"]["temp"]
+    except (KeyError, IndexError, TypeError) as e:
+        msg = "Unexpected weather data format received from API."
+        logger.exception(msg)
+        return _weather_error(msg)
+
+    weather_report = f"The weather in {city} is {weather_desc} with a temperature of {temperature}°C."
+    logger.info("Generated weather report: %s", weather_report)
+
+    return {
+        "results": {"weather": [weather_report]},
+        "task_completed": {"weather": True}
+    }
+
+def _build_weather_update(city: str, location_response) -> AgentState:
+    """
+    Turns the OpenWeatherMap HTTP response into the state update for the weather task.
+
+    Args:
+    - city (str): The city that was queried.
+    - location_response: The httpx response from OpenWeatherMap.
+
+    Returns:
+    - AgentState: Either 'results' with the weather report or 'error' with the reason.
+    """
+    if location_response.status_code != 200:
+        msg = f"City '{city}' not found or not correctly written in English."
+        logger.warning(msg)
+        return _weather_error(msg)
+
+    return _report_update(city, location_response.json())
+
+def _build_group_updates(keys_by_id: dict[int, dict[str, str]], group_response) -> dict[str, AgentState]:
+    """
+    Splits an OpenWeatherMap group response into one state update per cache key. Several keys
+    may share a city ID (e.g. "Bogotá" and "Bogota"); each gets the report under its own spelling.
+    """
+    if group_response.status_code != 200:
+        msg = f"Weather API error: {group_response.status_code}"
+        logger.error(msg)
+        return {key: _weather_error(msg) for cities in keys_by_id.values() for key in cities}
+
+    entries = {entry.get("id"): entry for entry in group_response.json().get("list", []) if isinstance(entry, dict)}
+    updates = {}
+    for city_id, cities in keys_by_id.items():
+        for key, city in cities.items():
+            if city_id in entries:
+                updates[key] = _report_update(city, entries[city_id])
+            else:
+                msg = f"City '{city}' not found or not correctly written in English."
+                logger.warning(msg)
+                updates[key] = _weather_error(msg)
+    return updates
+
+def _split_by_id(cities_by_key: dict[str, str]) -> tuple[list[dict[int, dict[str, str]]], dict[str, str]]:
+    """
+    Separates the cities the gazetteer knows an OpenWeatherMap ID for (grouped as
+    {city ID: {cache key: city}}, in chunks of at most WEATHER_GROUP_MAX_IDS IDs, one group
+    call each) from those that must be queried by name.
+    """
+    chunks, by_name, current = [], {}, {}
+    for key, city in cities_by_key.items():
+        city_id = gazetteer.city_id(city)
+        if city_id is None:
+            by_name[key] = city
+            continue
+        if city_id not in current and len(current) == WEATHER_GROUP_MAX_IDS:
+            chunks.append(current)
+            current = {}
+        current.setdefault(city_id, {})[key] = city
+    if current:
+        chunks.append(current)
+    return chunks, by_name
+
+def _load_weather(cities_by_key: dict[str, str], api_key: str) -> dict[str, AgentState]:
+    """
+    Fetches the reports of several cities: one group call per chunk of known IDs and one
+    call per city without an ID. Returns {cache key: state update}.
+    """
+    chunks, by_name = _split_by_id(cities_by_key)
+    updates = {}
+    for chunk in chunks:
+        response = http_get(WEATHER_GROUP_URL, params=_group_params(list(chunk), api_key))
+        updates.update(_build_group_updates(chunk, response))
+    for key, city in by_name.items():
+        updates[key] = _build_weather_update(city, http_get(WEATHER_URL, params=_weather_params(city, api_key)))
+    return updates
+
+async def _aload_weather(cities_by_key: dict[str, str], api_key: str) -> dict[str, AgentState]:
+    """
+    Async version of `_load_weather`; the group and by-name calls run concurrently.
+    """
+    chunks, by_name = _split_by_id(cities_by_key)
+    group_responses, name_responses = await asyncio.gather(
+        asyncio.gather(*(ahttp_get(WEATHER_GROUP_URL, params=_group_params(list(chunk), api_key)) for chunk in chunks)),
+        asyncio.gather(*(ahttp_get(WEATHER_URL, params=_weather_params(city, api_key)) for city in by_name.values())),
+    )
+    updates = {}
+    for chunk, response in zip(chunks, group_responses):
+        updates.update(_build_group_updates(chunk, response))
+    for (key, city), response in zip(by_name.items(), name_responses):
+        updates[key] = _build_weather_update(city, response)
+    return updates
+
+def _combine_weather(updates: list[AgentState]) -> AgentState:
+    """
+    Merges the per-city updates into one update for the weather task. The errors of the
+    cities that failed are listed after the reports; the task fails only if every city did.
+    """
+    reports = [update["results"]["weather"][0] for update in updates if "results" in update]
+    if not reports:
+        return updates[0]
+    failures = [update["error"]["weather"] for update in updates if "error" in update]
+    return {
+        "results": {"weather": reports + failures},
+        "task_completed": {"weather": True}
+    }
+
+def _planned_cities(state: AgentState) -> Optional[list[str]]:
+    """
+    Cities extracted by the planner, or None if the planner did not run.
+    """
+    entities = state.get("entities") or {}
+    if "cities" not in entities:
         return None
+    return [city for city in map(_validate_city, entities["cities"] or []) if city]
 
-    return city
+def _cached_weather(state: AgentState) -> Optional[str]:
+    """
+    Last cached reports for the query's cities, resolved without calling the LLM or the API.
+    Used when the weather task misses its deadline.
+    """
+    cities = _planned_cities(state)
+    if cities is None:
+        cities = gazetteer.match_cities(state["messages"][-1].content)
+    reports = []
+    for city in cities:
+        cached = weather_cache.peek(normalize_key(city))
+        if cached and "results" in cached[0]:
+            reports.append(cached[0]["results"]["weather"][0])
+    return " ".join(reports) or None
+
+def refresh_weather(city: str) -> None:
+    """
+    Fetches the report for `city` now and stores it in the cache (used by the prefetcher).
+    """
+    api_key = os.getenv("OPENWEATHER_API_KEY")
+    if not api_key:
+        return
+    weather_cache.refresh(
+        normalize_key(city),
+        lambda: _build_weather_update(city, http_get(WEATHER_URL, params=_weather_params(city, api_key)))
+    )
 
 # ----- Weather Node -----
+@record_history("task_weather")
+@with_deadline("weather", _cached_weather, upstream="openweathermap")
 def get_weather(state: AgentState) -> AgentState:
     """
-    Handles weather-related queries using an LLM to extract the city and the OpenWeatherMap API to fetch weather data.
+    Handles weather-related queries using an LLM to extract the cities and the OpenWeatherMap API to fetch weather data.
+    A single city is queried by name; several cities share one group call by city ID.
 
     Returns:
-    - 'results': If successful, a dictionary with the weather report.
+    - 'results': If successful, a dictionary with one weather report per city.
     - 'error': If an issue occurs, a dictionary with the error message.
     - 'task_completed': A boolean flag indicating if the task was completed.
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_weather")
 
     try:
         input_text = state["messages"][-1].content
-        logger.debug(f"Received weather message: '{input_text}'")
+        logger.debug("Received weather message: '%s'", input_text)
 
-        city = extract_city_with_llm(input_text)
-        logger.debug(f"Respose llm: '{city}'")
+        # The planner may have already extracted the cities; then the extraction call is skipped
+        cities = _planned_cities(state)
+        if cities is None:
+            # Known cities resolve locally; the LLM is only asked when there is no confident match
+            cities = gazetteer.match_cities(input_text, strict=True) or extract_cities_with_llm(input_text)
+        logger.debug("Cities to query: '%s'", cities)
 
-        if not city:
+        if not cities:
             msg = "City could not be identified in the message."
             logger.warning(msg)
-            return {
-                "error": {"weather": msg},
-                "task_completed": {"weather": False}
-            }
+            return _weather_error(msg)
+        for city in cities:
+            popularity.record("weather", normalize_key(city), city)
 
         api_key = os.getenv("OPENWEATHER_API_KEY")
         if not api_key:
             msg = "API Key not configured in the system."
             logger.error(msg)
-            return {
-                "error": {"weather": msg},
-                "task_completed": {"weather": False}
-            }
-
-        logger.info(f"Fetching weather for: {city}")
-        location_url = "https://api.openweathermap.org/data/2.5/weather"
-        params = {
-            "q": city,
-            "appid": api_key,
-            "units": "metric"
-        }
-        location_response = requests.get(location_url, params=params)
-
-        if location_response.status_code != 200:
-            msg = f"City '{city}' not found or not correctly written in English."
+            return _weather_error(msg)
+
+        logger.info("Fetching weather for: %s", ", ".join(cities))
+        if len(cities) == 1:
+            city = cities[0]
+            return weather_cache.get_or_load(
+                normalize_key(city),
+                lambda: _build_weather_update(city, http_get(WEATHER_URL, params=_weather_params(city, api_key)))
+            )
+
+        cities_by_key = {normalize_key(city): city for city in cities}
+        updates = weather_cache.get_many_or_load(
+            list(cities_by_key),
+            lambda missing: _load_weather({key: cities_by_key[key] for key in missing}, api_key)
+        )
+        return _combine_weather([updates[key] for key in cities_by_key])
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
+
+    except Exception as e:
+        msg = f"Error obtaining weather: {str(e)}"
+        logger.exception(msg)
+        return _weather_error(msg)
+
+# ----- Async Weather Node -----
+@record_history("task_weather")
+@with_deadline("weather", _cached_weather, upstream="openweathermap")
+async def aget_weather(state: AgentState) -> AgentState:
+    """
+    Async version of `get_weather`. The city extraction is awaited with `ainvoke` and the
+    OpenWeatherMap calls go through the pooled async client, so LangGraph can run this node
+    concurrently with the other agents under `app.ainvoke`.
+
+    Returns:
+    - 'results': If successful, a dictionary with one weather report per city.
+    - 'error': If an issue occurs, a dictionary with the error message.
+    - 'task_completed': A boolean flag indicating if the task was completed.
+    """
+
+    try:
+        input_text = state["messages"][-1].content
+        logger.debug("Received weather message: '%s'", input_text)
+
+        # The planner may have already extracted the cities; then the extraction call is skipped
+        cities = _planned_cities(state)
+        if cities is None:
+            # Known cities resolve locally; the LLM is only asked when there is no confident match
+            cities = gazetteer.match_cities(input_text, strict=True) or await aextract_cities_with_llm(input_text)
+        logger.debug("Cities to query: '%s'", cities)
+
+        if not cities:
+            msg = "City could not be identified in the message."
             logger.warning(msg)
-            return {
-                "error": {"weather": msg},
-                "task_completed": {"weather": False}
-            }
-
-        location_data = location_response.json()
-
-        try:
-            weather_desc = location_data["weather"][0]["description"]
-            temperature = location_data["main"]["temp"]
-        except (KeyError, IndexError, TypeError) as e:
-            msg = "Unexpected weather data format received from API."
-            logger.exception(msg)
-            return {
-                "error": {"weather": msg},
-                "task_completed": {"weather": False}
-            }
-
-        weather_report = f"The weather in {city} is {weather_desc} with a temperature of {temperature}°C."
-        logger.info(f"Generated weather report: {weather_report}")
-
-        return {
-            "results": {"weather": [weather_report]},
-            "task_completed": {"weather": True}
-        }
+            return _weather_error(msg)
+        for city in cities:
+            popularity.record("weather", normalize_key(city), city)
+
+        api_key = os.getenv("OPENWEATHER_API_KEY")
+        if not api_key:
+            msg = "API Key not configured in the system."
+            logger.error(msg)
+            return _weather_error(msg)
+
+        logger.info("Fetching weather for: %s", ", ".join(cities))
+        if len(cities) == 1:
+            city = cities[0]
+
+            async def load_report():
+                location_response = await ahttp_get(WEATHER_URL, params=_weather_params(city, api_key))
+                return _build_weather_update(city, location_response)
+
+            return await weather_cache.aget_or_load(normalize_key(city), load_report)
+
+        cities_by_key = {normalize_key(city): city for city in cities}
+
+        async def load_reports(missing: list[str]):
+            return await _aload_weather({key: cities_by_key[key] for key in missing}, api_key)
+
+        updates = await weather_cache.aget_many_or_load(list(cities_by_key), load_reports)
+        return _combine_weather([updates[key] for key in cities_by_key])
+
+    except CircuitOpenError:
+        raise  # with_deadline responds without the error handler
 
     except Exception as e:
         msg = f"Error obtaining weather: {str(e)}"
         logger.exception(msg)
-        return {
-            "error": {"weather": msg},
-            "task_completed": {"weather": False}
-        }
+        return _weather_error(msg)
@@ -0,0 +1,227 @@
+
+"""
+HTTP routes of the query service.
+
+    GET  /query?q=...&budget=...     -> text/event-stream
+    POST /query {"query": ..., "budget": ...}
+    GET  /health
+    GET  /metrics                    -> Prometheus text format
+
+A query is answered as a stream of Server-Sent Events: `start`, one `result` per task as soon
+as its agent finishes (the fastest branch first), `token` for each fragment of the rewritten
+answer as the aggregator generates it and `section` when a task's part is complete, then
+`answer` with the aggregated text, or `error` if the query failed.
+"""
+
+import os
+import json
+import time
+import asyncio
+from typing import Any, AsyncIterator, Optional
+
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from core import engine
+from utils.logging import setup_logging
+from utils.metrics import render_prometheus
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "64"))  # Queries in flight per process
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "2.0"))  # Max wait for a free slot before 503
+API_MAX_QUERY_CHARS = int(os.getenv("API_MAX_QUERY_CHARS", "2000"))
+
+
+# ----- Concurrency gate -----
+class QuerySlot:
+    """
+    Hueco de una consulta en el `QueryGate`. `release()` se puede llamar varias veces
+    (desde el generador de eventos y al terminar la respuesta); solo la primera libera.
+    """
+
+    def __init__(self, gate: "QueryGate"):
+        self._gate = gate
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self._gate._release()
+
+
+class QueryGate:
+    """
+    Limita las consultas en curso. Una petición espera a lo sumo `queue_timeout` segundos
+    por un hueco; si no lo consigue (o el servidor se está apagando) se rechaza con 503.
+    """
+
+    def __init__(self, limit: int = API_MAX_CONCURRENCY, queue_timeout: float = API_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.rejected = 0
+        self.draining = False
+        self._semaphore = asyncio.Semaphore(limit)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def acquire(self) -> Optional[QuerySlot]:
+        """
+        Devuelve el hueco de la consulta, o None si hay que responder 503.
+        """
+        if self.draining:
+            self.rejected += 1
+            return None
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return None
+        self.in_flight += 1
+        self._idle.clear()
+        return QuerySlot(self)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+        if self.in_flight == 0:
+            self._idle.set()
+
+    def drain(self) -> None:
+        """
+        Deja de aceptar consultas nuevas; las que están en curso siguen hasta terminar.
+        """
+        self.draining = True
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """
+        Espera a que terminen las consultas en curso. Devuelve False si vence el plazo.
+        """
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "limit": self.limit,
+            "rejected": self.rejected,
+            "draining": self.draining,
+        }
+
+
+# ----- Server-Sent Events -----
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def _events(
+    slot: QuerySlot, query: str, request_id: str, budget: Optional[float]
+) -> AsyncIterator[str]:
+    start = time.perf_counter()
+    try:
+        yield sse("start", {"request_id": request_id, "query": query})
+        async for event in engine.astream(query, request_id=request_id, budget=budget):
+            event_type = event.pop("type")
+            event["elapsed"] = round(time.perf_counter() - start, 4)
+            yield sse(event_type, event)
+    except Exception as e:
+        logger.exception("Fallo la consulta en streaming")
+        yield sse("error", {"error": f"{type(e).__name__}: {e}"})
+    finally:
+        # También si el cliente se desconecta: engine.astream cancela el grafo al cerrarse
+        slot.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse que libera el hueco de la consulta termine como termine la respuesta.
+    El `finally` del generador no corre si este nunca arranca (p. ej. el envío de las
+    cabeceras falla porque el cliente ya se fue), y Starlette tampoco ejecuta `background`
+    cuando el envío lanza una excepción.
+    """
+
+    def __init__(self, slot: QuerySlot, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.release()
+
+
+# ----- Handlers -----
+def _parse_budget(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    budget = float(value)
+    if budget < 0:
+        raise ValueError("budget must be >= 0")
+    return budget
+
+
+async def query(request: Request) -> Response:
+    if request.method == "POST":
+        try:
+            body = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return JSONResponse({"error": "body must be JSON"}, status_code=400)
+        if not isinstance(body, dict):
+            return JSONResponse({"error": "body must be a JSON object"}, status_code=400)
+        text, budget = body.get("query"), body.get("budget")
+    else:
+        text, budget = request.query_params.get("q"), request.query_params.get("budget")
+
+    if not isinstance(text, str) or not text.strip():
+        return JSONResponse({"error": "missing query"}, status_code=400)
+    if len(text) > API_MAX_QUERY_CHARS:
+        return JSONResponse({"error": f"query longer than {API_MAX_QUERY_CHARS} characters"}, status_code=400)
+    try:
+        budget = _parse_budget(budget)
+    except (TypeError, ValueError):
+        return JSONResponse({"error": "budget must be a non-negative number"}, status_code=400)
+
+    gate: QueryGate = request.app.state.gate
+    slot = await gate.acquire()
+    if slot is None:
+        return JSONResponse(
+            {"error": "server busy" if not gate.draining else "server shutting down"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+
+    # Se fija aquí para que el evento `start` y los logs del motor lleven el mismo ID
+    request_id = engine.ensure_request_id(request.headers.get("x-request-id"))
+    return SlotStreamingResponse(
+        slot,
+        _events(slot, text, request_id, budget),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def health(request: Request) -> Response:
+    gate: QueryGate = request.app.state.gate
+    return JSONResponse(
+        {"status": "draining" if gate.draining else "ok", **gate.stats()},
+        status_code=503 if gate.draining else 200,
+    )
+
+
+async def metrics(request: Request) -> Response:
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+routes = [
+    Route("/query", query, methods=["GET", "POST"]),
+    Route("/health", health, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+]
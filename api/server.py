@@ -0,0 +1,83 @@
+
+"""
+ASGI service in front of the compiled async graph.
+
+Usage:
+    python -m api.server
+    uvicorn api.server:app --host 0.0.0.0 --port 8000
+
+On startup the graph is compiled once (and the prefetcher started if API_PREFETCH is set).
+With `python -m api.server` the gate starts draining as soon as the shutdown signal arrives:
+new queries get 503 while uvicorn gives the ones in flight API_SHUTDOWN_GRACE seconds to finish.
+The lifespan shutdown then closes the prefetcher and the pooled HTTP clients.
+"""
+
+import os
+from contextlib import asynccontextmanager
+
+from core import env  # noqa: F401  (loads the env file before the settings below are read)
+
+from starlette.applications import Starlette
+
+from api.routes import QueryGate, routes
+from core import engine
+from core.prefetch import start_prefetcher, stop_prefetcher
+from utils.http_client import aclose_clients, close_clients
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_SHUTDOWN_GRACE = float(os.getenv("API_SHUTDOWN_GRACE", "10"))  # Seconds for in-flight queries on shutdown
+API_PREFETCH = os.getenv("API_PREFETCH", "false").lower() == "true"
+API_PREFETCH_SEED = os.getenv("API_PREFETCH_SEED")  # Optional query log to seed popularity
+
+
+@asynccontextmanager
+async def lifespan(app: Starlette):
+    app.state.gate = QueryGate()
+    engine.get_app(use_async=True, stream_answer=True)  # Compila antes de la primera petición
+    if API_PREFETCH:
+        start_prefetcher(API_PREFETCH_SEED)
+    logger.info("Servicio listo (máx. %s consultas en curso)", app.state.gate.limit)
+    try:
+        yield
+    finally:
+        # uvicorn ya esperó a las conexiones abiertas antes de llegar aquí; no se espera otra vez
+        gate: QueryGate = app.state.gate
+        gate.drain()
+        if gate.in_flight:
+            logger.warning("Apagado con %s consultas sin terminar", gate.in_flight)
+        stop_prefetcher()
+        await aclose_clients()
+        close_clients()
+        logger.info("Servicio detenido")
+
+
+def create_app() -> Starlette:
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+app = create_app()
+
+
+def main() -> None:
+    import uvicorn
+
+    class DrainingServer(uvicorn.Server):
+        # Drena con la señal, no en el lifespan: este corre después de la espera de uvicorn
+        def handle_exit(self, sig, frame) -> None:
+            gate = getattr(app.state, "gate", None)
+            if gate is not None:
+                gate.drain()
+            super().handle_exit(sig, frame)
+
+    config = uvicorn.Config(app, host=API_HOST, port=API_PORT, timeout_graceful_shutdown=API_SHUTDOWN_GRACE)
+    DrainingServer(config).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+
+"""
+Accuracy and latency of the task classifier on a labeled set of messages.
+
+Usage:
+    python -m benchmarks.classify_eval                # rules only (no network)
+    python -m benchmarks.classify_eval --llm          # rules vs LLM vs hybrid classify_tasks
+
+Each line of the evaluation file is {"text": ..., "weather": bool, "exchange": bool, "news": bool}.
+A prediction counts as correct only if all three labels match.
+"""
+
+import argparse
+import json
+import statistics
+import time
+from pathlib import Path
+
+from langchain_core.messages import HumanMessage
+
+from core.llm import get_llm
+from nodes.classify_query import RULES_MIN_CONFIDENCE, classify_tasks, classify_with_rules, system_prompt
+
+DEFAULT_EVAL_FILE = Path(__file__).parent / "data" / "classify_eval.jsonl"
+TASKS = ("weather", "exchange", "news")
+
+
+def load_examples(path: Path) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _matches(prediction: dict, example: dict) -> bool:
+    return all(bool(prediction.get(task)) == example[task] for task in TASKS)
+
+
+def _summary(name: str, correct: list[bool], latencies: list[float], extra: str = "") -> str:
+    accuracy = sum(correct) / len(correct) if correct else 0.0
+    ordered = sorted(latencies)
+    p95 = ordered[int(0.95 * (len(ordered) - 1))] if ordered else 0.0
+    mean = statistics.mean(latencies) if latencies else 0.0
+    return f"{name:<8} accuracy={accuracy:6.1%}  mean={mean * 1000:9.3f} ms  p95={p95 * 1000:9.3f} ms  {extra}"
+
+
+def evaluate_rules(examples: list[dict]) -> None:
+    correct, confident_correct, latencies = [], [], []
+    for example in examples:
+        start = time.perf_counter()
+        prediction, confidence = classify_with_rules(example["text"])
+        latencies.append(time.perf_counter() - start)
+        correct.append(_matches(prediction, example))
+        if confidence >= RULES_MIN_CONFIDENCE:
+            confident_correct.append(correct[-1])
+
+    coverage = len(confident_correct) / len(examples)
+    confident_accuracy = sum(confident_correct) / len(confident_correct) if confident_correct else 0.0
+    print(_summary("rules", correct, latencies,
+                   f"coverage={coverage:.1%}  accuracy_when_confident={confident_accuracy:.1%}"))
+
+
+def evaluate_llm(examples: list[dict]) -> None:
+    correct, latencies = [], []
+    llm = get_llm("classify")
+    for example in examples:
+        start = time.perf_counter()
+        try:
+            prediction = json.loads(llm.invoke([system_prompt, HumanMessage(content=example["text"])]).content)
+        except Exception:
+            prediction = {}
+        latencies.append(time.perf_counter() - start)
+        correct.append(_matches(prediction, example))
+    print(_summary("llm", correct, latencies))
+
+
+def evaluate_hybrid(examples: list[dict]) -> None:
+    correct, latencies = [], []
+    for example in examples:
+        start = time.perf_counter()
+        update = classify_tasks({"messages": [HumanMessage(content=example["text"])]})
+        latencies.append(time.perf_counter() - start)
+        correct.append(_matches(update.get("tasks_to_do", {}), example))
+    print(_summary("hybrid", correct, latencies))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--file", type=Path, default=DEFAULT_EVAL_FILE, help="Labeled JSONL evaluation set")
+    parser.add_argument("--llm", action="store_true", help="Also evaluate the LLM and the hybrid classify_tasks node")
+    args = parser.parse_args()
+
+    examples = load_examples(args.file)
+    print(f"{len(examples)} labeled messages from {args.file} (confidence threshold {RULES_MIN_CONFIDENCE})")
+    evaluate_rules(examples)
+    if args.llm:
+        evaluate_llm(examples)
+        evaluate_hybrid(examples)
+
+
+if __name__ == "__main__":
+    main()
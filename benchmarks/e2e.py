@@ -0,0 +1,368 @@
+"""
+Offline end-to-end benchmark of the full graph: plan -> agents -> error handler -> aggregator.
+
+Usage:
+    python -m benchmarks.e2e                                   # 200 queries per scenario and level
+    python -m benchmarks.e2e --requests 50 --concurrency 1 8 --llm-latency 0 --upstream-latency 0
+    python -m benchmarks.e2e --json e2e.json --max-p95-ms 500  # what CI runs
+
+Nothing leaves the machine. Every node gets `FakeChatModel`, a deterministic chat model that
+answers after `--llm-latency` ms (the plan is built with the gazetteer and the task lexicon,
+the aggregator echoes its sections). The agents call `UpstreamStandIn`, a local HTTP server
+that serves OpenWeatherMap, exchangerate-api and NewsAPI payloads after `--upstream-latency`
+ms, through WEATHER_URL / WEATHER_GROUP_URL / EXCHANGE_URL / NEWS_URL. With both latencies at 0 the numbers are
+the pipeline's own overhead.
+
+Scenarios:
+    single     one task per query (weather, exchange or news)
+    compound   weather + exchange + news in one query
+    multi      several cities, target currencies or countries in one query
+    error      unknown city (404), a single currency, a country without news
+
+The LLM cache is disabled, so every query makes all of its LLM calls. The weather, exchange
+and news caches stay on, as in production, and are emptied before each run. Queries run
+through `engine.arun` with at most `--concurrency` in flight. The exit code is 1 if a query
+ends up on the wrong path (an error in single/compound, none in error) or any p95 exceeds
+`--max-p95-ms`.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+from urllib.parse import parse_qs, urlparse
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+SCENARIOS = {
+    "single": [
+        "¿Qué clima hace en Madrid?",
+        "¿Cuánto vale un dólar en pesos mexicanos?",
+        "¿Cuántos pesos mexicanos por un dólar?",
+        "¿Qué noticias hay en Francia?",
+        "What's the weather like in London?",
+        "How much is a euro in dollars?",
+        "Latest news in Japan",
+    ],
+    "compound": [
+        "¿Cómo está el clima en Nueva York, cuánto vale el dólar en pesos mexicanos y qué noticias hay en Francia?",
+        "Weather in Tokyo, euro to yen and news from Germany",
+        "Clima en Buenos Aires, dólar a peso argentino y noticias de Argentina",
+    ],
+    "multi": [
+        "¿Qué clima hace en Madrid, París y Roma?",
+        "¿Cuánto vale un dólar en pesos mexicanos, euros y yenes?",
+        "¿Qué noticias hay en Francia, Alemania y Japón?",
+        "Weather in London and Tokyo, and news from Spain and Italy",
+    ],
+    "error": [
+        "¿Qué clima hace en Atlantis?",
+        "¿Cuánto vale el dólar?",
+        "¿Qué noticias hay en Portugal?",
+    ],
+}
+
+# ----- Local upstream stand-in -----
+# Rates per US dollar; other bases are derived from the same table
+USD_RATES = {"USD": 1.0, "EUR": 0.92, "MXN": 17.1, "GBP": 0.79, "JPY": 151.2, "ARS": 870.0, "CAD": 1.36}
+UNKNOWN_CITIES = {"atlantis"}
+COUNTRIES_WITHOUT_NEWS = {"pt"}
+
+
+def _city_names_by_id() -> dict[int, str]:
+    from utils.gazetteer import CITIES
+
+    return {city_id: city for city, (_, city_id, _) in CITIES.items()}
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like the real APIs
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if url.path.endswith("/weather"):
+            city = query.get("q", "")
+            if city.lower() in UNKNOWN_CITIES:
+                self._send(404, {"cod": "404", "message": "city not found"})
+            else:
+                self._send(200, {"name": city, "weather": [{"description": "clear sky"}], "main": {"temp": 21.5}})
+        elif url.path.endswith("/group"):
+            names = _city_names_by_id()
+            ids = [int(city_id) for city_id in query.get("id", "").split(",") if city_id.isdigit()]
+            entries = [
+                {"id": city_id, "name": names[city_id], "weather": [{"description": "clear sky"}], "main": {"temp": 21.5}}
+                for city_id in ids if city_id in names
+            ]
+            self._send(200, {"cnt": len(entries), "list": entries})
+        elif "/latest/" in url.path:
+            base = url.path.rsplit("/", 1)[-1].upper()
+            if base not in USD_RATES:
+                self._send(404, {"result": "error", "error-type": "unsupported-code"})
+            else:
+                rates = {code: rate / USD_RATES[base] for code, rate in USD_RATES.items()}
+                self._send(200, {"result": "success", "base_code": base, "conversion_rates": rates})
+        elif url.path.endswith("/top-headlines"):
+            country = query.get("country", "")
+            articles = [] if country in COUNTRIES_WITHOUT_NEWS else [
+                {"title": f"Headline {i} ({country})"} for i in range(1, 6)
+            ]
+            self._send(200, {"status": "ok", "totalResults": len(articles), "articles": articles})
+        else:
+            self._send(404, {"message": "unknown endpoint"})
+
+    def _send(self, status: int, payload: dict) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class UpstreamStandIn(ThreadingHTTPServer):
+    """
+    Serves the three upstream APIs on 127.0.0.1 from a daemon thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, port: int = 0):
+        super().__init__(("127.0.0.1", port), _UpstreamHandler)
+        self.latency = latency
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def start(self) -> "UpstreamStandIn":
+        threading.Thread(target=self.serve_forever, name="upstream-stand-in", daemon=True).start()
+        return self
+
+    def urls(self) -> dict[str, str]:
+        """
+        WEATHER_URL / WEATHER_GROUP_URL / EXCHANGE_URL / NEWS_URL pointing at this server.
+        """
+        return {
+            "WEATHER_URL": f"{self.base_url}/data/2.5/weather",
+            "WEATHER_GROUP_URL": f"{self.base_url}/data/2.5/group",
+            "EXCHANGE_URL": f"{self.base_url}/v6/{{api_key}}/latest/{{base_currency}}",
+            "NEWS_URL": f"{self.base_url}/v2/top-headlines?country={{country_code}}&apiKey={{api_key}}",
+        }
+
+
+# ----- Fake chat model -----
+_CITY_RE = re.compile(r"\b(?:en|in)\s+([A-Z][\w-]+(?:\s+[A-Z][\w-]+)*)")
+_SECTION_RE = re.compile(r"^### (\w+)\n(.*?)(?=^### |\Z)", re.M | re.S)
+
+
+def plan_answer(text: str) -> str:
+    """
+    The planner's JSON for `text`, built with the gazetteer and the task lexicon.
+    """
+    from utils.gazetteer import gazetteer
+    from utils.task_lexicon import scan_tasks
+
+    tasks = []
+    for mention in scan_tasks(text):
+        if mention.task not in tasks:
+            tasks.append(mention.task)
+    cities = gazetteer.match_cities(text)
+    if not cities:
+        match = _CITY_RE.search(text)
+        cities = [match.group(1)] if match else []
+    currencies = gazetteer.match_exchange(text)
+    return json.dumps({
+        "tasks": tasks,
+        "cities": cities or None,
+        "currencies": [currencies[0], *currencies[1]] if currencies else None,
+        "countries": gazetteer.match_countries(text) or None,
+    })
+
+
+def fake_answer(messages: list[BaseMessage]) -> str:
+    if isinstance(messages[0], SystemMessage) and "planifica" in messages[0].content:
+        return plan_answer(messages[-1].content)
+    text = messages[-1].content
+    sections = _SECTION_RE.findall(text)
+    if sections:
+        return "\n".join(f"### {task}\n{body.strip()} 🙂" for task, body in sections)
+    return text.strip().splitlines()[-1] + " 🙂"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model that answers after `latency` seconds.
+    """
+
+    latency: float = 0.05
+    model_name: str = "fake-chat"
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _generate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_answer(messages)))])
+
+    async def _agenerate(self, messages: list[BaseMessage], stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_answer(messages)))])
+
+
+# ----- Benchmark -----
+def configure_environment(stand_in: UpstreamStandIn) -> None:
+    """
+    Points the project at the stand-in. Must run before the agents are imported: they read
+    their URLs at import time.
+    """
+    os.environ.update(stand_in.urls())
+    os.environ.update(
+        OPENWEATHER_API_KEY="benchmark", EXCHANGE_API_KEY="benchmark", NEWS_API_KEY="benchmark",
+        # The fake model is not bound by the OpenAI quota
+        LLM_CACHE_ENABLED="false", RATE_LIMIT_OPENAI="",
+    )
+    os.environ.setdefault("OPENAI_API_KEY", "sk-placeholder")
+    os.environ.setdefault("DISABLE_LOGGING", "True")
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+def _on_expected_path(scenario: str, state: Any) -> bool:
+    if isinstance(state, BaseException):
+        return False
+    has_errors = bool(state.get("error"))
+    return has_errors if scenario == "error" else not has_errors and not state.get("degraded")
+
+
+async def run_level(engine, scenario: str, requests: int, concurrency: int) -> dict[str, Any]:
+    """
+    Runs `requests` queries of `scenario` with at most `concurrency` in flight.
+    """
+    from agents.weather_agent import weather_cache
+    from agents.currency_agent import rate_cache
+    from agents.news_agent import news_cache
+
+    for cache in (weather_cache, rate_cache, news_cache):
+        cache.clear()
+
+    queries = SCENARIOS[scenario]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    unexpected = 0
+
+    async def one(query: str) -> None:
+        nonlocal unexpected
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                state = await engine.arun(query)
+            except Exception as e:
+                state = e
+            latencies.append(time.perf_counter() - start)
+            if not _on_expected_path(scenario, state):
+                unexpected += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(queries[i % len(queries)]) for i in range(requests)))
+    elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput": requests / elapsed if elapsed else 0.0,
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": _percentile(ordered, 0.50) * 1000,
+        "p95_ms": _percentile(ordered, 0.95) * 1000,
+        "p99_ms": _percentile(ordered, 0.99) * 1000,
+        "unexpected": unexpected,
+    }
+
+
+async def run_benchmark(scenarios: list[str], requests: int, levels: list[int]) -> list[dict[str, Any]]:
+    from core import engine
+
+    # Warm-up: imports, graph compilation and connection pools stay out of the numbers
+    for scenario in scenarios:
+        await run_level(engine, scenario, len(SCENARIOS[scenario]), 1)
+
+    results = []
+    for scenario in scenarios:
+        for concurrency in levels:
+            result = await run_level(engine, scenario, requests, concurrency)
+            print(
+                f"{scenario:<10} {concurrency:>5} {requests:>6} {result['throughput']:>9.1f} "
+                f"{result['mean_ms']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+                f"{result['p99_ms']:>9.1f} {result['unexpected']:>10}",
+                flush=True,
+            )
+            results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="Queries per scenario and concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Queries in flight")
+    parser.add_argument("--llm-latency", type=float, default=50.0, help="Milliseconds per fake LLM call")
+    parser.add_argument("--upstream-latency", type=float, default=20.0, help="Milliseconds per stand-in response")
+    parser.add_argument("--json", help="Also write the results to this JSON file")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit with 1 if any p95 exceeds this")
+    args = parser.parse_args()
+
+    stand_in = UpstreamStandIn(latency=args.upstream_latency / 1000).start()
+    configure_environment(stand_in)
+
+    from core.llm import NODES, set_llm
+    from utils.http_client import run_closing_clients
+
+    for node in NODES:
+        set_llm(node, FakeChatModel(latency=args.llm_latency / 1000))
+
+    print(f"LLM latency {args.llm_latency:g} ms, upstream latency {args.upstream_latency:g} ms, "
+          f"stand-in at {stand_in.base_url}")
+    print(f"{'scenario':<10} {'conc':>5} {'n':>6} {'q/s':>9} {'mean ms':>9} {'p50 ms':>9} "
+          f"{'p95 ms':>9} {'p99 ms':>9} {'unexpected':>10}")
+    results = run_closing_clients(run_benchmark(args.scenarios, args.requests, args.concurrency))
+    stand_in.shutdown()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"llm_latency_ms": args.llm_latency, "upstream_latency_ms": args.upstream_latency,
+                       "results": results}, f, indent=2)
+
+    failed = [r for r in results if r["unexpected"]]
+    if args.max_p95_ms is not None:
+        failed += [r for r in results if r["p95_ms"] > args.max_p95_ms]
+    if failed:
+        print(f"FAILED: {len(failed)} scenario/concurrency runs off the expected path or over the p95 limit",
+              file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
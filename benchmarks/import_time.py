@@ -0,0 +1,75 @@
+
+"""
+Cold-start cost of importing the graph modules, measured in fresh interpreters.
+
+Usage:
+    python -m benchmarks.import_time              # 10 runs per scenario
+    python -m benchmarks.import_time --runs 30
+
+Scenarios:
+    lazy      import the agents and nodes; no LLM client is created
+    first     lazy + the first `get_llm` call (langchain_openai import and one shared client)
+    eager     import + one ChatOpenAI per node, as every module used to do at import time
+
+No request is sent to OpenAI; a placeholder OPENAI_API_KEY is used when none is set.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+MODULES = (
+    "agents.weather_agent",
+    "agents.currency_agent",
+    "agents.news_agent",
+    "nodes.plan_query",
+    "nodes.classify_query",
+    "nodes.order_tasks",
+    "nodes.error_handler",
+    "nodes.aggregator_tasks",
+)
+
+_IMPORTS = "".join(f"import {module}\n" for module in MODULES)
+
+SCENARIOS = {
+    "lazy": "",
+    "first": "from core.llm import NODES, get_llm\nfor node in NODES: get_llm(node)\n",
+    "eager": (
+        "from core.llm import NODES\n"
+        "from langchain_openai import ChatOpenAI\n"
+        "clients = [ChatOpenAI(model='gpt-3.5-turbo', temperature=0) for _ in NODES]\n"
+    ),
+}
+
+_CHILD = """
+import time
+start = time.perf_counter()
+{imports}{extra}print(time.perf_counter() - start)
+"""
+
+
+def measure(scenario: str) -> float:
+    env = {**os.environ, "DISABLE_LOGGING": "True"}
+    env.setdefault("OPENAI_API_KEY", "sk-placeholder")
+    code = _CHILD.format(imports=_IMPORTS, extra=SCENARIOS[scenario])
+    output = subprocess.run(
+        [sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Fresh interpreters per scenario")
+    args = parser.parse_args()
+
+    for scenario in SCENARIOS:
+        timings = [measure(scenario) for _ in range(args.runs)]
+        print(f"{scenario:<6} mean={statistics.mean(timings) * 1000:8.1f} ms  "
+              f"min={min(timings) * 1000:8.1f} ms  max={max(timings) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
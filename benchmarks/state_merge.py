@@ -0,0 +1,66 @@
+
+"""
+Cost of the AgentState reducers as the number of tasks and conversation turns grows.
+
+Usage:
+    python -m benchmarks.state_merge
+    python -m benchmarks.state_merge --tasks 3 10 30 --turns 10 100 1000
+
+Each turn replays what the graph writes: every task node returns
+{"results": {task: [msg]}, "task_completed": {task: True}, "history": [node]}, and a
+check_completion step echoes the full state back. The history of a session keeps growing
+across turns. "copy" is the previous implementation ({**a, **b} and list concatenation);
+"current" uses core.agent_state.merge_dicts / add_history_update.
+"""
+
+import argparse
+import time
+
+from core.agent_state import add_history_update, merge_dicts
+
+
+def copy_merge_dicts(dict1, dict2):
+    return {**dict1, **dict2}
+
+
+def copy_add_history(history_old, history_new):
+    # The old reducer also concatenated a full-state echo onto itself, doubling the history
+    # every turn; that is skipped here so both versions do the same work.
+    if history_new is history_old:
+        return history_old
+    return history_old + history_new
+
+
+def run_session(tasks: int, turns: int, merge, add_history) -> float:
+    names = [f"task_{i}" for i in range(tasks)]
+    state = {"results": {}, "task_completed": {}, "history": []}
+
+    start = time.perf_counter()
+    for turn in range(turns):
+        for name in names:
+            state["results"] = merge(state["results"], {name: [f"respuesta {turn}"]})
+            state["task_completed"] = merge(state["task_completed"], {name: True})
+            state["history"] = add_history(state["history"], [name])
+        # check_completion devuelve el estado completo
+        state["results"] = merge(state["results"], state["results"])
+        state["task_completed"] = merge(state["task_completed"], state["task_completed"])
+        state["history"] = add_history(state["history"], state["history"])
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tasks", type=int, nargs="+", default=[3, 10, 30], help="Tasks per turn")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000], help="Turns per session")
+    args = parser.parse_args()
+
+    print(f"{'tasks':>5} {'turns':>6} {'copy ms':>10} {'current ms':>11} {'speedup':>8}")
+    for tasks in args.tasks:
+        for turns in args.turns:
+            baseline = run_session(tasks, turns, copy_merge_dicts, copy_add_history)
+            current = run_session(tasks, turns, merge_dicts, add_history_update)
+            print(f"{tasks:>5} {turns:>6} {baseline * 1000:>10.2f} {current * 1000:>11.2f} {baseline / current:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,84 @@
-
-from dotenv import load_dotenv
 from typing import Annotated, TypedDict, Optional, List, Dict, Any
 from langchain_core.messages import BaseMessage
 from langgraph.graph.message import add_messages
 
-# Cargar variables de entorno
-load_dotenv(dotenv_path='env')
+# Las variables de entorno se cargan en los puntos de entrada (ver core/env.py)
 
+# ----- Reductores -----
+# Los reductores de LangGraph deben ser puros: las aristas condicionales leen el estado
+# aplicando las escrituras del nodo sobre `channel.copy()`, que comparte el valor con el canal,
+# y los nodos en paralelo reciben los mismos objetos. Por eso no se modifica nada en sitio:
+# los diccionarios solo se copian si la actualización cambia algo, y el historial comparte
+# su parte anterior en lugar de copiarse.
 # Función para combinar diccionarios
 def merge_dicts(dict1, dict2):
     if not isinstance(dict1, dict) or not isinstance(dict2, dict):
         raise TypeError(f"Ambos argumentos deben ser diccionarios. Recibido: {type(dict1)} y {type(dict2)}")
+    # Sin cambios (p. ej. un nodo que devuelve el estado completo): se conserva el mismo objeto
+    if dict2 is dict1 or not dict2:
+        return dict1
     return {**dict1, **dict2}
 
-def add_history_update(history_old: List[str], history_new: List[str]) -> List[str]:
-    return history_old + history_new
+class History:
+    """
+    Secuencia inmutable de nombres de nodos. Cada actualización crea un eslabón con las
+    entradas nuevas que apunta al historial anterior: añadir cuesta O(entradas nuevas)
+    en vez de copiar toda la lista, y las versiones anteriores siguen siendo válidas.
+    """
+    __slots__ = ("_parent", "_items", "_len", "_flat")
+
+    def __init__(self, items=(), parent: Optional["History"] = None):
+        self._parent = parent
+        self._items = tuple(items)
+        self._len = len(self._items) + (parent._len if parent is not None else 0)
+        self._flat = None  # Lista materializada (tupla), calculada en el primer acceso por índice
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self):
+        chunks, node = [], self
+        while node is not None:
+            chunks.append(node._items)
+            node = node._parent
+        for chunk in reversed(chunks):
+            yield from chunk
+
+    def __getitem__(self, index):
+        # El último nodo (el acceso habitual) sale del eslabón más reciente en O(1)
+        if index == -1 and self._items:
+            return self._items[-1]
+        # El historial es inmutable, así que la lista se materializa una sola vez
+        if self._flat is None:
+            self._flat = tuple(self)
+        if isinstance(index, slice):
+            return list(self._flat[index])
+        return self._flat[index]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (History, list, tuple)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+def add_history_update(history_old: List[str], history_new: List[str]) -> History:
+    # Un nodo que devuelve el estado completo reenvía el mismo historial: no se duplica
+    if history_new is history_old or not history_new:
+        return history_old
+    if type(history_old) is not History:
+        history_old = History(history_old) if history_old else None
+    return History(history_new, history_old)
+
+def add_timings(timings_old: Dict[str, float], timings_new: Dict[str, float]) -> Dict[str, float]:
+    # Un nodo que se ejecuta varias veces (p. ej. task_error) acumula su tiempo
+    if timings_new is timings_old or not timings_new:
+        return timings_old
+    merged = dict(timings_old)
+    for node, seconds in timings_new.items():
+        merged[node] = merged.get(node, 0.0) + seconds
+    return merged
 
 # Clase AgentState
 class AgentState(TypedDict):
@@ -46,14 +110,47 @@ class AgentState(TypedDict):
 
         history (List[str]):
             Lista para realizar un seguimiento de los nombres de los nodos por los que pasa el flujo.
+            Los nodos la amplían devolviendo `{"history": [nombre]}` (ver `core.instrumentation.record_history`);
+            el reductor la guarda como `History`, que se recorre igual que una lista.
+
+        task_completed (Dict[str, bool]):
+            Tarea -> True si terminó con éxito, False si falló.
+
+        timings (Dict[str, float]):
+            Segundos que tardó cada nodo (sumados si se ejecuta varias veces), registrados por
+            `record_history`. Ejemplo: {"plan_query": 0.8, "task_weather": 0.3}
+
+        entities (Dict[str, Any]):
+            Argumentos de los agentes extraídos por el planificador en una sola llamada.
+            Ejemplo: {"cities": ["New York", "Paris"], "currencies": ["USD", "MXN", "EUR"], "countries": ["us"]}
+            (en "currencies" la primera es la divisa de origen y las demás las de destino).
+            Si una clave está presente (aunque sea None), el agente no vuelve a llamar al LLM.
+
+        deadline (Optional[float]):
+            Hora límite (Unix) de la consulta, fijada por el motor a partir del presupuesto de
+            latencia. Los agentes reciben lo que queda de ella (ver `core.deadline`).
+
+        degraded (Dict[str, str]):
+            Tareas respondidas en modo degradado por superar el plazo: "stale" (último valor
+            en caché) o "unavailable". Ejemplo: {"news": "stale"}
+
+        metrics (Dict[str, Any]):
+            Desglose de la consulta que añade el motor al estado final (no lo escribe ningún
+            nodo): tiempo total, segundos y proporción por nodo, llamadas/tokens/coste del LLM
+            por nodo y llamadas HTTP por servicio (ver `utils.metrics.RequestMetrics`).
     """
     
     messages: Annotated[List[BaseMessage], add_messages]  # Mensajes intercambiados
     order_task: Dict[str, Any]  # Orden de las tareas
     error: Annotated[Dict[str, str], merge_dicts]  # Manejo de errores
     results: Annotated[Dict[str, str], merge_dicts]  # Resultados de las tareas
-    task_completed: Annotated[Dict[str, str], merge_dicts]  # Tareas completadas
+    task_completed: Annotated[Dict[str, bool], merge_dicts]  # Tareas completadas
     tasks_to_do: Dict[str, bool]  # Tareas pendientes
     ready_to_aggregate: bool  # Indicador de si está listo para agregarse
     history: Annotated[List[str], add_history_update]  # Historial de nodos procesados
+    entities: Annotated[Dict[str, Any], merge_dicts]  # Argumentos extraídos por el planificador
+    timings: Annotated[Dict[str, float], add_timings]  # Latencia por nodo
+    deadline: Optional[float]  # Hora límite de la consulta
+    degraded: Annotated[Dict[str, str], merge_dicts]  # Tareas que superaron su plazo
+    metrics: Dict[str, Any]  # Desglose de tiempos, tokens y coste (estado final)
 
@@ -0,0 +1,213 @@
+
+"""
+Runs the queries of a JSONL file through the graph and writes one JSONL result per query.
+
+Usage:
+    python -m core.batch_runner queries.jsonl -o results.jsonl
+    python -m core.batch_runner requests.jsonl -o out.jsonl --query-field body --id-field request_id --workers 16
+
+Each input line is a JSON object with the query under `--query-field` (default "query"), or a
+bare JSON string. The input is read lazily, `--workers` queries run concurrently on one event
+loop, and each result is appended to the output as soon as it finishes. The byte offset of
+every finished line is appended to a checkpoint file (default: <output>.ckpt); rerunning the
+same command skips those lines, so a crashed run resumes where it stopped. A query that was
+written but not yet checkpointed when the process died is run again (at-least-once output).
+
+With CASSETTE_MODE=record the run stores every LLM answer and API response (see
+utils.cassette); with CASSETTE_MODE=replay the same file runs against those recordings, so two
+builds can be timed on identical inputs and answers.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import statistics
+from collections import defaultdict
+from typing import Any, Iterator, Optional
+
+from core import env  # noqa: F401  (loads the env file before the engine reads its settings)
+from core import engine
+from utils import cassette
+from utils.http_client import run_closing_clients
+from utils.logging import setup_logging
+from utils.metrics import METRICS_PORT, start_metrics_server
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+
+# ----- Input -----
+def read_queries(
+    path: str, query_field: str, id_field: str, done: set[int]
+) -> Iterator[tuple[int, str, Optional[str]]]:
+    """
+    Yields (byte offset, query, id) for every line not yet in `done`, one line at a time.
+    """
+    with open(path, "rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if offset in done or not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Línea inválida en el offset %s; se omite", offset)
+                continue
+            if isinstance(record, str):
+                yield offset, record, None
+            elif isinstance(record, dict) and isinstance(record.get(query_field), str):
+                request_id = record.get(id_field)
+                yield offset, record[query_field], str(request_id) if request_id is not None else None
+            else:
+                logger.warning("Línea sin el campo '%s' en el offset %s; se omite", query_field, offset)
+
+
+# ----- Checkpoint -----
+def load_checkpoint(path: str) -> set[int]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {int(line) for line in f if line.strip()}
+
+
+# ----- Statistics -----
+class RunStats:
+    def __init__(self):
+        self.ok = 0
+        self.failed = 0
+        self.latencies: list[float] = []
+        self.stages: defaultdict[str, list[float]] = defaultdict(list)
+
+    def add(self, latency: float, timings: dict[str, float], failed: bool) -> None:
+        self.latencies.append(latency)
+        if failed:
+            self.failed += 1
+            return
+        self.ok += 1
+        for stage, seconds in timings.items():
+            self.stages[stage].append(seconds)
+
+    def report(self, elapsed: float, skipped: int) -> str:
+        processed = self.ok + self.failed
+        lines = [
+            f"processed={processed} ok={self.ok} failed={self.failed} skipped={skipped} "
+            f"elapsed={elapsed:.2f}s throughput={processed / elapsed if elapsed else 0.0:.2f} queries/s",
+            f"{'stage':<16} {'n':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}",
+        ]
+        rows = [("end_to_end", self.latencies)] + sorted(self.stages.items())
+        for stage, values in rows:
+            if not values:
+                continue
+            ordered = sorted(values)
+            p50 = ordered[len(ordered) // 2]
+            p95 = ordered[int(0.95 * (len(ordered) - 1))]
+            lines.append(
+                f"{stage:<16} {len(values):>6} {statistics.mean(values) * 1000:>9.1f} "
+                f"{p50 * 1000:>9.1f} {p95 * 1000:>9.1f}"
+            )
+        return "\n".join(lines)
+
+
+# ----- Runner -----
+def _result_record(offset: int, query: str, request_id: Optional[str], state: Any, latency: float) -> dict:
+    record = {"offset": offset, "id": request_id, "query": query, "latency": round(latency, 4)}
+    if isinstance(state, BaseException):
+        record["exception"] = f"{type(state).__name__}: {state}"
+    else:
+        record["messages"] = engine.final_messages(state)
+        record["errors"] = state.get("error", {})
+        record["degraded"] = state.get("degraded", {})
+        record["timings"] = {stage: round(seconds, 4) for stage, seconds in state.get("timings", {}).items()}
+        totals = state.get("metrics", {}).get("totals", {})
+        record["tokens"] = totals.get("prompt_tokens", 0) + totals.get("completion_tokens", 0)
+        record["cost_usd"] = round(totals.get("cost_usd", 0.0), 6)
+    return record
+
+
+async def run_file(
+    input_path: str,
+    output_path: str,
+    checkpoint_path: str,
+    workers: int,
+    query_field: str = "query",
+    id_field: str = "id",
+    limit: Optional[int] = None,
+) -> str:
+    """
+    Processes `input_path` with `workers` concurrent queries and returns the final report.
+    """
+    done = load_checkpoint(checkpoint_path)
+    stats = RunStats()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)  # Bounded: the input is read lazily
+
+    with open(output_path, "a", encoding="utf-8") as out, open(checkpoint_path, "a", encoding="utf-8") as ckpt:
+
+        async def producer() -> None:
+            for count, item in enumerate(read_queries(input_path, query_field, id_field, done)):
+                if limit is not None and count >= limit:
+                    break
+                await queue.put(item)
+            for _ in range(workers):
+                await queue.put(None)
+
+        async def worker() -> None:
+            while (item := await queue.get()) is not None:
+                offset, query, request_id = item
+                start = time.perf_counter()
+                try:
+                    state = await engine.arun(query, request_id=request_id)
+                except Exception as e:
+                    logger.exception("Fallo la consulta del offset %s", offset)
+                    state = e
+                latency = time.perf_counter() - start
+                stats.add(latency, {} if isinstance(state, BaseException) else state.get("timings", {}),
+                          isinstance(state, BaseException))
+
+                # Primero el resultado y después el checkpoint: un corte entre ambos solo repite la consulta
+                out.write(json.dumps(_result_record(offset, query, request_id, state, latency), ensure_ascii=False) + "\n")
+                out.flush()
+                ckpt.write(f"{offset}\n")
+                ckpt.flush()
+
+        start = time.perf_counter()
+        await asyncio.gather(producer(), *(worker() for _ in range(workers)))
+        elapsed = time.perf_counter() - start
+
+    return stats.report(elapsed, skipped=len(done))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file with one query per line")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file the results are appended to")
+    parser.add_argument("--checkpoint", help="Offsets of finished lines (default: <output>.ckpt)")
+    parser.add_argument("--workers", type=int, default=engine.ENGINE_MAX_CONCURRENCY, help="Concurrent queries")
+    parser.add_argument("--query-field", default="query", help="Field holding the query text")
+    parser.add_argument("--id-field", default="id", help="Field used as request ID in logs and output")
+    parser.add_argument("--limit", type=int, help="Process at most this many pending lines")
+    args = parser.parse_args()
+
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)  # Lets Prometheus scrape a long run while it progresses
+    report = run_closing_clients(run_file(
+        args.input,
+        args.output,
+        args.checkpoint or args.output + ".ckpt",
+        args.workers,
+        query_field=args.query_field,
+        id_field=args.id_field,
+        limit=args.limit,
+    ))
+    print(report, file=sys.stderr)
+    if cassette.active():
+        print(f"cassette ({cassette.CASSETTE_MODE}): {cassette.cassette_stats()}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+
+import os
+import time
+import asyncio
+import functools
+import inspect
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Awaitable, Callable, Optional
+
+from core.agent_state import AgentState
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# With a budget, every query gets an absolute deadline (`state["deadline"]`, Unix time) when
+# it enters the engine. The agents only get what is left of it minus a reserve for the
+# aggregation step; when their share runs out they answer with the last cached value or a
+# fast "unavailable". Deadlines are opt-in: the default budget of 0 disables them.
+QUERY_BUDGET = float(os.getenv("QUERY_BUDGET", "0"))  # Seconds per query; 0 disables deadlines
+AGGREGATOR_RESERVE = float(os.getenv("QUERY_AGGREGATOR_RESERVE", "1.0"))  # Seconds kept for the aggregator
+MIN_AGENT_TIMEOUT = float(os.getenv("QUERY_MIN_AGENT_TIMEOUT", "0.2"))  # Floor so a late agent still gets a try
+DEADLINE_WORKERS = int(os.getenv("QUERY_DEADLINE_WORKERS", "32"))  # Threads for sync calls under a deadline
+
+# Sync nodes cannot be interrupted, so they run here and the caller stops waiting at the
+# deadline; the straggler keeps its worker thread until it finishes (it still fills the
+# response caches), so a budget that is too tight can fill this pool.
+_executor = ThreadPoolExecutor(max_workers=DEADLINE_WORKERS, thread_name_prefix="deadline")
+_stragglers: set = set()  # Async calls past their deadline, kept alive until they finish
+
+
+def new_deadline(budget: Optional[float] = None) -> Optional[float]:
+    """
+    Absolute deadline for a query started now, or None if the budget is 0 (no deadline).
+    """
+    budget = QUERY_BUDGET if budget is None else budget
+    return time.time() + budget if budget > 0 else None
+
+
+def remaining(state: AgentState) -> Optional[float]:
+    """
+    Seconds left before the query's deadline (negative once it has passed), or None without one.
+    """
+    deadline = state.get("deadline")
+    return deadline - time.time() if deadline else None
+
+
+def agent_timeout(state: AgentState) -> Optional[float]:
+    """
+    Time an agent may spend: the remaining budget minus the aggregator's reserve.
+    """
+    left = remaining(state)
+    if left is None:
+        return None
+    return max(MIN_AGENT_TIMEOUT, left - AGGREGATOR_RESERVE)
+
+
+def call_with_timeout(fn: Callable[[], Any], timeout: Optional[float]) -> Any:
+    """
+    Runs `fn()` and returns its value, or raises `TimeoutError` after `timeout` seconds.
+    The logging context (request ID) is carried over to the worker thread.
+    """
+    if timeout is None:
+        return fn()
+    if timeout <= 0:
+        raise TimeoutError("deadline already passed")
+    future = _executor.submit(contextvars.copy_context().run, fn)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        raise TimeoutError(f"call did not finish within {timeout:.2f}s") from None
+
+
+def _log_straggler(task: asyncio.Task) -> None:
+    _stragglers.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug("Call past its deadline finished with an error: %s", task.exception())
+
+
+async def acall_with_timeout(coro: Awaitable[Any], timeout: Optional[float]) -> Any:
+    """
+    Async version of `call_with_timeout`. A call past its deadline is not cancelled: it keeps
+    running in the background (so a shared cache load is not aborted) and its result is dropped.
+    """
+    if timeout is None:
+        return await coro
+    if timeout <= 0:
+        if inspect.iscoroutine(coro):
+            coro.close()
+        raise TimeoutError("deadline already passed")
+    task = asyncio.ensure_future(coro)
+    done, _ = await asyncio.wait({task}, timeout=timeout)
+    if task in done:
+        return task.result()
+    _stragglers.add(task)
+    task.add_done_callback(_log_straggler)
+    raise TimeoutError(f"call did not finish within {timeout:.2f}s")
+
+
+# ----- Degraded answers -----
+def stale_update(task: str, message: str) -> AgentState:
+    """
+    Update for a task answered with its last cached value after missing the deadline.
+    """
+    return {
+        "results": {task: [f"{message} (last known value; live data did not arrive in time)"]},
+        "task_completed": {task: True},
+        "degraded": {task: "stale"},
+    }
+
+
+def unavailable_update(task: str) -> AgentState:
+    """
+    Fast answer for a task that missed the deadline with nothing cached. It is recorded as a
+    result (not an error) so no extra LLM call is spent explaining it.
+    """
+    return {
+        "results": {task: [f"{task.capitalize()} information is temporarily unavailable."]},
+        "task_completed": {task: False},
+        "degraded": {task: "unavailable"},
+    }
+
+
+# Precomputed answers while an upstream circuit is open (no network, no LLM)
+CIRCUIT_OPEN_MESSAGES = {
+    "weather": "The weather service is not responding right now. Please try again in a few minutes; "
+               "exchange rates and news are still available.",
+    "exchange": "The exchange rate service is not responding right now. Please try again in a few minutes; "
+                "weather and news are still available.",
+    "news": "The news service is not responding right now. Please try again in a few minutes; "
+            "weather and exchange rates are still available.",
+}
+
+
+def circuit_open_update(task: str) -> AgentState:
+    """
+    Precomputed answer for a task whose upstream breaker is open and that has nothing cached.
+    """
+    return {
+        "results": {task: [CIRCUIT_OPEN_MESSAGES.get(task, f"{task.capitalize()} is temporarily unavailable.")]},
+        "task_completed": {task: False},
+        "degraded": {task: "circuit_open"},
+    }
+
+
+def with_deadline(
+    task: str, fallback: Callable[[AgentState], Optional[str]], upstream: Optional[str] = None
+) -> Callable:
+    """
+    Agent decorator: limits the node to `agent_timeout(state)` seconds. If it does not finish
+    in time, `fallback(state)` looks up the last cached value (without calling the LLM or the
+    API), returned marked as stale, or else an "unavailable" answer.
+    With `upstream`, the node does not run at all while that API's circuit is open: it answers
+    from the cache or with the precomputed message in `CIRCUIT_OPEN_MESSAGES` (the agent must
+    let `CircuitOpenError` propagate to get here).
+    Goes below `record_history`, so that it measures the time the graph actually waited.
+    """
+    def _cached(state: AgentState) -> Optional[str]:
+        try:
+            return fallback(state)
+        except Exception:
+            logger.exception("Could not read the cache for '%s'", task)
+            return None
+
+    def _degraded(state: AgentState, timeout: float) -> AgentState:
+        logger.warning("Task '%s' exceeded its %.2fs deadline; answering in degraded mode", task, timeout)
+        cached = _cached(state)
+        return stale_update(task, cached) if cached else unavailable_update(task)
+
+    def _circuit_open(state: AgentState) -> AgentState:
+        logger.warning("Circuit for %s is open; task '%s' answers without calling the API", upstream, task)
+        cached = _cached(state)
+        return stale_update(task, cached) if cached else circuit_open_update(task)
+
+    def _is_open() -> bool:
+        return upstream is not None and get_breaker(upstream).is_open()
+
+    def decorator(node: Callable) -> Callable:
+        if inspect.iscoroutinefunction(node):
+            @functools.wraps(node)
+            async def async_wrapper(state, *args, **kwargs):
+                if _is_open():
+                    return _circuit_open(state)
+                timeout = agent_timeout(state)
+                try:
+                    return await acall_with_timeout(node(state, *args, **kwargs), timeout)
+                except TimeoutError:
+                    return _degraded(state, timeout)
+                except CircuitOpenError:
+                    return _circuit_open(state)
+            return async_wrapper
+
+        @functools.wraps(node)
+        def wrapper(state, *args, **kwargs):
+            if _is_open():
+                return _circuit_open(state)
+            timeout = agent_timeout(state)
+            try:
+                return call_with_timeout(lambda: node(state, *args, **kwargs), timeout)
+            except TimeoutError:
+                return _degraded(state, timeout)
+            except CircuitOpenError:
+                return _circuit_open(state)
+        return wrapper
+
+    return decorator
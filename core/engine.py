@@ -0,0 +1,271 @@
+
+import os
+import uuid
+import asyncio
+import threading
+from typing import Any, AsyncIterator, Iterable, Optional, Union
+
+from core import env  # noqa: F401  (carga el archivo env antes que los módulos que lo leen)
+
+from langchain_core.messages import HumanMessage
+from langgraph.graph import StateGraph, END, START
+from langgraph.types import Send
+
+from core.agent_state import AgentState
+from core.deadline import new_deadline
+from agents.weather_agent import get_weather, aget_weather
+from agents.currency_agent import get_exchange_rate, aget_exchange_rate
+from agents.news_agent import get_news, aget_news
+from nodes.plan_query import plan_query, aplan_query
+from nodes.error_handler import error_handler, aerror_handler, pending_errors
+from nodes.aggregator_tasks import aggregator, aaggregator, astreaming_aggregator
+from utils.http_client import run_closing_clients
+from utils.logging import request_context, setup_logging
+from utils.metrics import track_request
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+ENGINE_MAX_CONCURRENCY = int(os.getenv("ENGINE_MAX_CONCURRENCY", "8"))  # Queries in flight in run_batch
+ENGINE_RECURSION_LIMIT = int(os.getenv("ENGINE_RECURSION_LIMIT", "25"))  # Max graph steps per query
+
+# Tarea -> nodo del agente que la resuelve
+TASK_NODES = {
+    "weather": "task_weather",
+    "exchange": "task_exchange",
+    "news": "task_news",
+}
+
+# ----- Routing -----
+def route_tasks(state: AgentState) -> Union[list[Send], str]:
+    """
+    Lanza en paralelo (una rama `Send` por tarea) los agentes que pidió el planificador.
+    Sin tareas (o si el plan falló) se pasa directamente a check_completion.
+    """
+    tasks_to_do = state.get("tasks_to_do", {})
+    sends = [Send(node, state) for task, node in TASK_NODES.items() if tasks_to_do.get(task)]
+    return sends or "check_completion"
+
+def check_completion(state: AgentState) -> AgentState:
+    """
+    Punto de encuentro de las ramas: listo para agregar cuando cada tarea pedida
+    terminó (con éxito o no) y no quedan errores por explicar.
+    """
+    requested = [task for task, todo in state.get("tasks_to_do", {}).items() if todo]
+    completed = state.get("task_completed", {})
+    ready = all(task in completed for task in requested) and not pending_errors(state)
+    logger.debug("Tareas pedidas: %s | completadas: %s | listo: %s", requested, completed, ready)
+    return {"ready_to_aggregate": ready}
+
+def route_completion(state: AgentState) -> str:
+    if pending_errors(state):
+        return "handle_error"
+    if not state.get("ready_to_aggregate"):
+        logger.warning("Tareas sin terminar tras la ejecución en paralelo; se agrega lo disponible")
+    return "aggregate"
+
+# ----- Graph -----
+def build_graph(use_async: bool = False, stream_answer: bool = False):
+    """
+    Construye y compila el grafo:
+
+        START -> plan -> (Send) task_weather | task_exchange | task_news -> check_completion
+        check_completion -> handle_error -> check_completion   (mientras haya errores pendientes)
+        check_completion -> aggregate -> END
+
+    Con `use_async=True` se usan las versiones asíncronas de los nodos (para `ainvoke`).
+    Con `stream_answer=True` (solo async) el agregador transmite la respuesta por el modo
+    de stream "custom" (ver `astream`).
+    """
+    if stream_answer and not use_async:
+        raise ValueError("stream_answer requires use_async=True")
+    graph = StateGraph(AgentState)
+
+    graph.add_node("plan", aplan_query if use_async else plan_query)
+    graph.add_node("task_weather", aget_weather if use_async else get_weather)
+    graph.add_node("task_exchange", aget_exchange_rate if use_async else get_exchange_rate)
+    graph.add_node("task_news", aget_news if use_async else get_news)
+    graph.add_node("check_completion", check_completion)
+    graph.add_node("handle_error", aerror_handler if use_async else error_handler)
+    if stream_answer:
+        graph.add_node("aggregate", astreaming_aggregator)
+    else:
+        graph.add_node("aggregate", aaggregator if use_async else aggregator)
+
+    graph.add_edge(START, "plan")
+    graph.add_conditional_edges("plan", route_tasks, list(TASK_NODES.values()) + ["check_completion"])
+    for node in TASK_NODES.values():
+        graph.add_edge(node, "check_completion")
+    graph.add_conditional_edges("check_completion", route_completion, ["handle_error", "aggregate"])
+    graph.add_edge("handle_error", "check_completion")
+    graph.add_edge("aggregate", END)
+
+    return graph.compile()
+
+_apps: dict[tuple[bool, bool], Any] = {}
+_apps_lock = threading.Lock()
+
+def get_app(use_async: bool = False, stream_answer: bool = False):
+    """
+    Devuelve el grafo compilado (sync, async o async con la respuesta en streaming),
+    compilándolo una sola vez por proceso.
+    """
+    key = (use_async, stream_answer)
+    app = _apps.get(key)
+    if app is None:
+        with _apps_lock:
+            app = _apps.get(key)
+            if app is None:
+                app = _apps[key] = build_graph(use_async, stream_answer)
+    return app
+
+# ----- Public API -----
+def initial_state(query: str, budget: Optional[float] = None) -> AgentState:
+    """
+    Estado inicial de una consulta. `budget` son los segundos de latencia permitidos
+    (por defecto QUERY_BUDGET, que es 0: sin plazo).
+    """
+    return {
+        "messages": [HumanMessage(content=query)],
+        "order_task": {},
+        "task_completed": {},
+        "results": {},
+        "error": {},
+        "tasks_to_do": {},
+        "ready_to_aggregate": False,
+        "entities": {},
+        "timings": {},
+        "deadline": new_deadline(budget),
+        "degraded": {},
+    }
+
+def final_messages(state: AgentState) -> list[str]:
+    """
+    Mensajes para el usuario: los del agregador, o las explicaciones de errores que
+    no pertenecen a ninguna tarea (p. ej. si falló el plan).
+    """
+    results = state.get("results", {})
+    messages = list(results.get("aggregator") or [])
+    order = state.get("order_task") or {}
+    for source in state.get("error", {}):
+        if source not in order:
+            messages.extend(results.get(source) or [])
+    return messages
+
+def _config() -> dict:
+    return {"recursion_limit": ENGINE_RECURSION_LIMIT}
+
+def ensure_request_id(request_id: Optional[str]) -> str:
+    return request_id or uuid.uuid4().hex[:12]
+
+def run(query: str, request_id: Optional[str] = None, budget: Optional[float] = None) -> AgentState:
+    """
+    Ejecuta una consulta con el grafo síncrono y devuelve el estado final, con el desglose
+    de tiempos, tokens y coste de la consulta en `state["metrics"]`.
+    """
+    with request_context(ensure_request_id(request_id)), track_request() as breakdown:
+        state = get_app().invoke(initial_state(query, budget), config=_config())
+    return {**state, "metrics": breakdown.as_dict(state.get("timings"))}
+
+async def arun(query: str, request_id: Optional[str] = None, budget: Optional[float] = None) -> AgentState:
+    """
+    Ejecuta una consulta con el grafo asíncrono y devuelve el estado final (con `metrics`).
+    """
+    with request_context(ensure_request_id(request_id)), track_request() as breakdown:
+        state = await get_app(use_async=True).ainvoke(initial_state(query, budget), config=_config())
+    return {**state, "metrics": breakdown.as_dict(state.get("timings"))}
+
+async def astream(
+    query: str, request_id: Optional[str] = None, budget: Optional[float] = None
+) -> AsyncIterator[dict]:
+    """
+    Ejecuta una consulta con el grafo asíncrono y produce eventos a medida que avanza:
+
+        {"type": "result", "task": ..., "messages": [...], "degraded": ...}
+            en cuanto un agente (o el manejador de errores) deja el resultado de su tarea,
+            sin esperar a las demás ramas
+        {"type": "token", "task": ..., "text": ...}
+            cada fragmento de la respuesta según lo genera el agregador
+        {"type": "section", "task": ..., "text": ...}
+            cuando el agregador termina la sección de una tarea
+        {"type": "answer", "messages": [...], "errors": {...}, "degraded": {...}, "metrics": {...}}
+            al final, con los mensajes agregados (los de `final_messages`)
+
+    El grafo corre en su propia tarea: si quien consume deja de iterar (p. ej. el cliente
+    se desconecta), la consulta se cancela.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce() -> None:
+        emitted = set()
+        state: dict = {}
+        try:
+            with request_context(ensure_request_id(request_id)), track_request() as breakdown:
+                app = get_app(use_async=True, stream_answer=True)
+                async for mode, chunk in app.astream(
+                    initial_state(query, budget), config=_config(), stream_mode=["updates", "values", "custom"]
+                ):
+                    if mode == "values":
+                        state = chunk
+                        continue
+                    if mode == "custom":
+                        queue.put_nowait(chunk)  # Eventos token/section del agregador
+                        continue
+                    for update in chunk.values():
+                        if not isinstance(update, dict):
+                            continue
+                        for task, messages in (update.get("results") or {}).items():
+                            if task == "aggregator" or task in emitted or not messages:
+                                continue
+                            emitted.add(task)
+                            queue.put_nowait({
+                                "type": "result",
+                                "task": task,
+                                "messages": list(messages),
+                                "degraded": (update.get("degraded") or {}).get(task),
+                            })
+                metrics = breakdown.as_dict(state.get("timings"))
+            queue.put_nowait({
+                "type": "answer",
+                "messages": final_messages(state),
+                "errors": state.get("error", {}),
+                "degraded": state.get("degraded", {}),
+                "metrics": metrics,
+            })
+        except Exception as e:
+            queue.put_nowait(e)
+        queue.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while (event := await queue.get()) is not None:
+            if isinstance(event, Exception):
+                raise event
+            yield event
+    finally:
+        producer.cancel()
+
+async def arun_batch(
+    queries: Iterable[str], max_concurrency: int = ENGINE_MAX_CONCURRENCY
+) -> list[Union[AgentState, BaseException]]:
+    """
+    Ejecuta varias consultas en el event loop actual con a lo sumo `max_concurrency` a la vez.
+    El resultado conserva el orden de `queries`; una consulta que falla devuelve su excepción.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _run_one(query: str) -> AgentState:
+        async with semaphore:
+            return await arun(query)
+
+    return await asyncio.gather(*(_run_one(query) for query in queries), return_exceptions=True)
+
+def run_batch(
+    queries: Iterable[str], max_concurrency: int = ENGINE_MAX_CONCURRENCY
+) -> list[Union[AgentState, BaseException]]:
+    """
+    Versión síncrona de `arun_batch` (abre su propio event loop, y cierra sus clientes HTTP
+    al terminar; dentro de código async usar `arun_batch`).
+    """
+    return run_closing_clients(arun_batch(queries, max_concurrency))
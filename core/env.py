@@ -0,0 +1,12 @@
+
+"""
+Loads the `env` file into the process environment.
+
+Several modules read their settings once, at import time (core.llm, utils.metrics,
+utils.logging, ...), so the entry points (core.engine, api.server, core.batch_runner)
+import this module before anything else from the project.
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path="env")
@@ -0,0 +1,40 @@
+
+import time
+import inspect
+import functools
+from typing import Callable
+
+from utils.metrics import observe_node
+
+# Decorador que instrumenta los nodos del grafo: historial, tiempos por nodo y métricas.
+# Vive fuera de core/agent_state.py para que el módulo del estado no dependa de utils/.
+def record_history(node_name: str) -> Callable:
+    """
+    Decorador de nodos: añade `{"history": [node_name]}` y `{"timings": {node_name: segundos}}`
+    a la actualización que devuelve el nodo, en lugar de modificar `state["history"]` en sitio,
+    y registra la duración en el histograma de nodos (ver `utils.metrics`).
+    Admite nodos sync y async.
+    """
+    def _with_history(update, start: float):
+        elapsed = time.perf_counter() - start
+        observe_node(node_name, elapsed)
+        if isinstance(update, dict) and "history" not in update:
+            update["history"] = [node_name]
+            update["timings"] = {node_name: elapsed}
+        return update
+
+    def decorator(node: Callable) -> Callable:
+        if inspect.iscoroutinefunction(node):
+            @functools.wraps(node)
+            async def async_wrapper(state, *args, **kwargs):
+                start = time.perf_counter()
+                return _with_history(await node(state, *args, **kwargs), start)
+            return async_wrapper
+
+        @functools.wraps(node)
+        def wrapper(state, *args, **kwargs):
+            start = time.perf_counter()
+            return _with_history(node(state, *args, **kwargs), start)
+        return wrapper
+
+    return decorator
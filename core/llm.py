@@ -0,0 +1,92 @@
+
+import os
+import threading
+from typing import Any
+
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# Defaults for every node; a node can override them with LLM_<NODE>_MODEL / LLM_<NODE>_TEMPERATURE
+# (e.g. LLM_AGGREGATOR_MODEL=gpt-4o-mini) or programmatically with `configure_llm`.
+DEFAULT_MODEL = os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+DEFAULT_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0"))
+
+# Nodes that call the LLM, as used in the cache and metrics labels
+NODES = ("plan", "classify", "order", "weather", "exchange", "news", "error_handler", "aggregator")
+
+_lock = threading.Lock()
+_clients: dict[tuple, Any] = {}  # One client per (model, params), shared by every node using them
+_overrides: dict[str, dict[str, Any]] = {}  # Parameters set with configure_llm
+_injected: dict[str, Any] = {}  # Instances set with set_llm (fakes, other providers)
+
+
+def llm_params(node: str) -> dict[str, Any]:
+    """
+    Parameters of the chat model used by `node`: defaults, then environment, then `configure_llm`.
+    """
+    prefix = f"LLM_{node.upper()}_"
+    params: dict[str, Any] = {
+        "model": os.getenv(prefix + "MODEL", DEFAULT_MODEL),
+        "temperature": float(os.getenv(prefix + "TEMPERATURE", DEFAULT_TEMPERATURE)),
+        # x-ratelimit-* headers in response_metadata, read by the "openai" rate limiter
+        "include_response_headers": True,
+        # usage_metadata also on streamed answers, for the token and cost metrics
+        "stream_usage": True,
+    }
+    params.update(_overrides.get(node, {}))
+    return params
+
+
+def get_llm(node: str) -> Any:
+    """
+    Returns the chat model for `node`, creating it on first use.
+
+    Nodes with the same parameters share one `ChatOpenAI` instance, and with it one
+    connection pool. `langchain_openai` itself is only imported here, so importing the
+    graph does not pay for it nor require OPENAI_API_KEY.
+    """
+    if node in _injected:
+        return _injected[node]
+
+    params = llm_params(node)
+    key = tuple(sorted(params.items()))
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                from langchain_openai import ChatOpenAI
+
+                logger.debug("Creando cliente LLM %s (nodo '%s')", params, node)
+                client = ChatOpenAI(**params)
+                _clients[key] = client
+    return client
+
+
+def configure_llm(node: str, **params: Any) -> None:
+    """
+    Overrides the model parameters of one node, e.g. `configure_llm("aggregator", model="gpt-4o-mini")`.
+    """
+    with _lock:
+        _overrides.setdefault(node, {}).update(params)
+
+
+def set_llm(node: str, llm: Any) -> None:
+    """
+    Uses `llm` as the chat model of `node` (any object with invoke/ainvoke/stream/astream).
+    """
+    with _lock:
+        _injected[node] = llm
+
+
+def reset_llms() -> None:
+    """
+    Drops the created clients, overrides and injected models.
+    """
+    with _lock:
+        _clients.clear()
+        _overrides.clear()
+        _injected.clear()
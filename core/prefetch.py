@@ -0,0 +1,173 @@
+
+"""
+Background prefetcher: keeps the most popular cities, base currencies and countries fresh in
+the response caches, so hot queries never wait on an upstream call.
+
+The caches live in memory, so the prefetcher runs inside the serving process: call
+`start_prefetcher()` once (optionally with a query log to seed the popularity ranking, e.g.
+`start_prefetcher("requests.jsonl", query_field="body")`) and `stop_prefetcher()` on shutdown.
+"""
+
+import os
+import time
+import threading
+from typing import Callable, Optional
+
+from agents.weather_agent import weather_cache, refresh_weather
+from agents.currency_agent import rate_cache, refresh_rates
+from agents.news_agent import news_cache, refresh_news
+from utils.circuit_breaker import get_breaker
+from utils.logging import setup_logging
+from utils.popularity import popularity, seed_from_log
+from utils.rate_limit import TokenBucket, upstream_limits
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", "20"))  # Hottest keys kept fresh per kind
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", "30"))  # Seconds between scans
+PREFETCH_LEAD = float(os.getenv("PREFETCH_LEAD", "60"))  # Refresh entries this close to going stale
+PREFETCH_QUOTA_SHARE = float(os.getenv("PREFETCH_QUOTA_SHARE", "0.2"))  # Share of each API quota for prefetching
+
+
+class _Kind:
+    """
+    How to prefetch one kind of key: its upstream, how long the cached entry stays fresh,
+    and how to reload it.
+    """
+
+    def __init__(self, upstream: str, expires_in: Callable[[str], Optional[float]], refresh: Callable[[str], None]):
+        self.upstream = upstream
+        self.expires_in = expires_in
+        self.refresh = refresh
+
+
+KINDS = {
+    "weather": _Kind("openweathermap", weather_cache.expires_in, refresh_weather),
+    "exchange": _Kind("exchangerate", rate_cache.expires_in, refresh_rates),
+    "news": _Kind("newsapi", news_cache.expires_in, refresh_news),
+}
+
+
+class QuotaShare:
+    """
+    Token buckets at `share` of every quota of an upstream. Prefetches never wait for a token:
+    without one the key is left for the next scan, so user traffic keeps the rest of the quota.
+    """
+
+    def __init__(self, upstream: str, share: float):
+        self._buckets = [
+            TokenBucket(rate * share, max(1.0, capacity * share)) for rate, capacity in upstream_limits(upstream)
+        ]
+        self._lock = threading.Lock()
+
+    def try_take(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            waits = [bucket.reserve(now) for bucket in self._buckets]
+            if any(waits):
+                for bucket in self._buckets:
+                    bucket.cancel()
+                return False
+            return True
+
+
+class Prefetcher:
+    """
+    Every `interval` seconds, refreshes the top-`top_k` keys of each kind whose cache entry is
+    missing or goes stale within `lead` seconds, hottest first, within `quota_share` of each API.
+    """
+
+    def __init__(
+        self,
+        top_k: int = PREFETCH_TOP_K,
+        interval: float = PREFETCH_INTERVAL,
+        lead: float = PREFETCH_LEAD,
+        quota_share: float = PREFETCH_QUOTA_SHARE,
+    ):
+        self.top_k = top_k
+        self.interval = interval
+        self.lead = lead
+        self._budgets = {name: QuotaShare(kind.upstream, quota_share) for name, kind in KINDS.items()}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stats = {"scans": 0, "refreshed": 0, "over_budget": 0, "failed": 0}
+
+    def due(self, name: str) -> list[str]:
+        """
+        Values (city, base currency, country) of the hot keys of `name` that need a refresh.
+        """
+        kind = KINDS[name]
+        due = []
+        for key, value, _ in popularity.top(name, self.top_k):
+            expires_in = kind.expires_in(key)
+            if expires_in is None or expires_in < self.lead:
+                due.append(value)
+        return due
+
+    def run_once(self) -> int:
+        """
+        One scan over every kind. Returns the number of keys refreshed.
+        """
+        self.stats["scans"] += 1
+        refreshed = 0
+        for name, kind in KINDS.items():
+            if get_breaker(kind.upstream).is_open():
+                continue
+            for value in self.due(name):
+                if not self._budgets[name].try_take():
+                    self.stats["over_budget"] += 1
+                    logger.debug("Prefetch de %s sin cuota disponible; se retoma en el próximo ciclo", name)
+                    break
+                try:
+                    kind.refresh(value)
+                    refreshed += 1
+                    self.stats["refreshed"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.warning("Prefetch de %s '%s' falló: %s", name, value, e)
+        if refreshed:
+            logger.info("Prefetch: %s claves actualizadas", refreshed)
+        return refreshed
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Error en el ciclo de prefetch")
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="prefetcher", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_prefetcher: Optional[Prefetcher] = None
+
+
+def start_prefetcher(seed_path: Optional[str] = None, query_field: str = "query") -> Prefetcher:
+    """
+    Starts the process-wide prefetcher (once), optionally seeding popularity from a query log.
+    """
+    global _prefetcher
+    if seed_path:
+        seed_from_log(seed_path, query_field)
+    if _prefetcher is None:
+        _prefetcher = Prefetcher()
+    _prefetcher.start()
+    return _prefetcher
+
+
+def stop_prefetcher() -> None:
+    if _prefetcher is not None:
+        _prefetcher.stop()
+
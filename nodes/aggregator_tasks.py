@@ -1,78 +1,293 @@
 
+import re
+import asyncio
 import logging
-from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
+from typing import AsyncIterator
+from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
+from langgraph.config import get_stream_writer
 from core.agent_state import AgentState  # Ajustar según sea necesario
+from core.instrumentation import record_history
+from core.llm import get_llm
+from core.deadline import acall_with_timeout, call_with_timeout, remaining
 
 # ----- Configurar logging -----
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached, astream_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Cargar variables de entorno -----
-load_dotenv(dotenv_path='env')
-
-# Instancia global de LLM
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
-# Plantilla para "enchulamiento"
+# Plantilla para "enchulamiento" de todos los resultados en una sola llamada.
+# Cada sección empieza con "### <tarea>" para poder separarlas (y transmitirlas) por tarea.
 enchulador_template = PromptTemplate(
-    input_variables=["mensaje"],
+    input_variables=["secciones"],
     template="""
-Enchula el siguiente mensaje para hacerlo amigable para el usuario:
+Enchula los siguientes mensajes para hacerlos amigables para el usuario.
+Responde con una sección por mensaje, en el mismo orden, y empieza cada sección
+con una línea que contenga solo su encabezado tal cual (por ejemplo "### weather").
+No agregues texto fuera de las secciones.
 
-{mensaje}
+{secciones}
 """
 )
 
-def aggregator(state: AgentState) -> AgentState:
-    """
-    Reformula resultados exitosos con el LLM y agrega errores directamente.
-    Devuelve mensajes listos para mostrar al usuario.
+# Encabezado de sección en la respuesta del modelo: "### weather"
+_HEADER_RE = re.compile(r"^#{1,6}\s*(\w+)\s*$")
 
-    Args:
-        state (dict): Contiene 'order_task', 'results', 'error'.
+class _SectionParser:
+    """
+    Separa incrementalmente la respuesta del modelo en secciones por tarea.
 
-    Returns:
-        dict: {"results": {"aggregator": [messages]}, "task_completed":  {}}
+    `feed` recibe fragmentos de texto (tokens) y devuelve eventos:
+    {"type": "token", "task", "text"} para el texto de cada sección según llega y
+    {"type": "section", "task", "text"} cuando una sección termina. Las líneas que
+    empiezan con "#" se retienen hasta completarse para no emitir encabezados.
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_aggregator")
-    processed_messages = []
 
-    logger.info("Iniciando agregación de tareas...")
+    def __init__(self, tasks: list):
+        self.tasks = tasks
+        self.sections = {}
+        # Con una sola tarea no hace falta encabezado
+        self.task = tasks[0] if len(tasks) == 1 else None
+        self.current = []
+        self.pending = ""
+        self.at_line_start = True
+
+    def feed(self, chunk: str) -> list:
+        events = []
+        self.pending += chunk
+        while self.pending:
+            newline = self.pending.find("\n")
+            if newline == -1:
+                if self.at_line_start and (not self.pending.strip() or self.pending.lstrip().startswith("#")):
+                    break  # Puede ser el inicio de un encabezado: esperar el resto de la línea
+                events += self._body(self.pending)
+                self.pending = ""
+                self.at_line_start = False
+            else:
+                line, self.pending = self.pending[:newline + 1], self.pending[newline + 1:]
+                events += self._line(line) if self.at_line_start else self._body(line)
+                self.at_line_start = True
+        return events
+
+    def close(self) -> list:
+        events = []
+        if self.pending:
+            events += self._line(self.pending) if self.at_line_start else self._body(self.pending)
+            self.pending = ""
+        return events + self._finish_section()
+
+    def _line(self, line: str) -> list:
+        match = _HEADER_RE.match(line.strip())
+        if match and match.group(1) in self.tasks:
+            events = self._finish_section()
+            self.task = match.group(1)
+            return events
+        return self._body(line)
 
+    def _body(self, text: str) -> list:
+        if self.task is None or (not self.current and not text.strip()):
+            return []
+        if not self.current:
+            text = text.lstrip()
+        self.current.append(text)
+        return [{"type": "token", "task": self.task, "text": text}]
+
+    def _finish_section(self) -> list:
+        if self.task is None or not self.current:
+            return []
+        text = "".join(self.current).strip()
+        self.sections[self.task] = text
+        self.current = []
+        return [{"type": "section", "task": self.task, "text": text}]
+
+def _sorted_order(state: AgentState) -> list:
+    """
+    Devuelve las tareas de 'order_task' ordenadas por su posición.
+    """
     # Ordenar las tareas según el orden dado en el diccionario order_task
     # Ordenamos el diccionario order_task por los valores (el orden de las tareas)
     sorted_order = sorted(state.get("order_task", {}).items(), key=lambda item: item[1])
     logger.info("Orden detectado  %s", sorted_order)
+    return sorted_order
+
+def _raw_messages(state: AgentState) -> list:
+    """
+    Construye los mensajes en bruto ("Tarea: resultado") de las tareas exitosas, en orden.
+    """
+    mensajes = []
 
     # Iterar en el orden correcto
-    for task, order in sorted_order:
+    for task, order in _sorted_order(state):
         result = state.get("results", {}).get(task)
         error = state.get("error", {}).get(task)
 
-        logger.debug(f"Tarea: {task} | Orden: {order} | Resultado: {result} | Error: {error}")
-
+        logger.debug("Tarea: %s | Orden: %s | Resultado: %s | Error: %s", task, order, result, error)
 
         if result:
-            mensaje_bruto = f"{task.capitalize()}: {result}"
-            try:
-                prompt_text = enchulador_template.format(mensaje=mensaje_bruto)
-                prompt = HumanMessage(content=prompt_text)
-                response = llm.invoke([prompt])
-                friendly_text = response.content.strip()
-                logger.info(f"Mensaje procesado para '{task}': {friendly_text}")
-                processed_messages.append(friendly_text)
-            except Exception as e:
-                logger.exception(f"No se pudo reformular el mensaje para '{task}': {str(e)}")
-                processed_messages.append(mensaje_bruto)
+            mensajes.append((task, f"{task.capitalize()}: {result}"))
+    return mensajes
 
+def _batched_prompt(mensajes: list) -> HumanMessage:
+    """
+    Construye un único prompt con todas las secciones en el orden de 'order_task'.
+    """
+    secciones = "\n\n".join(f"### {task}\n{mensaje_bruto}" for task, mensaje_bruto in mensajes)
+    prompt_text = enchulador_template.format(secciones=secciones)
+    log_prompt(logger, "Prompt de agregación:\n%s", prompt_text)
+    return HumanMessage(content=prompt_text)
+
+def _final_messages(mensajes: list, sections: dict) -> list:
+    """
+    Mensajes finales en orden; si el modelo omitió una sección se usa el mensaje en bruto.
+    """
+    processed_messages = []
+    for task, mensaje_bruto in mensajes:
+        friendly_text = sections.get(task)
+        if friendly_text:
+            logger.info("Mensaje procesado para '%s': %s", task, friendly_text)
+            processed_messages.append(friendly_text)
+        else:
+            logger.warning("El modelo no devolvió la sección '%s'; se usa el mensaje en bruto", task)
+            processed_messages.append(mensaje_bruto)
+    return processed_messages
+
+def _aggregated_update(processed_messages: list) -> AgentState:
     # Retornar solo el formato correcto, sin modificar el state
     return {
         "results": {"aggregator": processed_messages},
         "task_completed": {'aggregator':True}
     }
+
+def _parse_sections(mensajes: list, content: str) -> dict:
+    parser = _SectionParser([task for task, _ in mensajes])
+    parser.feed(content)
+    parser.close()
+    return parser.sections
+
+@record_history("task_aggregator")
+def aggregator(state: AgentState) -> AgentState:
+    """
+    Reformula todos los resultados exitosos con una sola llamada al LLM.
+    Devuelve mensajes listos para mostrar al usuario, en el orden de 'order_task'.
+
+    Args:
+        state (dict): Contiene 'order_task', 'results', 'error'.
+
+    Returns:
+        dict: {"results": {"aggregator": [messages]}, "task_completed":  {}}
+    """
+
+    logger.info("Iniciando agregación de tareas...")
+    mensajes = _raw_messages(state)
+    if not mensajes:
+        return _aggregated_update([])
+
+    try:
+        # Lo que quede del presupuesto de la consulta; sin tiempo se usan los mensajes en bruto
+        response = call_with_timeout(
+            lambda: invoke_cached(get_llm("aggregator"), [_batched_prompt(mensajes)], node="aggregator"),
+            remaining(state),
+        )
+        sections = _parse_sections(mensajes, response.content)
+    except TimeoutError:
+        logger.warning("La agregación superó el plazo de la consulta; se devuelven los mensajes sin reformular")
+        sections = {}
+    except Exception as e:
+        logger.exception("No se pudieron reformular los mensajes: %s", str(e))
+        sections = {}
+
+    return _aggregated_update(_final_messages(mensajes, sections))
+
+@record_history("task_aggregator")
+async def aaggregator(state: AgentState) -> AgentState:
+    """
+    Versión asíncrona de `aggregator`: una sola llamada con `ainvoke`.
+
+    Args:
+        state (dict): Contiene 'order_task', 'results', 'error'.
+
+    Returns:
+        dict: {"results": {"aggregator": [messages]}, "task_completed":  {}}
+    """
+
+    logger.info("Iniciando agregación de tareas...")
+    mensajes = _raw_messages(state)
+    if not mensajes:
+        return _aggregated_update([])
+
+    try:
+        # Lo que quede del presupuesto de la consulta; sin tiempo se usan los mensajes en bruto
+        response = await acall_with_timeout(
+            ainvoke_cached(get_llm("aggregator"), [_batched_prompt(mensajes)], node="aggregator"),
+            remaining(state),
+        )
+        sections = _parse_sections(mensajes, response.content)
+    except TimeoutError:
+        logger.warning("La agregación superó el plazo de la consulta; se devuelven los mensajes sin reformular")
+        sections = {}
+    except Exception as e:
+        logger.exception("No se pudieron reformular los mensajes: %s", str(e))
+        sections = {}
+
+    return _aggregated_update(_final_messages(mensajes, sections))
+
+# ----- Modo streaming -----
+async def astream_aggregator(state: AgentState) -> AsyncIterator[dict]:
+    """
+    Igual que `aaggregator`, pero transmite la respuesta mientras el modelo la genera.
+
+    Produce eventos:
+        {"type": "token", "task": ..., "text": ...}    por cada fragmento de texto
+        {"type": "section", "task": ..., "text": ...}  cuando termina la sección de una tarea
+        {"type": "done", "messages": [...]}            con los mensajes finales en orden
+
+    Si se acaba el plazo de la consulta se deja de esperar al modelo: las secciones ya
+    completas se conservan y las demás usan el mensaje en bruto.
+    """
+    mensajes = _raw_messages(state)
+    parser = _SectionParser([task for task, _ in mensajes])
+    if mensajes:
+        chunks = astream_cached(get_llm("aggregator"), [_batched_prompt(mensajes)], node="aggregator")
+        try:
+            while True:
+                left = remaining(state)
+                if left is not None and left <= 0:
+                    raise TimeoutError("deadline already passed")
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), left)
+                except StopAsyncIteration:
+                    break
+                for event in parser.feed(chunk.content):
+                    yield event
+            for event in parser.close():
+                yield event
+        except (TimeoutError, asyncio.TimeoutError):
+            logger.warning("La agregación superó el plazo de la consulta; las secciones sin terminar van en bruto")
+        except Exception as e:
+            logger.exception("Se interrumpió la transmisión de la agregación: %s", str(e))
+        finally:
+            await chunks.aclose()
+
+    yield {"type": "done", "messages": _final_messages(mensajes, parser.sections)}
+
+@record_history("task_aggregator")
+async def astreaming_aggregator(state: AgentState) -> AgentState:
+    """
+    Nodo de agregación del grafo de `core.engine.astream`: como `aaggregator`, pero la
+    respuesta se genera con `astream_aggregator` y sus eventos `token` y `section` salen
+    por el modo de stream "custom" del grafo según llegan.
+
+    Returns:
+        dict: {"results": {"aggregator": [messages]}, "task_completed":  {}}
+    """
+    logger.info("Iniciando agregación de tareas (streaming)...")
+    writer = get_stream_writer()
+    processed_messages = []
+    async for event in astream_aggregator(state):
+        if event["type"] == "done":
+            processed_messages = event["messages"]
+        else:
+            writer(event)
+    return _aggregated_update(processed_messages)
@@ -1,23 +1,22 @@
-from dotenv import load_dotenv
 
+import os
 import logging
+import threading
+from collections import Counter
 from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_openai import ChatOpenAI
 from typing import cast
 from core.agent_state import AgentState
+from core.instrumentation import record_history
+from core.llm import get_llm
+from utils.task_lexicon import TASK_KEYWORDS, score_tasks
 import json
 
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Cargar variables de entorno -----
-load_dotenv(dotenv_path='env')
-
-# Global LLM instance
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 
 # ----- System message (prompt) -----
 system_prompt = SystemMessage(
@@ -29,50 +28,165 @@ Ejemplo de respuesta: {"weather": true, "exchange": false, "news": true}
 """
 )
 
+# ----- Clasificador por reglas -----
+# Si la confianza de las reglas alcanza este umbral no se llama al LLM.
+RULES_MIN_CONFIDENCE = float(os.getenv("CLASSIFY_RULES_MIN_CONFIDENCE", "0.8"))
+
+# Cuántos mensajes resolvió cada camino: "rules", "llm" o "rules_fallback" (LLM fallido)
+classifier_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _record(path: str) -> None:
+    with _stats_lock:
+        classifier_stats[path] += 1
+
+def classify_with_rules(text: str) -> tuple[dict[str, bool], float]:
+    """
+    Clasifica el mensaje con el léxico de tareas, sin llamar al LLM.
+
+    Una tarea está presente si su puntuación llega a 0.5. La confianza es la
+    certeza de la tarea más dudosa: 1.0 cuando cada puntuación es 0 o 1.0, y
+    0 si no se detecta ninguna tarea (el mensaje se deja al LLM).
+
+    Returns:
+        tuple: ({"weather": bool, "exchange": bool, "news": bool}, confianza entre 0 y 1)
+    """
+    scores = score_tasks(text)
+    classification = {task: scores[task] >= 0.5 for task in TASK_KEYWORDS}
+    if not any(classification.values()):
+        return classification, 0.0
+
+    confidence = min(max(score, 1.0 - score) for score in scores.values())
+    logger.debug("Puntuación por reglas: %s (confianza %.2f)", scores, confidence)
+    return classification, confidence
+
+# ----- Helpers compartidos por las versiones sync y async -----
+def _last_user_message(state: AgentState) -> HumanMessage:
+    """
+    Devuelve el último mensaje del usuario (HumanMessage) del estado.
+    """
+    logger.debug("Buscando el último mensaje del usuario...")
+    user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
+    logger.info("Mensaje recibido: %s", user_msg.content)
+    return user_msg
+
+def _classification_update(state: AgentState, content: str) -> AgentState:
+    """
+    Convierte la respuesta JSON del modelo en la actualización del estado.
+    """
+    classification = json.loads(content)
+    classification = cast(dict, classification)
+    return _classification_result(state, classification)
+
+def _classification_result(state: AgentState, classification: dict) -> AgentState:
+    """
+    Construye la actualización del estado a partir de una clasificación.
+    """
+    logger.info("Tareas clasificadas: %s", classification)
+
+    new_state = {
+        "tasks_to_do": classification,
+        "results": state.get("results", {}),
+        "task_completed": {},
+        "error": {},
+        "order_task": {},
+        "ready_to_aggregate": False,
+    }
+
+    logger.debug("Estado actualizado correctamente.")
+    return new_state
+
+def _rules_if_confident(state: AgentState, user_msg: HumanMessage):
+    """
+    Devuelve (actualización o None, clasificación por reglas). La actualización solo
+    existe cuando las reglas son suficientemente confiables para omitir el LLM.
+    """
+    classification, confidence = classify_with_rules(user_msg.content)
+    if confidence >= RULES_MIN_CONFIDENCE:
+        logger.info("Clasificación por reglas (confianza %.2f)", confidence)
+        _record("rules")
+        return _classification_result(state, classification), classification
+    logger.debug("Reglas poco confiables (%.2f); se consulta al modelo", confidence)
+    return None, classification
+
+def _classification_fallback(state: AgentState, rules: dict, e: Exception) -> AgentState:
+    """
+    Si el LLM falla (p. ej. JSON malformado) pero las reglas detectaron alguna
+    tarea, se usa la clasificación por reglas en lugar del camino de error.
+    """
+    if rules and any(rules.values()):
+        logger.warning("Fallo del modelo (%s); se usa la clasificación por reglas", e)
+        _record("rules_fallback")
+        return _classification_result(state, rules)
+    return _classification_error(state, e)
+
+def _classification_error(state: AgentState, e: Exception) -> AgentState:
+    """
+    Actualización del estado cuando la clasificación falla.
+    """
+    error_msg = f"classify: {str(e)}"
+    logger.exception("Error al clasificar el mensaje del usuario.")
+    return {
+        "messages": state["messages"] + [SystemMessage(content=error_msg)],
+        "results": state.get("results", {}),
+        "tasks_to_do": {},
+        "error": {"classify": error_msg},
+        "order_task": {},
+        "ready_to_aggregate": False,
+        "task_completed": {}
+    }
+
 # ----- Node: classify_tasks -----
+@record_history("classify_tasks")
 def classify_tasks(state: AgentState) -> AgentState:
     """
-    Clasifica la intención del usuario en categorías predefinidas
-    usando un modelo de lenguaje y actualiza el estado.
+    Clasifica la intención del usuario en categorías predefinidas y actualiza el estado.
+    Primero aplica el clasificador por reglas; solo los mensajes ambiguos
+    se envían al modelo de lenguaje.
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("classify_tasks")
+    rules = None
     try:
-        logger.debug("Buscando el último mensaje del usuario...")
-        user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
-        logger.info(f"Mensaje recibido: {user_msg.content}")
+        user_msg = _last_user_message(state)
+        update, rules = _rules_if_confident(state, user_msg)
+        if update:
+            return update
 
         full_prompt = [system_prompt, user_msg]
 
         logger.debug("Enviando prompt al modelo...")
-        response = llm.invoke(full_prompt)
-        logger.debug(f"Respuesta del modelo: {response.content}")
+        response = invoke_cached(get_llm("classify"), full_prompt, node="classify")
+        log_prompt(logger, "Respuesta del modelo: %s", response.content)
+
+        update = _classification_update(state, response.content)
+        _record("llm")
+        return update
+
+    except Exception as e:
+        return _classification_fallback(state, rules, e)
+
+# ----- Node: aclassify_tasks -----
+@record_history("classify_tasks")
+async def aclassify_tasks(state: AgentState) -> AgentState:
+    """
+    Versión asíncrona de `classify_tasks`: espera al modelo con `ainvoke`
+    para no bloquear el event loop cuando el grafo se ejecuta con `app.ainvoke`.
+    """
+    rules = None
+    try:
+        user_msg = _last_user_message(state)
+        update, rules = _rules_if_confident(state, user_msg)
+        if update:
+            return update
 
-        classification = json.loads(response.content)
-        classification = cast(dict, classification)
-        logger.info(f"Tareas clasificadas: {classification}")
+        full_prompt = [system_prompt, user_msg]
 
-        new_state = {
-            "tasks_to_do": classification,
-            "results": state.get("results", {}),
-            "task_completed": {},
-            "error": {},
-            "order_task": {},
-            "ready_to_aggregate": False,
-        }
+        logger.debug("Enviando prompt al modelo...")
+        response = await ainvoke_cached(get_llm("classify"), full_prompt, node="classify")
+        log_prompt(logger, "Respuesta del modelo: %s", response.content)
 
-        logger.debug("Estado actualizado correctamente.")
-        return new_state
+        update = _classification_update(state, response.content)
+        _record("llm")
+        return update
 
     except Exception as e:
-        error_msg = f"classify: {str(e)}"
-        logger.exception("Error al clasificar el mensaje del usuario.")
-        return {
-            "messages": state["messages"] + [SystemMessage(content=error_msg)],
-            "results": state.get("results", {}),
-            "tasks_to_do": {},
-            "error": {"classify": error_msg},
-            "order_task": {},
-            "ready_to_aggregate": False,
-            "task_completed": {}
-        }
+        return _classification_fallback(state, rules, e)
@@ -1,23 +1,20 @@
 
 import logging
-from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
 from core.agent_state import AgentState  # Adjust if needed
-from langchain_openai import ChatOpenAI
+from core.instrumentation import record_history
+from core.llm import get_llm
+from core.deadline import acall_with_timeout, call_with_timeout, remaining
+from utils.error_catalog import detect_locale, render_error
 
 # ----- Configurar logging -----
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Cargar variables de entorno -----
-load_dotenv(dotenv_path='env')
-
-# Global LLM instance
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 # ----- Error Interpretation Prompt -----
 error_handler_template = PromptTemplate(
     input_variables=["error", "original_text"],
@@ -38,51 +35,190 @@ Devuelve solo el texto final para el usuario, no incluyas explicaciones adiciona
 """
 )
 
+# Varios errores desconocidos se explican juntos en una sola llamada, una sección por fuente
+error_batch_template = PromptTemplate(
+    input_variables=["errores", "original_text"],
+    template="""
+Eres un asistente experto en interpretar errores de sistemas que consultan datos sobre clima, noticias y divisas.
+
+Mensaje original del usuario:
+"{original_text}"
+
+Errores del sistema, cada uno bajo el encabezado "### <fuente>":
+{errores}
+
+Para cada error:
+1. Si hay nombres de ciudades, países o monedas abreviados (como 'UK', 'US', 'EUR'), proporciónalos en su forma completa y clara.
+2. Genera una explicación amigable del error para el usuario.
+3. Sugiere una alternativa y que vuelva a hacer la petición con la recomendación asociada.
+Responde con una sección por error, en el mismo orden, empezando cada una con su línea "### <fuente>"
+y debajo solo el texto final para el usuario, sin explicaciones adicionales.
+"""
+)
+
+# ----- Helpers shared by the sync and async error handlers -----
+def pending_errors(state: AgentState) -> list[str]:
+    """
+    Sources whose error has not been explained yet: an error is handled once its source has
+    an entry in `results` (the reducers only merge, so handled errors are never removed).
+    """
+    results = state.get("results", {})
+    return [source for source in state.get("error", {}) if source not in results]
+
+def _user_input(state: AgentState) -> str:
+    return state["messages"][-1].content if state.get("messages") else ""
+
+def _from_catalog(state: AgentState) -> tuple[dict[str, str], dict[str, str]]:
+    """
+    Explains every pending error it can with the template catalog (no LLM).
+
+    Returns:
+        tuple: ({source: friendly message}, {source: raw error} of the unknown errors)
+    """
+    errores = state.get("error", {})
+    locale = detect_locale(_user_input(state))
+    explained, unknown = {}, {}
+    for source in pending_errors(state):
+        raw_error = errores.get(source) or "Error no especificado"
+        message = render_error(source, raw_error, locale)
+        if message:
+            logger.info("Error de '%s' explicado con plantilla: %s", source, raw_error)
+            explained[source] = message
+        else:
+            unknown[source] = raw_error
+    return explained, unknown
+
+def _unknown_prompt(unknown: dict[str, str], user_input: str) -> HumanMessage:
+    """
+    Prompt for the errors the catalog does not know: the single-error prompt for one,
+    the batched prompt (one "### <fuente>" section each) for several.
+    """
+    if len(unknown) == 1:
+        prompt = error_handler_template.format(error=next(iter(unknown.values())), original_text=user_input)
+    else:
+        errores = "\n\n".join(f"### {source}\n{raw_error}" for source, raw_error in unknown.items())
+        prompt = error_batch_template.format(errores=errores, original_text=user_input)
+    log_prompt(logger, "Prompt generado para el LLM:\n%s", prompt)
+    return HumanMessage(content=prompt)
+
+def _parse_explanations(unknown: dict[str, str], content: str) -> dict[str, str]:
+    """
+    Splits the model's answer into one message per source. A section the model left out
+    falls back to the raw error.
+    """
+    if len(unknown) == 1:
+        return {next(iter(unknown)): content.strip()}
+
+    sections: dict[str, list[str]] = {}
+    current = None
+    for line in content.splitlines():
+        header = line.strip()
+        if header.startswith("###") and header[3:].strip() in unknown:
+            current = header[3:].strip()
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+
+    explained = {}
+    for source, raw_error in unknown.items():
+        text = "\n".join(sections.get(source, [])).strip()
+        if not text:
+            logger.warning("El modelo no devolvió la sección '%s'; se usa el error en bruto", source)
+        explained[source] = text or raw_error
+    return explained
+
+def _llm_failed(unknown: dict[str, str], e: Exception) -> dict[str, str]:
+    if isinstance(e, TimeoutError):
+        # Sin presupuesto para explicar los errores: se muestran tal cual
+        logger.warning("La explicación de %s superó el plazo de la consulta", list(unknown))
+        return dict(unknown)
+    logger.exception("No se pudieron explicar los errores con el LLM")
+    return {
+        source: f"No se pudo procesar el error automáticamente. Detalles: {raw_error}"
+        for source, raw_error in unknown.items()
+    }
+
+def _handled_update(explained: dict[str, str]) -> AgentState:
+    """
+    Builds the state update once every pending error has a friendly message.
+    The entries in `results` mark the errors as handled.
+    """
+    for source, message in explained.items():
+        logger.info("Mensaje amigable para '%s': %s", source, message)
+    return {
+        "results": {source: [message] for source, message in explained.items()},
+        "task_completed": {source: True for source in explained},
+    }
+
+def _fallback_update(state: AgentState, e: Exception) -> AgentState:
+    """
+    State update returned when the error handler itself fails. The raw errors are still
+    recorded as results so the graph does not route back here for the same sources.
+    """
+    logger.exception("Error en el manejador de errores")
+    fallback_message = f"No se pudo procesar el error automáticamente. Detalles: {str(e)}"
+    pendientes = pending_errors(state) or ["error"]
+    return {
+        "results": {source: [fallback_message] for source in pendientes},
+        "task_completed": {source: True for source in pendientes},
+    }
+
 # ----- Error Handler Node -----
+@record_history("task_error")
 def error_handler(state: AgentState) -> AgentState:
     """
-    Uses LLM to transform technical error messages into user-friendly suggestions.
+    Turns every pending technical error into a user-friendly suggestion in one pass.
+    Known errors come from the template catalog (utils.error_catalog); the rest are
+    explained together with a single LLM call.
 
     Parameters:
         state (AgentState): The shared graph state including error and last message.
 
     Returns:
-        dict: {"results": {...}, "task_completed": {...}, "error": {...}}
+        dict: {"results": {source: [message], ...}, "task_completed": {source: True, ...}}
     """
-
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_error")
     try:
-        user_input = state["messages"][-1].content if state.get("messages") else ""
-
-        errores = state.get("error", {})
-        nodo_source = next(iter(errores), "desconocido")  # Tomamos la primera clave
-        raw_error = errores.get(nodo_source, "Error no especificado")
+        explained, unknown = _from_catalog(state)
+        if unknown:
+            prompt = _unknown_prompt(unknown, _user_input(state))
+            try:
+                response = call_with_timeout(
+                    lambda: invoke_cached(get_llm("error_handler"), [prompt], node="error_handler"),
+                    remaining(state),
+                )
+                explained.update(_parse_explanations(unknown, response.content))
+            except Exception as e:
+                explained.update(_llm_failed(unknown, e))
+        return _handled_update(explained)
 
-        logger.info(f"Procesando error desde el nodo '{nodo_source}': {raw_error}")
+    except Exception as e:
+        return _fallback_update(state, e)
 
-        prompt = error_handler_template.format(
-            error=raw_error,
-            original_text=user_input
-        )
-        logger.debug(f"Prompt generado para el LLM:\n{prompt}")
-        response = llm.invoke([HumanMessage(content=prompt)])
-        friendly_message = response.content.strip()
+# ----- Async Error Handler Node -----
+@record_history("task_error")
+async def aerror_handler(state: AgentState) -> AgentState:
+    """
+    Async version of `error_handler`, awaiting the model with `ainvoke`.
 
-        # Remover la clave procesada
-        errores.pop(nodo_source, None)
+    Parameters:
+        state (AgentState): The shared graph state including error and last message.
 
-        logger.info(f"Mensaje amigable generado: {friendly_message}")
-        return {
-            "results": {nodo_source: [friendly_message]},
-            "task_completed": {nodo_source: True},
-            "error": { "error": errores } # Retornamos el dict sin la clave ya procesada
-        }
+    Returns:
+        dict: {"results": {source: [message], ...}, "task_completed": {source: True, ...}}
+    """
+    try:
+        explained, unknown = _from_catalog(state)
+        if unknown:
+            prompt = _unknown_prompt(unknown, _user_input(state))
+            try:
+                response = await acall_with_timeout(
+                    ainvoke_cached(get_llm("error_handler"), [prompt], node="error_handler"),
+                    remaining(state),
+                )
+                explained.update(_parse_explanations(unknown, response.content))
+            except Exception as e:
+                explained.update(_llm_failed(unknown, e))
+        return _handled_update(explained)
 
     except Exception as e:
-        logger.exception("Error en el manejador de errores")
-        fallback_message = f"No se pudo procesar el error automáticamente. Detalles: {str(e)}"
-        return {
-            "results": {"error": [fallback_message]},
-            "task_completed": {'error': True}
-        }
+        return _fallback_update(state, e)
@@ -1,24 +1,22 @@
 
+import os
 import json
 import logging
-from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
+from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import HumanMessage
 from core.agent_state import AgentState
-from langchain_openai import ChatOpenAI
+from core.instrumentation import record_history
+from core.llm import get_llm
+from utils.gazetteer import gazetteer
+from utils.task_lexicon import TASK_KEYWORDS, scan_tasks
 
 # ----- Configurar logging -----
-from utils.logging import setup_logging
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
 
 # Initialize logger using the setup_logging function
 logger = setup_logging()
 
-# ----- Cargar variables de entorno -----
-load_dotenv(dotenv_path='env')
-
-# Global LLM instance
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
-
 # ----- Task Ordering Prompt -----
 order_tasks_template = PromptTemplate(
     input_variables=["tasks", "user_input"],
@@ -39,46 +37,164 @@ No incluyas ningún otro texto ni explicaciones.
 """
 )
 
+# ----- Deterministic ordering -----
+# The LLM is only consulted, when enabled, for tasks that cannot be located in the text.
+LLM_TIEBREAK = os.getenv("ORDER_TASKS_LLM_TIEBREAK", "False").strip().lower() == "true"
+
+# Entity kinds that place a task when none of its trigger words appear
+ENTITY_TASKS = {"city": "weather", "currency": "exchange", "country": "news"}
+
+def mention_offsets(text: str, tasks: list[str]) -> dict[str, int]:
+    """
+    Returns the character offset of the first mention of each task in `text`.
+
+    Trigger words ("clima", "tipo de cambio", "noticias"...) take precedence; a task
+    without trigger words is placed at its first entity (city, currency or country).
+    Tasks that cannot be located are left out.
+    """
+    offsets = {}
+    for mention in scan_tasks(text):
+        if mention.task in tasks:
+            offsets.setdefault(mention.task, mention.start)
+
+    entity_offsets = {}
+    for mention in gazetteer.scan(text):
+        entity_offsets.setdefault(ENTITY_TASKS[mention.kind], mention.start)
+    for task in tasks:
+        if task not in offsets and task in entity_offsets:
+            offsets[task] = entity_offsets[task]
+    return offsets
+
+def order_by_mentions(text: str, tasks: list[str]) -> tuple[dict[str, int], list[str]]:
+    """
+    Orders `tasks` by where they are mentioned in `text`.
+
+    Returns:
+        tuple: ({task: position starting at 1}, tasks that could not be located).
+               Unlocated tasks are appended after the located ones in canonical order.
+    """
+    offsets = mention_offsets(text, tasks)
+    located = sorted((task for task in tasks if task in offsets), key=offsets.get)
+    unlocated = [task for task in TASK_KEYWORDS if task in tasks and task not in offsets]
+    unlocated += [task for task in tasks if task not in TASK_KEYWORDS and task not in offsets]
+    ordered = located + unlocated
+    return {task: position for position, task in enumerate(ordered, start=1)}, unlocated
+
+# ----- Helpers shared by the sync and async ordering nodes -----
+def _requested_tasks(state: AgentState) -> tuple[list[str], str]:
+    """
+    Returns the tasks marked in 'tasks_to_do' and the user's query.
+    """
+    tasks = [k for k, v in state.get("tasks_to_do", {}).items() if v]
+    user_input = state["messages"][-1].content if state.get("messages") else ""
+
+    logger.info("Tareas detectadas: %s", tasks)
+    logger.debug("Consulta del usuario: %s", user_input)
+    return tasks, user_input
+
+def _needs_tiebreak(tasks: list[str], unlocated: list[str]) -> bool:
+    return LLM_TIEBREAK and len(tasks) > 1 and bool(unlocated)
+
+def _ordering_prompt(tasks: list[str], user_input: str) -> str:
+    """
+    Builds the ordering prompt from the detected tasks and the user's query.
+    """
+    prompt = order_tasks_template.format(
+        tasks=", ".join(tasks),
+        user_input=user_input
+    )
+    log_prompt(logger, "Prompt generado para el LLM:\n%s", prompt)
+    return prompt
+
+def _ordering_update(order: dict) -> AgentState:
+    """
+    Builds the 'order_task' state update.
+    """
+    return {
+        "order_task":  order,
+        "task_completed": {'order':True}
+    }
+
+def _tiebreak_update(content: str, tasks: list[str], fallback: dict) -> AgentState:
+    """
+    Parses the LLM answer; keeps the deterministic order if it does not cover every task.
+    """
+    try:
+        ordered_dict = json.loads(content.strip())
+    except ValueError:
+        logger.warning("Respuesta de desempate inválida: %s", content)
+        return _ordering_update(fallback)
+
+    if set(ordered_dict) != set(tasks):
+        logger.warning("El desempate del LLM no cubre las tareas %s: %s", tasks, ordered_dict)
+        return _ordering_update(fallback)
+
+    logger.info("Orden propuesto por LLM: %s", ordered_dict)
+    return _ordering_update(ordered_dict)
+
+def _ordering_error(e: Exception) -> AgentState:
+    """
+    State update returned when the tasks could not be ordered.
+    """
+    error_msg = f"Error al ordenar tareas: {str(e)}"
+    logger.exception(error_msg)
+    return {
+        "task_completed": {'order':False},
+        "error": {"order": error_msg}
+    }
+
 # ----- Task Ordering Node -----
+@record_history("task_order")
 def order_tasks(state: AgentState) -> AgentState:
     """
-    Orders tasks based on the user's input and their intent, helping to prioritize actions.
+    Orders tasks by the position where each one is first mentioned in the user's input.
+    The LLM is only used as an opt-in tie-breaker (ORDER_TASKS_LLM_TIEBREAK=true) for
+    tasks that cannot be located in the text.
 
     Parameters:
-        state (AgentState): The shared state that includes tasks and the user's query.
+        state (AgentState): The shared state that includes 'tasks_to_do' and the user's query.
 
     Returns:
-        dict: {"results": {"order": ...}, "task_completed": {"order": True}}
+        dict: {"order_task": {...}, "task_completed": {"order": True}}
     """
-    # Añadir trazabilidad del nodo
-    state.setdefault("history", []).append("task_order")
-    tasks = {k: v for k, v in state.get("tasks", {}).items() if v}
-    user_input = state["messages"][-1].content if state.get("messages") else ""
-
-    logger.info(f"Tareas detectadas: {list(tasks.keys())}")
-    logger.debug(f"Consulta del usuario: {user_input}")
 
     try:
-        prompt = order_tasks_template.format(
-            tasks=", ".join(tasks.keys()),
-            user_input=user_input
-        )
-        logger.debug(f"Prompt generado para el LLM:\n{prompt}")
+        tasks, user_input = _requested_tasks(state)
+        order, unlocated = order_by_mentions(user_input, tasks)
+        logger.info("Orden por posición en el texto: %s", order)
+
+        if _needs_tiebreak(tasks, unlocated):
+            response = invoke_cached(get_llm("order"), [HumanMessage(content=_ordering_prompt(tasks, user_input))], node="order")
+            return _tiebreak_update(response.content, tasks, order)
 
-        response = llm.invoke([HumanMessage(content=prompt)])
-        ordered_dict = json.loads(response.content.strip())
+        return _ordering_update(order)
+
+    except Exception as e:
+        return _ordering_error(e)
+
+# ----- Async Task Ordering Node -----
+@record_history("task_order")
+async def aorder_tasks(state: AgentState) -> AgentState:
+    """
+    Async version of `order_tasks`; the optional tie-break call is awaited with `ainvoke`.
+
+    Parameters:
+        state (AgentState): The shared state that includes 'tasks_to_do' and the user's query.
+
+    Returns:
+        dict: {"order_task": {...}, "task_completed": {"order": True}}
+    """
+
+    try:
+        tasks, user_input = _requested_tasks(state)
+        order, unlocated = order_by_mentions(user_input, tasks)
+        logger.info("Orden por posición en el texto: %s", order)
 
-        logger.info(f"Orden propuesto por LLM: {ordered_dict}")
+        if _needs_tiebreak(tasks, unlocated):
+            response = await ainvoke_cached(get_llm("order"), [HumanMessage(content=_ordering_prompt(tasks, user_input))], node="order")
+            return _tiebreak_update(response.content, tasks, order)
 
-        return {
-            "order_task":  ordered_dict,
-            "task_completed": {'order':True}
-        }
+        return _ordering_update(order)
 
     except Exception as e:
-        error_msg = f"Error al ordenar tareas: {str(e)}"
-        logger.exception(error_msg)
-        return {
-            "task_completed": {'order':False},
-            "error": {"order": error_msg}
-        }
+        return _ordering_error(e)
@@ -0,0 +1,267 @@
+
+import json
+import logging
+import threading
+from collections import Counter
+from typing import Any, Optional
+from langchain_core.messages import SystemMessage, HumanMessage
+from core.agent_state import AgentState
+from core.instrumentation import record_history
+from core.llm import get_llm
+from nodes.classify_query import RULES_MIN_CONFIDENCE, classify_with_rules
+from nodes.order_tasks import order_by_mentions
+from utils.gazetteer import gazetteer
+
+from utils.llm_cache import invoke_cached, ainvoke_cached
+from utils.logging import log_prompt, setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# Tareas que el planificador puede devolver
+KNOWN_TASKS = ("weather", "exchange", "news")
+
+# ----- System message (prompt) -----
+# Una sola llamada sustituye a classify_tasks, order_tasks y a los extractores de cada agente.
+system_prompt = SystemMessage(
+    content="""
+Eres un asistente que planifica consultas sobre clima (weather), divisas (exchange) y noticias (news).
+Dado un mensaje del usuario, responde únicamente con un JSON con estas claves:
+- "tasks": lista de las tareas presentes ("weather", "exchange", "news") en el orden en que aparecen en el texto.
+- "cities": lista de ciudades en inglés americano para el clima, o null.
+- "currencies": lista de códigos ISO 4217 para el tipo de cambio, primero el de origen y después los de destino [origen, destino, ...], o null.
+- "countries": lista de códigos ISO 3166-1 alpha-2 en minúsculas para las noticias, o null.
+
+Ejemplos:
+Texto: "¿Cómo está el clima en Nueva York, cuánto vale el dólar en pesos mexicanos y qué noticias hay en Francia?"
+Respuesta: {"tasks": ["weather", "exchange", "news"], "cities": ["New York"], "currencies": ["USD", "MXN"], "countries": ["fr"]}
+Texto: "Clima en Madrid y Roma, y el dólar en euros y yenes"
+Respuesta: {"tasks": ["weather", "exchange"], "cities": ["Madrid", "Rome"], "currencies": ["USD", "EUR", "JPY"], "countries": null}
+"""
+)
+
+# ----- Plan por reglas -----
+# Cuántas consultas resolvió cada camino: "rules" (léxico + gazetteer, sin LLM) o "llm"
+planner_stats = Counter()
+_stats_lock = threading.Lock()
+
+def _record(path: str) -> None:
+    with _stats_lock:
+        planner_stats[path] += 1
+
+def plan_with_rules(text: str) -> Optional[dict[str, Any]]:
+    """
+    Arma el plan sin llamar al LLM: las tareas con el léxico (`classify_with_rules`), su orden
+    por la posición en el texto (`order_by_mentions`) y los argumentos con el gazetteer.
+
+    Devuelve None (y la consulta pasa al LLM) si la clasificación no alcanza
+    RULES_MIN_CONFIDENCE, si alguna tarea no se puede ubicar en el texto o si a alguna
+    tarea le falta su argumento (p. ej. una ciudad desconocida o una sola divisa).
+    """
+    classification, confidence = classify_with_rules(text)
+    if confidence < RULES_MIN_CONFIDENCE:
+        return None
+    tasks = [task for task in KNOWN_TASKS if classification.get(task)]
+    order, unlocated = order_by_mentions(text, tasks)
+    if unlocated:
+        return None
+
+    plan = {"tasks": sorted(tasks, key=order.get), "cities": None, "currencies": None, "countries": None}
+    if "weather" in tasks:
+        plan["cities"] = gazetteer.match_cities(text, strict=True) or None
+        if not plan["cities"]:
+            return None
+    if "exchange" in tasks:
+        currencies = gazetteer.match_exchange(text, strict=True)
+        if not currencies:
+            return None
+        plan["currencies"] = [currencies[0], *currencies[1]]
+    if "news" in tasks:
+        plan["countries"] = gazetteer.match_countries(text, strict=True) or None
+        if not plan["countries"]:
+            return None
+    return plan
+
+# ----- Validación de la respuesta del modelo -----
+def _as_list(value: Any) -> list:
+    # Acepta también un valor suelto ("city": "Madrid"), como en la versión anterior del prompt
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+def _clean_city(city: Any) -> Optional[str]:
+    if not isinstance(city, str):
+        return None
+    city = city.strip()
+    if len(city) < 2 or any(c in city for c in ['{', '}', '[', ']']):
+        return None
+    return city
+
+def _clean_cities(cities: Any) -> Optional[list[str]]:
+    cleaned = []
+    for city in map(_clean_city, _as_list(cities)):
+        if city and city not in cleaned:
+            cleaned.append(city)
+    return cleaned or None
+
+def _clean_currencies(currencies: Any) -> Optional[list[str]]:
+    if not isinstance(currencies, list):
+        return None
+    codes = []
+    for code in (str(code).strip().upper() for code in currencies):
+        if not (len(code) == 3 and code.isalpha()):
+            return None
+        if code not in codes:
+            codes.append(code)
+    return codes if len(codes) >= 2 else None
+
+def _clean_country(country: Any) -> Optional[str]:
+    if not isinstance(country, str):
+        return None
+    country = country.strip().lower()
+    if len(country) != 2 or not country.isalpha():
+        return None
+    return country
+
+def _clean_countries(countries: Any) -> Optional[list[str]]:
+    cleaned = []
+    for country in map(_clean_country, _as_list(countries)):
+        if country and country not in cleaned:
+            cleaned.append(country)
+    return cleaned or None
+
+def parse_plan(content: str) -> dict[str, Any]:
+    """
+    Convierte la respuesta JSON del modelo en un plan validado.
+
+    Returns:
+        dict: {"tasks": [...], "cities": [...], "currencies": [origen, destino, ...], "countries": [...]}
+    """
+    content = content.strip()
+    if content.startswith("```"):
+        # Algunos modelos envuelven el JSON en un bloque de código
+        content = content.strip("`").removeprefix("json").strip()
+    raw = json.loads(content)
+
+    tasks = []
+    for task in raw.get("tasks") or []:
+        if task in KNOWN_TASKS and task not in tasks:
+            tasks.append(task)
+
+    return {
+        "tasks": tasks,
+        "cities": _clean_cities(raw.get("cities", raw.get("city"))),
+        "currencies": _clean_currencies(raw.get("currencies")),
+        "countries": _clean_countries(raw.get("countries", raw.get("country"))),
+    }
+
+# ----- Helpers compartidos por las versiones sync y async -----
+def _plan_prompt(state: AgentState) -> list:
+    """
+    Construye el prompt del planificador a partir del último mensaje del usuario.
+    """
+    user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
+    logger.info("Mensaje recibido: %s", user_msg.content)
+    return [system_prompt, user_msg]
+
+def _rules_plan(state: AgentState) -> Optional[dict[str, Any]]:
+    """
+    Plan por reglas del último mensaje del usuario, o None si hay que preguntar al modelo.
+    """
+    user_msg = [m for m in state["messages"] if isinstance(m, HumanMessage)][-1]
+    plan = plan_with_rules(user_msg.content)
+    if plan is not None:
+        logger.info("Plan por reglas, sin LLM")
+        _record("rules")
+    else:
+        logger.debug("Reglas poco confiables; se consulta al modelo")
+        _record("llm")
+    return plan
+
+def _plan_update(state: AgentState, plan: dict[str, Any]) -> AgentState:
+    """
+    Traduce el plan a las claves de AgentState que usan el router, los agentes y el agregador.
+    """
+    logger.info("Plan de la consulta: %s", plan)
+
+    tasks = plan["tasks"]
+    entities = {}
+    if "weather" in tasks:
+        entities["cities"] = plan["cities"]
+    if "exchange" in tasks:
+        entities["currencies"] = plan["currencies"]
+    if "news" in tasks:
+        entities["countries"] = plan["countries"]
+
+    return {
+        "tasks_to_do": {task: task in tasks for task in KNOWN_TASKS},
+        "order_task": {task: position for position, task in enumerate(tasks, start=1)},
+        "entities": entities,
+        "results": state.get("results", {}),
+        "task_completed": {},
+        "error": {},
+        "ready_to_aggregate": False,
+    }
+
+def _plan_error(state: AgentState, e: Exception) -> AgentState:
+    """
+    Actualización del estado cuando el plan no se puede obtener.
+    """
+    error_msg = f"plan: {str(e)}"
+    logger.exception("Error al planificar la consulta del usuario.")
+    return {
+        "messages": state["messages"] + [SystemMessage(content=error_msg)],
+        "results": state.get("results", {}),
+        "tasks_to_do": {},
+        "error": {"plan": error_msg},
+        "order_task": {},
+        "ready_to_aggregate": False,
+        "task_completed": {}
+    }
+
+# ----- Node: plan_query -----
+@record_history("plan_query")
+def plan_query(state: AgentState) -> AgentState:
+    """
+    Obtiene las tareas, su orden y los argumentos de cada agente (ciudades, divisas y
+    países): primero con reglas (`plan_with_rules`) y, si no son concluyentes, en una sola
+    llamada al LLM. Sustituye a `classify_tasks` y `order_tasks`; los agentes leen sus
+    argumentos de `state["entities"]`.
+    """
+    try:
+        plan = _rules_plan(state)
+        if plan is not None:
+            return _plan_update(state, plan)
+
+        full_prompt = _plan_prompt(state)
+
+        logger.debug("Enviando prompt al modelo...")
+        response = invoke_cached(get_llm("plan"), full_prompt, node="plan")
+        log_prompt(logger, "Respuesta del modelo: %s", response.content)
+
+        return _plan_update(state, parse_plan(response.content))
+
+    except Exception as e:
+        return _plan_error(state, e)
+
+# ----- Node: aplan_query -----
+@record_history("plan_query")
+async def aplan_query(state: AgentState) -> AgentState:
+    """
+    Versión asíncrona de `plan_query`, espera al modelo con `ainvoke`.
+    """
+    try:
+        plan = _rules_plan(state)
+        if plan is not None:
+            return _plan_update(state, plan)
+
+        full_prompt = _plan_prompt(state)
+
+        logger.debug("Enviando prompt al modelo...")
+        response = await ainvoke_cached(get_llm("plan"), full_prompt, node="plan")
+        log_prompt(logger, "Respuesta del modelo: %s", response.content)
+
+        return _plan_update(state, parse_plan(response.content))
+
+    except Exception as e:
+        return _plan_error(state, e)
@@ -0,0 +1,7 @@
+import os
+
+# Offline and quiet: no OpenAI key is needed to import the modules under test, the LLM cache
+# never touches disk, and log records are not written while the tests run.
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("LLM_CACHE_ENABLED", "false")
+os.environ.setdefault("DISABLE_LOGGING", "true")
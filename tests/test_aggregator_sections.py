@@ -0,0 +1,53 @@
+from nodes.aggregator_tasks import _SectionParser
+
+
+def _feed_all(parser, chunks):
+    events = []
+    for chunk in chunks:
+        events += parser.feed(chunk)
+    return events + parser.close()
+
+
+def _sections(events):
+    return [(e["task"], e["text"]) for e in events if e["type"] == "section"]
+
+
+# ----- Sections -----
+def test_splits_sections_by_header():
+    parser = _SectionParser(["weather", "news"])
+    events = _feed_all(parser, ["### weather\nHace sol.\n### news\nNada nuevo.\n"])
+    assert _sections(events) == [("weather", "Hace sol."), ("news", "Nada nuevo.")]
+    assert parser.sections == {"weather": "Hace sol.", "news": "Nada nuevo."}
+
+
+def test_header_split_across_chunks_is_not_emitted_as_text():
+    text = "### weather\nHace sol en Madrid.\n\n### news\nNada nuevo.\n"
+    chunks = [text[i:i + 3] for i in range(0, len(text), 3)]
+    events = _feed_all(_SectionParser(["weather", "news"]), chunks)
+    tokens = "".join(e["text"] for e in events if e["type"] == "token")
+    assert "#" not in tokens
+    assert _sections(events) == [("weather", "Hace sol en Madrid."), ("news", "Nada nuevo.")]
+
+
+def test_tokens_stream_before_the_section_ends():
+    parser = _SectionParser(["weather", "news"])
+    events = parser.feed("### weather\nHace ")
+    assert events == [{"type": "token", "task": "weather", "text": "Hace "}]
+
+
+def test_single_task_needs_no_header():
+    events = _feed_all(_SectionParser(["weather"]), ["Hace ", "sol."])
+    assert _sections(events) == [("weather", "Hace sol.")]
+
+
+def test_preamble_is_dropped_and_unknown_headers_stay_in_the_body():
+    parser = _SectionParser(["weather", "news"])
+    events = _feed_all(parser, ["Aquí tienes:\n### weather\nSol.\n### otro\nX\n"])
+    # El texto antes del primer encabezado no pertenece a ninguna tarea
+    assert _sections(events) == [("weather", "Sol.\n### otro\nX")]
+
+
+def test_missing_section_is_absent():
+    parser = _SectionParser(["weather", "news"])
+    _feed_all(parser, ["### news\nNada nuevo."])
+    assert parser.sections == {"news": "Nada nuevo."}
@@ -0,0 +1,127 @@
+import pytest
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", window=60, min_calls=4, failure_rate=0.5, open_seconds=30)
+
+
+def _call(breaker, failed):
+    breaker.before_call()
+    breaker.record(failed)
+
+
+def _trip(breaker):
+    for _ in range(breaker.min_calls):
+        _call(breaker, failed=True)
+
+
+# ----- Closed -----
+def test_needs_min_calls_before_opening(breaker):
+    for _ in range(3):
+        _call(breaker, failed=True)
+    assert breaker.snapshot()["state"] == CLOSED
+    _call(breaker, failed=True)
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def test_opens_at_the_failure_rate(breaker):
+    for failed in (False, False, True):
+        _call(breaker, failed)
+    assert breaker.snapshot()["state"] == CLOSED
+    _call(breaker, failed=True)  # 2 of 4
+    assert breaker.snapshot()["state"] == OPEN
+
+
+def test_old_outcomes_leave_the_window(breaker, clock):
+    for _ in range(3):
+        _call(breaker, failed=True)
+    clock[0] += 61
+    _call(breaker, failed=True)
+    assert breaker.snapshot()["state"] == CLOSED
+    assert breaker.snapshot()["calls"] == 1
+
+
+def test_client_errors_do_not_count_as_failures(breaker):
+    for _ in range(4):
+        breaker.before_call()
+        breaker.record_status(404)
+    assert breaker.snapshot()["failures"] == 0
+    for _ in range(4):
+        breaker.before_call()
+        breaker.record_status(503)
+    assert breaker.snapshot()["state"] == OPEN
+
+
+# ----- Open -----
+def test_open_rejects_until_open_seconds_pass(breaker, clock):
+    _trip(breaker)
+    assert breaker.is_open()
+    clock[0] += 10
+    with pytest.raises(CircuitOpenError) as excinfo:
+        breaker.before_call()
+    assert excinfo.value.retry_in == pytest.approx(20)
+    assert breaker.snapshot()["rejected"] == 1
+    clock[0] += 20
+    assert not breaker.is_open()
+    assert breaker.snapshot()["state"] == HALF_OPEN
+
+
+def test_late_result_of_a_call_started_before_opening_is_ignored(breaker):
+    _trip(breaker)
+    breaker.record(failed=False)
+    assert breaker.is_open()
+
+
+# ----- Half-open -----
+def test_half_open_lets_one_probe_through(breaker, clock):
+    _trip(breaker)
+    clock[0] += 30
+    breaker.before_call()
+    assert breaker.is_open()  # The probe is in flight
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_probe_closes(breaker, clock):
+    _trip(breaker)
+    clock[0] += 30
+    _call(breaker, failed=False)
+    assert breaker.snapshot()["state"] == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+    _call(breaker, failed=False)
+
+
+def test_failed_probe_opens_again(breaker, clock):
+    _trip(breaker)
+    clock[0] += 30
+    _call(breaker, failed=True)
+    snapshot = breaker.snapshot()
+    assert (snapshot["state"], snapshot["opened"]) == (OPEN, 2)
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_cancelled_probe_frees_the_slot(breaker, clock):
+    _trip(breaker)
+    clock[0] += 30
+    breaker.before_call()
+    breaker.cancel()  # E.g. the rate limiter rejected it before it reached the upstream
+    breaker.before_call()
+
+
+def test_reset(breaker):
+    _trip(breaker)
+    breaker.reset()
+    assert not breaker.is_open()
+    _call(breaker, failed=False)
@@ -0,0 +1,72 @@
+import pytest
+
+from utils import error_catalog
+from utils.error_catalog import detect_locale, render_error
+
+
+# ----- Patterns -----
+# Raw errors exactly as the agents and the HTTP helpers record them
+@pytest.mark.parametrize("raw_error, key", [
+    ("API Key not configured in the system.", "missing_api_key"),
+    ("News API Key is not configured.", "missing_api_key"),
+    ("City 'Atlantis' not found or not correctly written in English.", "city_not_found"),
+    ("City could not be identified in the message.", "city_missing"),
+    ("No currencies detected in the message.", "currencies_missing"),
+    ("Country could not be identified in the message.", "country_missing"),
+    ("Exchange rate for XYZ not found.", "rate_not_found"),
+    ("Unexpected weather data format received from API.", "bad_payload"),
+    ("Rate limit for weather reached; next slot in 1.5s", "rate_limited"),
+    ("Circuit for news is open; next probe in 12.0s", "service_down"),
+    ("API error: 503", "http_status"),
+    ("Error in News API: 401", "http_status"),
+])
+def test_every_agent_error_matches_its_pattern(raw_error, key):
+    matched = [name for name, pattern in error_catalog.ERROR_PATTERNS if pattern.search(raw_error)]
+    assert matched[:1] == [key]
+
+
+def test_named_groups_are_captured():
+    patterns = dict(error_catalog.ERROR_PATTERNS)
+    assert patterns["city_not_found"].search("City 'New York' not found").group("city") == "New York"
+    assert patterns["rate_not_found"].search("Exchange rate for xyz not found.").group("currency") == "xyz"
+    assert patterns["http_status"].search("Weather API error: 429").group("status") == "429"
+
+
+# ----- Rendering -----
+@pytest.mark.parametrize("raw_error, expected", [
+    ("Weather API error: 401", "rechazó la credencial"),
+    ("API error: 429", "demasiadas consultas"),
+    ("API error: 502", "no responde en este momento"),
+    ("API error: 404", "respondió con un error (404)"),
+])
+def test_http_status_picks_template_by_code(raw_error, expected):
+    assert expected in render_error("exchange", raw_error, "es")
+
+
+def test_render_fills_fields_and_alternatives():
+    message = render_error("exchange", "Exchange rate for xyz not found.", "en")
+    assert "XYZ" in message
+    message = render_error("weather", "Circuit for weather is open; next probe in 3.0s", "es")
+    assert message.startswith("El servicio del clima")
+    assert "los tipos de cambio o las noticias" in message
+
+
+def test_unknown_errors_are_left_to_the_llm():
+    assert render_error("weather", "Something exploded", "es") is None
+    assert render_error("plan", "API Key not configured in the system.", "es") is None
+
+
+# ----- Locale -----
+@pytest.mark.parametrize("text, locale", [
+    ("¿Qué clima hace en Madrid?", "es"),
+    ("noticias de Francia", "es"),
+    ("What's the weather in Paris?", "en"),
+])
+def test_detect_locale(monkeypatch, text, locale):
+    monkeypatch.setattr(error_catalog, "ERROR_LOCALE", "auto")
+    assert detect_locale(text) == locale
+
+
+def test_error_locale_overrides_detection(monkeypatch):
+    monkeypatch.setattr(error_catalog, "ERROR_LOCALE", "en")
+    assert detect_locale("¿Qué clima hace en Madrid?") == "en"
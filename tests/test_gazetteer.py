@@ -0,0 +1,97 @@
+import pytest
+
+from utils.gazetteer import AhoCorasick, fold, gazetteer
+
+
+# ----- fold -----
+def test_fold_strips_case_and_accents():
+    assert fold("México BOGOTÁ São Paulo") == "mexico bogota sao paulo"
+
+
+def test_fold_keeps_offsets():
+    text = "¿Qué clima hace en Bogotá?"
+    assert len(fold(text)) == len(text)
+    start = fold(text).index("bogota")
+    assert text[start:start + len("bogota")] == "Bogotá"
+
+
+# ----- Automaton -----
+def test_aho_corasick_finds_overlapping_patterns():
+    automaton = AhoCorasick([("he", 1), ("she", 2), ("hers", 3)])
+    assert sorted(automaton.iter_matches("ushers")) == [(1, 4, 2), (2, 4, 1), (2, 6, 3)]
+
+
+def test_word_matches_skip_partial_words():
+    automaton = AhoCorasick([("roma", "city")])
+    assert list(automaton.iter_word_matches("aroma de roma")) == [(9, 13, "city")]
+
+
+# ----- Mentions -----
+def test_scan_reports_offsets_in_the_original_text():
+    text = "Clima en Nueva York y en Bogotá"
+    for mention in gazetteer.scan(text):
+        assert fold(text[mention.start:mention.end]) in ("nueva york", "bogota")
+    assert [m.value for m in gazetteer.scan(text)] == ["New York", "Bogota"]
+
+
+def test_scan_prefers_the_longest_match():
+    assert [m.value for m in gazetteer.scan("Clima en Rio de Janeiro")] == ["Rio de Janeiro"]
+
+
+def test_uppercase_only_codes_ignore_everyday_words():
+    assert gazetteer.match_exchange("try a pen") is None
+    assert gazetteer.match_exchange("USD to COP") == ("USD", ["COP"])
+
+
+def test_match_cities_in_order_without_duplicates():
+    assert gazetteer.match_cities("Clima en Madrid, París, Roma y madrid") == ["Madrid", "Paris", "Rome"]
+
+
+def test_match_countries():
+    assert gazetteer.match_countries("Noticias de Francia, Alemania y Japón") == ["fr", "de", "jp"]
+
+
+def test_city_id_ignores_case_and_accents():
+    assert gazetteer.city_id("BOGOTÁ") == gazetteer.city_id("bogota") is not None
+    assert gazetteer.city_id("Atlantis") is None
+
+
+# ----- Currency order -----
+@pytest.mark.parametrize("text, expected", [
+    ("¿Cuánto vale un dólar en pesos mexicanos?", ("USD", ["MXN"])),
+    ("¿Cuántos pesos mexicanos por dólar?", ("USD", ["MXN"])),
+    ("¿Cuántos pesos mexicanos por un dólar?", ("USD", ["MXN"])),
+    ("pesos mexicanos por 1 dólar", ("USD", ["MXN"])),
+    ("pesos mexicanos por cada dólar", ("USD", ["MXN"])),
+    ("euros per one dollar", ("USD", ["EUR"])),
+    ("Un dólar en pesos mexicanos, euros y yenes", ("USD", ["MXN", "EUR", "JPY"])),
+])
+def test_match_exchange_orders_base_and_targets(text, expected):
+    assert gazetteer.match_exchange(text) == expected
+
+
+def test_match_exchange_needs_two_currencies():
+    assert gazetteer.match_exchange("¿Cuánto vale el dólar?") is None
+
+
+# ----- Partial matches -----
+@pytest.mark.parametrize("text, unmatched", [
+    ("Clima en Madrid y en Valladolid", ["Valladolid"]),
+    ("Noticias de España y Eslovenia", ["Eslovenia"]),
+    ("Clima en Madrid, Valladolid y Roma", ["Valladolid"]),
+    ("Un dólar en euros y XYZ", ["XYZ"]),
+    ("Clima en Madrid y Roma", []),
+    ("Clima en Rio de Janeiro", []),
+    ("Weather in London and Tokyo, and news from Spain and Italy", []),
+])
+def test_unmatched_names(text, unmatched):
+    assert gazetteer.unmatched_names(text) == unmatched
+
+
+def test_strict_match_drops_partial_matches():
+    text = "Clima en Madrid y en Valladolid"
+    assert gazetteer.match_cities(text) == ["Madrid"]
+    assert gazetteer.match_cities(text, strict=True) == []
+    assert gazetteer.match_countries("Noticias de España y Eslovenia", strict=True) == []
+    assert gazetteer.match_exchange("Un dólar en euros y XYZ", strict=True) is None
+    assert gazetteer.match_cities("Clima en Madrid y Roma", strict=True) == ["Madrid", "Rome"]
@@ -0,0 +1,27 @@
+import pytest
+
+from nodes.plan_query import plan_with_rules
+
+
+# ----- Rules-first planner -----
+@pytest.mark.parametrize("text, plan", [
+    ("Clima en Madrid",
+     {"tasks": ["weather"], "cities": ["Madrid"], "currencies": None, "countries": None}),
+    ("¿Cuánto vale un dólar en pesos mexicanos?",
+     {"tasks": ["exchange"], "cities": None, "currencies": ["USD", "MXN"], "countries": None}),
+    ("el clima en Madrid y noticias de Francia",
+     {"tasks": ["weather", "news"], "cities": ["Madrid"], "currencies": None, "countries": ["fr"]}),
+])
+def test_plans_without_the_llm(text, plan):
+    assert plan_with_rules(text) == plan
+
+
+@pytest.mark.parametrize("text", [
+    "hola",  # No task
+    "el tiempo",  # Weak evidence
+    "¿Qué clima hace?",  # No city
+    "Clima en Madrid y en Valladolid",  # One city the gazetteer does not know
+    "noticias de España y Eslovenia",  # Same for countries
+])
+def test_falls_back_to_the_llm(text):
+    assert plan_with_rules(text) is None
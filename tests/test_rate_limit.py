@@ -0,0 +1,110 @@
+import time
+
+import pytest
+
+from utils import rate_limit
+from utils.rate_limit import (
+    RateLimitExceeded, TokenBucket, UpstreamLimiter, backoff_delay, parse_limits, retry_after,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+
+# ----- Quotas -----
+def test_parse_limits():
+    assert parse_limits("60/min, 1500/month") == [(1.0, 60.0), (1500 / (30 * 86400), 1500.0)]
+    assert parse_limits("") == []
+
+
+# ----- Token bucket -----
+def test_bucket_serves_its_burst_then_queues(clock):
+    bucket = TokenBucket(rate=2.0, capacity=2)
+    assert bucket.reserve(clock[0]) == 0.0
+    assert bucket.reserve(clock[0]) == 0.0
+    assert bucket.reserve(clock[0]) == pytest.approx(0.5)
+    assert bucket.reserve(clock[0]) == pytest.approx(1.0)
+
+
+def test_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=1.0, capacity=3)
+    for _ in range(3):
+        bucket.reserve(clock[0])
+    bucket._refill(clock[0] + 100)
+    assert bucket.tokens == 3
+
+
+def test_cancel_returns_the_token(clock):
+    bucket = TokenBucket(rate=1.0, capacity=1)
+    bucket.reserve(clock[0])
+    assert bucket.reserve(clock[0]) == pytest.approx(1.0)
+    bucket.cancel()
+    assert bucket.reserve(clock[0]) == pytest.approx(1.0)
+
+
+def test_cap_lowers_the_level_to_the_upstream_remaining(clock):
+    bucket = TokenBucket(rate=1.0, capacity=10)
+    bucket.cap(0, clock[0])
+    assert bucket.reserve(clock[0]) == pytest.approx(1.0)
+
+
+# ----- Upstream limiter -----
+def test_limiter_rejects_waits_over_max_wait_without_spending_tokens(clock):
+    limiter = UpstreamLimiter("test", [(1.0, 1.0)], max_wait=0.5)
+    assert limiter._reserve() == 0.0
+    with pytest.raises(RateLimitExceeded) as excinfo:
+        limiter._reserve()
+    assert excinfo.value.wait == pytest.approx(1.0)
+    clock[0] += 1.0
+    assert limiter._reserve() == 0.0  # The rejected call did not keep its slot
+    assert limiter.stats()["rejected"] == 1
+
+
+def test_limiter_waits_for_the_slowest_bucket(clock):
+    limiter = UpstreamLimiter("test", [(10.0, 10.0), (1.0, 1.0)], max_wait=5)
+    assert limiter._reserve() == 0.0
+    assert limiter._reserve() == pytest.approx(1.0)
+
+
+def test_429_blocks_every_caller_for_retry_after(clock):
+    limiter = UpstreamLimiter("test", [(100.0, 100.0)], max_wait=5)
+    limiter.observe(429, {"retry-after": "2"})
+    assert limiter._reserve() == pytest.approx(2.0)
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_exhausted_remaining_header_blocks_until_reset(clock):
+    limiter = UpstreamLimiter("test", [(100.0, 100.0)], max_wait=5)
+    limiter.observe(200, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": "3"})
+    assert limiter._reserve() == pytest.approx(3.0)
+
+
+# ----- Headers and backoff -----
+@pytest.mark.parametrize("value, seconds", [
+    ("30", 30.0),
+    ("6m0s", 360.0),
+    ("20ms", 0.02),
+    ("1m30s", 90.0),
+])
+def test_retry_after_formats(value, seconds):
+    assert retry_after({"retry-after": value}) == pytest.approx(seconds)
+
+
+def test_retry_after_unix_timestamp():
+    assert retry_after({"Retry-After": str(time.time() + 60)}) == pytest.approx(60, abs=1)
+
+
+def test_retry_after_missing_or_invalid():
+    assert retry_after({}) is None
+    assert retry_after({"retry-after": "soon"}) is None
+
+
+def test_backoff_never_undercuts_retry_after():
+    for attempt in range(5):
+        delay = backoff_delay(attempt)
+        assert 0 <= delay <= min(rate_limit.HTTP_BACKOFF_MAX, rate_limit.HTTP_BACKOFF_BASE * 2 ** attempt)
+    assert backoff_delay(0, retry_after_seconds=30) == 30
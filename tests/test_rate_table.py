@@ -0,0 +1,95 @@
+import pytest
+
+from agents import currency_agent
+from agents.currency_agent import RateTableCache, _parse_currencies, _split_codes
+
+USD_TABLE = {"USD": 1.0, "EUR": 0.9, "MXN": 18.0}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(currency_agent.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def cache(clock):
+    cache = RateTableCache(ttl=60, max_stale=600)
+    cache.store("USD", USD_TABLE)
+    return cache
+
+
+# ----- Lookup -----
+def test_direct_lookup(cache):
+    assert cache.lookup("USD", "MXN") == (18.0, "USD", False)
+    assert cache.stats["direct"] == 1
+
+
+def test_cross_rate_is_derived_from_another_base(cache):
+    rate, source, stale = cache.lookup("EUR", "MXN")
+    assert rate == pytest.approx(18.0 / 0.9)
+    assert (source, stale) == ("USD", False)
+    assert cache.stats["derived"] == 1
+
+
+def test_missing_currency_is_a_miss(cache):
+    assert cache.lookup("EUR", "JPY") is None
+    assert cache.lookup("JPY", "EUR") is None
+    assert cache.stats["misses"] == 2
+
+
+def test_zero_rate_is_not_used_as_divisor(cache):
+    cache.store("GBP", {"GBP": 1.0, "XXX": 0.0, "EUR": 1.2})
+    assert cache.lookup("XXX", "GBP") is None
+
+
+# ----- Freshness -----
+def test_stale_table_is_served_until_max_stale(cache, clock):
+    clock[0] += 61
+    assert cache.lookup("USD", "EUR") == (0.9, "USD", True)
+    assert cache.stats["stale"] == 1
+    clock[0] += 600
+    assert cache.lookup("USD", "EUR") is None
+
+
+def test_fresh_table_of_another_base_wins_over_stale_own_table(cache, clock):
+    clock[0] += 61
+    cache.store("EUR", {"EUR": 1.0, "USD": 1.1})
+    assert cache.lookup("USD", "EUR") == (pytest.approx(1 / 1.1), "EUR", False)
+
+
+def test_expires_in(cache, clock):
+    assert cache.expires_in("USD") == 60
+    clock[0] += 90
+    assert cache.expires_in("USD") == -30
+    assert cache.expires_in("EUR") is None
+
+
+# ----- Refresh claims -----
+def test_only_one_refresh_in_flight(cache):
+    assert cache.claim_refresh("USD")
+    assert not cache.claim_refresh("USD")
+    cache.store("USD", USD_TABLE)  # Storing the new table ends the refresh
+    assert cache.claim_refresh("USD")
+    cache.release_refresh("USD")
+    assert cache.claim_refresh("USD")
+    assert cache.stats["refreshes"] == 3
+
+
+# ----- Currency codes -----
+@pytest.mark.parametrize("answer, expected", [
+    ("USD, MXN", ("USD", ["MXN"])),
+    ("usd, eur, mxn", ("USD", ["EUR", "MXN"])),
+    ("USD, USD, EUR", ("USD", ["EUR"])),
+    ("USD", None),
+    ("dollar, peso", None),
+])
+def test_parse_currencies(answer, expected):
+    assert _parse_currencies(answer) == expected
+
+
+def test_split_codes():
+    assert _split_codes(["EUR", "USD", "GBP"]) == ("EUR", ["USD", "GBP"])
+    assert _split_codes(["EUR"]) is None
+    assert _split_codes(None) is None
@@ -0,0 +1,192 @@
+import types
+import asyncio
+import threading
+
+import pytest
+
+from utils import response_cache
+from utils.response_cache import LoadAbortedError, ResponseCache, normalize_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Only the cache sees the fake clock: the event loop keeps the real one for its sleeps
+    now = [1000.0]
+    monkeypatch.setattr(response_cache, "time", types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def cache(clock):
+    return ResponseCache("test", ttl=10, stale_ttl=50)
+
+
+def test_normalize_key():
+    assert normalize_key("  New   York ") == "new york"
+
+
+# ----- Freshness -----
+def test_fresh_hit_does_not_call_the_loader(cache):
+    assert cache.get_or_load("k", lambda: 1) == 1
+    assert cache.get_or_load("k", lambda: pytest.fail("loader called on a fresh hit")) == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(cache, clock):
+    cache.get_or_load("k", lambda: "old")
+    clock[0] += 20
+    release, calls = threading.Event(), []
+
+    def slow_loader():
+        calls.append(1)
+        release.wait(5)
+        return "new"
+
+    assert cache.get_or_load("k", slow_loader) == "old"
+    assert cache.get_or_load("k", slow_loader) == "old"  # Refresh already claimed
+    release.set()
+    for _ in range(100):
+        if cache.stats()["refreshes"] and not cache._refreshing:
+            break
+        threading.Event().wait(0.01)
+    assert calls == [1]
+    assert cache.peek("k") == ("new", False)
+
+
+def test_expired_entry_is_reloaded_but_still_peekable(cache, clock):
+    cache.get_or_load("k", lambda: "old")
+    clock[0] += 61
+    assert cache.peek("k") == ("old", True)
+    assert cache.get_or_load("k", lambda: "new") == "new"
+    assert cache.stats()["misses"] == 2
+
+
+def test_cache_if_skips_values(clock):
+    cache = ResponseCache("test_cache_if", ttl=10, cache_if=lambda value: value is not None)
+    cache.get_or_load("k", lambda: None)
+    assert cache.peek("k") is None
+
+
+# ----- Bounds -----
+def test_lru_eviction_by_entries(clock):
+    cache = ResponseCache("test_lru", ttl=10, max_entries=2)
+    cache.get_or_load("a", lambda: 1)
+    cache.get_or_load("b", lambda: 2)
+    cache.get_or_load("a", lambda: 1)  # "a" is now the most recent
+    cache.get_or_load("c", lambda: 3)
+    assert cache.peek("b") is None
+    assert cache.peek("a") == (1, False)
+    assert cache.stats()["evictions"] == 1
+
+
+def test_eviction_by_bytes(clock):
+    cache = ResponseCache("test_bytes", ttl=10, max_bytes=20)  # Each value takes 12 bytes: the length of its repr
+    cache.get_or_load("a", lambda: "x" * 10)
+    cache.get_or_load("b", lambda: "y" * 10)
+    assert cache.peek("a") is None
+    cache.get_or_load("c", lambda: "z" * 100)  # Larger than the whole cache: not stored
+    assert cache.peek("c") is None
+    assert cache.stats()["entries"] == 1
+
+
+# ----- Single-flight -----
+def test_concurrent_sync_misses_share_one_load(cache):
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def loader():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "value"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_load("k", loader)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(cache.refresh("k", loader))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    for _ in range(100):
+        if cache.stats()["coalesced"] == 3:
+            break
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert results == ["value"] * 4
+    assert calls == [1]
+
+
+def test_sync_load_error_reaches_every_waiter_and_is_not_cached(cache):
+    def loader():
+        raise ValueError("upstream down")
+
+    with pytest.raises(ValueError):
+        cache.get_or_load("k", loader)
+    assert cache.peek("k") is None
+    assert cache.stats()["load_errors"] == 1
+
+
+def test_concurrent_async_misses_share_one_load(cache):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main():
+        return await asyncio.gather(*(cache.aget_or_load("k", loader) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["value"] * 5
+    assert calls == [1]
+    assert cache.stats()["coalesced"] == 4
+
+
+def test_cancelled_async_leader_aborts_its_waiters(cache):
+    async def loader():
+        await asyncio.sleep(10)
+
+    async def main():
+        leader = asyncio.create_task(cache.aget_or_load("k", loader))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(cache.aget_or_load("k", loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        with pytest.raises(LoadAbortedError):
+            await follower
+
+    asyncio.run(main())
+
+
+def test_async_stale_entry_is_refreshed_in_the_background(cache, clock):
+    async def main():
+        await cache.aget_or_load("k", _value("old"))
+        clock[0] += 20
+        assert await cache.aget_or_load("k", _value("new")) == "old"
+        await asyncio.gather(*cache._background_tasks)
+        return cache.peek("k")
+
+    assert asyncio.run(main()) == ("new", False)
+
+
+# ----- Batch loads -----
+def test_get_many_loads_only_the_misses(cache):
+    cache.get_or_load("a", lambda: 1)
+    requested = []
+
+    def load_many(keys):
+        requested.append(keys)
+        return {key: key.upper() for key in keys}
+
+    assert cache.get_many_or_load(["a", "b", "c"], load_many) == {"a": 1, "b": "B", "c": "C"}
+    assert requested == [["b", "c"]]
+    assert cache.peek("c") == ("C", False)
+
+
+def _value(value):
+    async def loader():
+        return value
+    return loader
@@ -0,0 +1,37 @@
+import pytest
+
+from nodes.classify_query import classify_with_rules
+from utils.task_lexicon import CURRENCY_MENTION_WEIGHT, scan_tasks, score_tasks
+
+
+def test_scan_tasks_sorted_by_offset():
+    mentions = scan_tasks("noticias y el clima")
+    assert [(m.task, m.start) for m in mentions] == [("news", 0), ("weather", 14)]
+
+
+def test_multi_word_keywords_win_over_their_parts():
+    mentions = scan_tasks("tipo de cambio del euro")
+    assert [(m.task, m.weight) for m in mentions if m.start == 0] == [("exchange", 1.0)]
+
+
+def test_currency_mentions_count_as_exchange_evidence():
+    assert score_tasks("un dólar")["exchange"] == CURRENCY_MENTION_WEIGHT
+    assert score_tasks("un dólar en euros")["exchange"] == 1.0
+
+
+def test_scores_are_capped():
+    assert score_tasks("clima, temperatura y pronóstico")["weather"] == 1.0
+
+
+@pytest.mark.parametrize("text, tasks, confidence", [
+    ("¿Qué clima hace en Madrid?", {"weather"}, 1.0),
+    ("¿Cuánto vale un dólar en pesos mexicanos?", {"exchange"}, 1.0),
+    ("¿Qué tiempo hace y las noticias?", {"weather", "news"}, 1.0),
+    ("el tiempo", {"weather"}, 0.6),  # Weak evidence: below the default threshold
+    ("cambio", set(), 0.0),
+    ("hola", set(), 0.0),
+])
+def test_classify_with_rules(text, tasks, confidence):
+    classification, score = classify_with_rules(text)
+    assert {task for task, present in classification.items() if present} == tasks
+    assert score == pytest.approx(confidence)
@@ -0,0 +1,369 @@
+
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# Record/replay of LLM calls and upstream HTTP requests, for reproducible performance runs.
+#   CASSETTE_MODE=record  every model answer and API response is stored (and still served live)
+#   CASSETTE_MODE=replay  answers come from the cassette; nothing reaches OpenAI or the APIs
+# Entries are keyed by a hash of the request (model + prompt, or URL without credentials) and
+# stored zlib-compressed in SQLite together with the latency observed while recording.
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").strip().lower()
+# Like LLM_CACHE_PATH, a relative path is resolved against the project root
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CASSETTE_PATH = os.path.join(PROJECT_ROOT, os.getenv("CASSETTE_PATH", os.path.join(".cache", "cassette.sqlite")))
+# "recorded" replays each entry with the latency it had when recorded; a number of seconds
+# simulates a fixed latency instead ("0" answers immediately)
+CASSETTE_LATENCY = os.getenv("CASSETTE_LATENCY", "recorded").strip().lower()
+# Replay miss: "error" raises CassetteMiss, "live" sends the request for real
+CASSETTE_ON_MISS = os.getenv("CASSETTE_ON_MISS", "error").strip().lower()
+
+# Query parameters and environment variables whose values never reach the cassette keys
+CREDENTIAL_PARAMS = {"appid", "apikey", "api_key", "key", "token"}
+CREDENTIAL_ENV = ("OPENWEATHER_API_KEY", "EXCHANGE_API_KEY", "NEWS_API_KEY")
+
+# Response headers dropped when recording: the stored body is already decoded
+_HOP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "keep-alive"}
+
+
+class CassetteMiss(Exception):
+    """
+    Raised in replay mode when a request was never recorded (unless CASSETTE_ON_MISS=live).
+    """
+
+    def __init__(self, kind: str, description: str):
+        super().__init__(f"No recorded {kind} response for {description}")
+        self.kind = kind
+
+
+def recording() -> bool:
+    return CASSETTE_MODE == "record"
+
+
+def replaying() -> bool:
+    return CASSETTE_MODE == "replay"
+
+
+def active() -> bool:
+    return CASSETTE_MODE in ("record", "replay")
+
+
+# ----- Request keys -----
+def _hash(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _model_name(llm: Any) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def llm_key(llm: Any, messages: list[BaseMessage]) -> str:
+    """
+    Hash of the model name and the whitespace-normalized prompt. Client options (timeouts,
+    response headers, ...) are left out so a cassette stays valid across builds.
+    """
+    return _hash({
+        "kind": "llm",
+        "model": _model_name(llm),
+        "messages": [(message.type, re.sub(r"\s+", " ", str(message.content)).strip()) for message in messages],
+    })
+
+
+def _full_url(url: str, params: Optional[dict]) -> httpx.URL:
+    # httpx.URL(url, params=None) would drop the query already in `url`
+    return httpx.URL(url).copy_merge_params(params) if params else httpx.URL(url)
+
+
+def redact_url(url: str, params: Optional[dict] = None) -> str:
+    """
+    The request URL with its query merged and sorted, and every credential removed, so the
+    same request matches whatever API keys the recording and the replay environment use.
+    """
+    parts = urlsplit(str(_full_url(url, params)))
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k.lower() not in CREDENTIAL_PARAMS
+    )
+    path = parts.path
+    for name in CREDENTIAL_ENV:
+        secret = os.getenv(name)
+        if secret:
+            path = path.replace(secret, "{" + name + "}")
+    return urlunsplit((parts.scheme, parts.netloc, path, urlencode(query), ""))
+
+
+def http_key(url: str, params: Optional[dict] = None) -> str:
+    return _hash({"kind": "http", "method": "GET", "url": redact_url(url, params)})
+
+
+# ----- On-disk store -----
+class CassetteStore:
+    """
+    SQLite table of compressed entries: key -> (kind, zlib(JSON payload), latency in seconds).
+    """
+
+    def __init__(self, path: str = CASSETTE_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the project never touches the disk
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cassette ("
+                "key TEXT PRIMARY KEY, kind TEXT NOT NULL, payload BLOB NOT NULL, "
+                "latency REAL NOT NULL, recorded_at REAL NOT NULL)"
+            )
+            self._db = db
+        return self._db
+
+    def get(self, key: str) -> Optional[tuple[dict, float]]:
+        with self._lock:
+            row = self._connection().execute("SELECT payload, latency FROM cassette WHERE key = ?", (key,)).fetchone()
+            self._stats["replayed" if row else "misses"] += 1
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8")), row[1]
+
+    def put(self, key: str, kind: str, payload: dict, latency: float) -> None:
+        blob = zlib.compress(json.dumps(payload, ensure_ascii=False).encode("utf-8"), 9)
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO cassette (key, kind, payload, latency, recorded_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, blob, latency, time.time()),
+            )
+            self._stats["recorded"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns recorded / replayed / misses counters and the stored entries per kind.
+        """
+        with self._lock:
+            stats: dict[str, Any] = dict(self._stats)
+            if self._db is not None or os.path.exists(self.path):
+                rows = self._connection().execute("SELECT kind, COUNT(*) FROM cassette GROUP BY kind").fetchall()
+                stats["entries"] = dict(rows)
+            return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._db is not None or os.path.exists(self.path):
+                self._connection().execute("DELETE FROM cassette")
+            self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+
+
+# Shared by every node in the process
+cassette = CassetteStore()
+
+
+def cassette_stats() -> dict[str, Any]:
+    return cassette.stats()
+
+
+def _replay_delay(recorded: float) -> float:
+    if CASSETTE_LATENCY == "recorded":
+        return recorded
+    return float(CASSETTE_LATENCY)
+
+
+def _miss(kind: str, description: str) -> None:
+    if CASSETTE_ON_MISS != "live":
+        raise CassetteMiss(kind, description)
+    logger.warning("Cassette sin respuesta %s para %s; se consulta en vivo", kind, description)
+
+
+# ----- LLM calls (used by the utils.llm_cache wrappers) -----
+def _message_payload(message: AIMessage) -> dict:
+    return {"content": message.content, "usage_metadata": getattr(message, "usage_metadata", None)}
+
+
+def _chunks_payload(chunks: list[AIMessageChunk]) -> dict:
+    usage = next((c.usage_metadata for c in reversed(chunks) if getattr(c, "usage_metadata", None)), None)
+    return {"chunks": [chunk.content for chunk in chunks], "usage_metadata": usage}
+
+
+def _message(payload: dict) -> AIMessage:
+    if "chunks" in payload:
+        return AIMessage(content="".join(payload["chunks"]), usage_metadata=payload.get("usage_metadata"))
+    return AIMessage(content=payload["content"], usage_metadata=payload.get("usage_metadata"))
+
+
+def _chunks(payload: dict) -> list[AIMessageChunk]:
+    parts = payload["chunks"] if "chunks" in payload else [payload["content"]]
+    usage = payload.get("usage_metadata")
+    return [
+        AIMessageChunk(content=part, usage_metadata=usage if i == len(parts) - 1 else None)
+        for i, part in enumerate(parts)
+    ]
+
+
+def invoke(llm: Any, messages: list[BaseMessage]) -> AIMessage:
+    """
+    `llm.invoke(messages)`, recorded or replayed according to CASSETTE_MODE.
+    """
+    if not active():
+        return llm.invoke(messages)
+    key = llm_key(llm, messages)
+    if replaying():
+        entry = cassette.get(key)
+        if entry is not None:
+            time.sleep(_replay_delay(entry[1]))
+            return _message(entry[0])
+        _miss("llm", _model_name(llm))
+    start = time.perf_counter()
+    response = llm.invoke(messages)
+    if recording():
+        cassette.put(key, "llm", _message_payload(response), time.perf_counter() - start)
+    return response
+
+
+async def ainvoke(llm: Any, messages: list[BaseMessage]) -> AIMessage:
+    """
+    Async version of `invoke`; SQLite access runs in a worker thread.
+    """
+    if not active():
+        return await llm.ainvoke(messages)
+    key = llm_key(llm, messages)
+    if replaying():
+        entry = await asyncio.to_thread(cassette.get, key)
+        if entry is not None:
+            await asyncio.sleep(_replay_delay(entry[1]))
+            return _message(entry[0])
+        _miss("llm", _model_name(llm))
+    start = time.perf_counter()
+    response = await llm.ainvoke(messages)
+    if recording():
+        await asyncio.to_thread(cassette.put, key, "llm", _message_payload(response), time.perf_counter() - start)
+    return response
+
+
+def stream(llm: Any, messages: list[BaseMessage]) -> Iterator[AIMessageChunk]:
+    """
+    `llm.stream(messages)`, recorded or replayed chunk by chunk (the recorded latency is spread
+    evenly over the chunks).
+    """
+    if not active():
+        yield from llm.stream(messages)
+        return
+    key = llm_key(llm, messages)
+    if replaying():
+        entry = cassette.get(key)
+        if entry is not None:
+            chunks = _chunks(entry[0])
+            for chunk in chunks:
+                time.sleep(_replay_delay(entry[1]) / len(chunks))
+                yield chunk
+            return
+        _miss("llm", _model_name(llm))
+    start = time.perf_counter()
+    chunks = []
+    for chunk in llm.stream(messages):
+        chunks.append(chunk)
+        yield chunk
+    if recording():
+        cassette.put(key, "llm", _chunks_payload(chunks), time.perf_counter() - start)
+
+
+async def astream(llm: Any, messages: list[BaseMessage]) -> AsyncIterator[AIMessageChunk]:
+    """
+    Async version of `stream`.
+    """
+    if not active():
+        async for chunk in llm.astream(messages):
+            yield chunk
+        return
+    key = llm_key(llm, messages)
+    if replaying():
+        entry = await asyncio.to_thread(cassette.get, key)
+        if entry is not None:
+            chunks = _chunks(entry[0])
+            for chunk in chunks:
+                await asyncio.sleep(_replay_delay(entry[1]) / len(chunks))
+                yield chunk
+            return
+        _miss("llm", _model_name(llm))
+    start = time.perf_counter()
+    chunks = []
+    async for chunk in llm.astream(messages):
+        chunks.append(chunk)
+        yield chunk
+    if recording():
+        await asyncio.to_thread(cassette.put, key, "llm", _chunks_payload(chunks), time.perf_counter() - start)
+
+
+# ----- Upstream HTTP (used by utils.http_client) -----
+def _response_payload(response: httpx.Response) -> dict:
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in _HOP_HEADERS}
+    return {"status": response.status_code, "headers": headers, "body": response.text}
+
+
+def _response(payload: dict, url: str, params: Optional[dict]) -> httpx.Response:
+    return httpx.Response(
+        payload["status"],
+        headers=payload["headers"],
+        content=payload["body"].encode("utf-8"),
+        request=httpx.Request("GET", _full_url(url, params)),
+    )
+
+
+def http_get(url: str, params: Optional[dict], send: Callable[[], httpx.Response]) -> httpx.Response:
+    """
+    Runs `send()` (the real GET, with its breaker, limiter and retries), recording the final
+    response, or replays it without touching the network.
+    """
+    if not active():
+        return send()
+    key = http_key(url, params)
+    if replaying():
+        entry = cassette.get(key)
+        if entry is not None:
+            time.sleep(_replay_delay(entry[1]))
+            return _response(entry[0], url, params)
+        _miss("http", redact_url(url, params))
+    start = time.perf_counter()
+    response = send()
+    if recording():
+        cassette.put(key, "http", _response_payload(response), time.perf_counter() - start)
+    return response
+
+
+async def ahttp_get(url: str, params: Optional[dict], send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+    """
+    Async version of `http_get`.
+    """
+    if not active():
+        return await send()
+    key = http_key(url, params)
+    if replaying():
+        entry = await asyncio.to_thread(cassette.get, key)
+        if entry is not None:
+            await asyncio.sleep(_replay_delay(entry[1]))
+            return _response(entry[0], url, params)
+        _miss("http", redact_url(url, params))
+    start = time.perf_counter()
+    response = await send()
+    if recording():
+        await asyncio.to_thread(cassette.put, key, "http", _response_payload(response), time.perf_counter() - start)
+    return response
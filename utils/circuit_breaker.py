@@ -0,0 +1,180 @@
+
+import os
+import time
+import threading
+from collections import deque
+from typing import Optional
+
+from utils.logging import setup_logging
+from utils.rate_limit import UPSTREAM_HOSTS
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# A breaker opens when, within the last CIRCUIT_WINDOW seconds, at least CIRCUIT_MIN_CALLS calls
+# were made and CIRCUIT_FAILURE_RATE of them failed (connection errors, timeouts or 5xx; a 4xx
+# such as "city not found" is the caller's problem, not the upstream's). While open, calls fail
+# at once. After CIRCUIT_OPEN_SECONDS one probe call is let through (half-open): success
+# closes the breaker, failure opens it again.
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "60"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "5"))
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling an upstream whose breaker is open.
+    """
+
+    def __init__(self, upstream: str, retry_in: float):
+        super().__init__(f"Circuit for {upstream} is open; next probe in {retry_in:.1f}s")
+        self.upstream = upstream
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker over a sliding time window of call outcomes. Thread-safe.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window: float = CIRCUIT_WINDOW,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+    ):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._outcomes: deque = deque()  # (monotonic time, failed)
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    # ----- State -----
+    def _trim(self, now: float) -> None:
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _open(self, now: float) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self._outcomes.clear()
+        self._stats["opened"] += 1
+        logger.warning("Circuit for %s open for %.0fs", self.name, self.open_seconds)
+
+    def is_open(self) -> bool:
+        """
+        True while calls would be rejected, without taking the half-open probe.
+        """
+        with self._lock:
+            if self._state == OPEN:
+                return time.monotonic() - self._opened_at < self.open_seconds
+            return self._state == HALF_OPEN and self._probe_in_flight
+
+    def before_call(self) -> None:
+        """
+        Lets the call through or raises `CircuitOpenError`. In half-open only one probe passes.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == OPEN:
+                retry_in = self.open_seconds - (now - self._opened_at)
+                if retry_in > 0:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, retry_in)
+                self._state = HALF_OPEN
+                logger.info("Circuit for %s half-open: letting one trial call through", self.name)
+            if self._state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self._stats["rejected"] += 1
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probe_in_flight = True
+
+    def cancel(self) -> None:
+        """
+        Call allowed by `before_call` that never reached the upstream (e.g. rate limited).
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record(self, failed: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self._state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._state = CLOSED
+                    self._probe_in_flight = False
+                    logger.info("Circuit for %s closed", self.name)
+                return
+            if self._state == OPEN:
+                return  # Call that started before the circuit opened
+            self._outcomes.append((now, failed))
+            self._trim(now)
+            failures = sum(1 for _, f in self._outcomes if f)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    def record_status(self, status_code: int) -> None:
+        self.record(failed=status_code >= 500)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            calls = len(self._outcomes)
+            failures = sum(1 for _, f in self._outcomes if f)
+            state = self._state
+            if state == OPEN and now - self._opened_at >= self.open_seconds:
+                state = HALF_OPEN  # The next attempt is the trial call
+            return {
+                "state": state,
+                "calls": calls,
+                "failures": failures,
+                "failure_rate": failures / calls if calls else 0.0,
+                **self._stats,
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._state = CLOSED
+            self._probe_in_flight = False
+            self._outcomes.clear()
+
+
+# ----- Registry (one breaker per upstream, same names as utils.rate_limit) -----
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def breaker_for_host(host: str) -> Optional[CircuitBreaker]:
+    name = UPSTREAM_HOSTS.get(host)
+    return get_breaker(name) if name else None
+
+
+def circuit_states() -> dict[str, dict]:
+    """
+    Returns state, calls, failures, failure rate, times opened and rejected calls per upstream.
+    """
+    return {name: breaker.snapshot() for name, breaker in _breakers.items()}
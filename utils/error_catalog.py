@@ -0,0 +1,151 @@
+import os
+import re
+from typing import Optional
+
+# ----- Error catalog -----
+# Known error messages produced by the agents, matched by regular expression, and the
+# user-facing explanation for each one in Spanish and English. The error handler answers
+# these without the LLM; only messages that match no pattern are sent to the model.
+# ERROR_LOCALE selects the language: "es", "en" or "auto" (from the user's message).
+ERROR_LOCALE = os.getenv("ERROR_LOCALE", "auto")
+
+ERROR_PATTERNS = [
+    ("missing_api_key", re.compile(r"API Key (?:is )?not configured", re.I)),
+    ("city_not_found", re.compile(r"City '(?P<city>[^']+)' not found", re.I)),
+    ("city_missing", re.compile(r"City could not be identified", re.I)),
+    ("currencies_missing", re.compile(r"No currencies detected", re.I)),
+    ("country_missing", re.compile(r"Country could not be identified", re.I)),
+    ("rate_not_found", re.compile(r"Exchange rate for (?P<currency>\w+) not found", re.I)),
+    ("news_missing", re.compile(r"No news found for (?P<country>\w+)", re.I)),
+    ("bad_payload", re.compile(r"Unexpected .* format", re.I)),
+    ("rate_limited", re.compile(r"Rate limit for \w+ reached", re.I)),
+    ("service_down", re.compile(r"Circuit for \w+ is open", re.I)),
+    ("http_status", re.compile(r"(?:API error|Error in News API): (?P<status>\d{3})", re.I)),
+]
+
+TEMPLATES = {
+    "es": {
+        "missing_api_key": "No pude consultar {service} porque no está configurado por ahora. "
+                           "Mientras tanto, puedes preguntarme por {alternatives}.",
+        "city_not_found": "No encontré la ciudad «{city}». Revisa cómo está escrita (mejor con su nombre "
+                          "en inglés, por ejemplo «New York») y vuelve a preguntar por el clima.",
+        "city_missing": "No identifiqué ninguna ciudad en tu mensaje. Vuelve a preguntar por el clima "
+                        "indicando la ciudad, por ejemplo: «¿Qué clima hace en Madrid?».",
+        "currencies_missing": "No identifiqué las divisas de tu consulta. Vuelve a preguntar indicando las dos "
+                              "monedas, por ejemplo: «¿Cuánto vale un dólar en pesos mexicanos?».",
+        "country_missing": "No identifiqué ningún país en tu mensaje. Vuelve a preguntar por las noticias "
+                           "indicando el país, por ejemplo: «¿Qué noticias hay en Francia?».",
+        "rate_not_found": "No encontré el tipo de cambio de {currency}. Comprueba el código de la moneda "
+                          "(por ejemplo EUR, USD o MXN) y vuelve a intentarlo.",
+        "news_missing": "No encontré noticias recientes de {country}. Prueba con otro país o pregúntame por "
+                        "{alternatives}.",
+        "bad_payload": "{Service} devolvió datos en un formato inesperado. Vuelve a intentarlo en unos minutos; "
+                       "mientras tanto puedo ayudarte con {alternatives}.",
+        "rate_limited": "{Service} recibió demasiadas consultas en poco tiempo. Vuelve a intentarlo en unos "
+                        "minutos; mientras tanto puedo ayudarte con {alternatives}.",
+        "service_down": "{Service} no responde en este momento. Vuelve a intentarlo en unos minutos; "
+                        "mientras tanto puedo ayudarte con {alternatives}.",
+        "auth_error": "{Service} rechazó la credencial configurada, así que no pude completar esa parte. "
+                      "Mientras tanto, puedes preguntarme por {alternatives}.",
+        "http_error": "{Service} respondió con un error ({status}). Vuelve a intentarlo en unos minutos; "
+                      "mientras tanto puedo ayudarte con {alternatives}.",
+    },
+    "en": {
+        "missing_api_key": "I couldn't check {service} because it isn't configured right now. "
+                           "Meanwhile, you can ask me about {alternatives}.",
+        "city_not_found": "I couldn't find the city \"{city}\". Check the spelling (its English name works "
+                          "best, e.g. \"New York\") and ask about the weather again.",
+        "city_missing": "I couldn't find a city in your message. Ask about the weather again including the "
+                        "city, e.g. \"What's the weather in Madrid?\".",
+        "currencies_missing": "I couldn't tell which currencies you meant. Ask again naming both, e.g. "
+                              "\"How much is a dollar in Mexican pesos?\".",
+        "country_missing": "I couldn't find a country in your message. Ask about the news again including the "
+                           "country, e.g. \"What's the news in France?\".",
+        "rate_not_found": "I couldn't find an exchange rate for {currency}. Check the currency code "
+                          "(e.g. EUR, USD or MXN) and try again.",
+        "news_missing": "I couldn't find recent news for {country}. Try another country or ask me about "
+                        "{alternatives}.",
+        "bad_payload": "{Service} returned data in an unexpected format. Please try again in a few minutes; "
+                       "meanwhile I can help with {alternatives}.",
+        "rate_limited": "{Service} received too many requests in a short time. Please try again in a few "
+                        "minutes; meanwhile I can help with {alternatives}.",
+        "service_down": "{Service} is not responding right now. Please try again in a few minutes; "
+                        "meanwhile I can help with {alternatives}.",
+        "auth_error": "{Service} rejected the configured credentials, so I couldn't complete that part. "
+                      "Meanwhile, you can ask me about {alternatives}.",
+        "http_error": "{Service} answered with an error ({status}). Please try again in a few minutes; "
+                      "meanwhile I can help with {alternatives}.",
+    },
+}
+
+SERVICE_NAMES = {
+    "es": {"weather": "el servicio del clima", "exchange": "el servicio de tipos de cambio",
+           "news": "el servicio de noticias"},
+    "en": {"weather": "the weather service", "exchange": "the exchange rate service",
+           "news": "the news service"},
+}
+
+TOPICS = {
+    "es": {"weather": "el clima", "exchange": "los tipos de cambio", "news": "las noticias"},
+    "en": {"weather": "the weather", "exchange": "exchange rates", "news": "news"},
+}
+
+_SPANISH_HINTS = re.compile(
+    r"[¿¡ñáéíóú]|\b(?:qué|que|cómo|como|cuánto|cuanto|el|la|los|las|de|del|en|y|clima|noticias|tiempo)\b"
+)
+
+
+def detect_locale(text: str) -> str:
+    """
+    "es" or "en" for the user's message, unless ERROR_LOCALE fixes the language.
+    """
+    if ERROR_LOCALE in TEMPLATES:
+        return ERROR_LOCALE
+    return "es" if _SPANISH_HINTS.search(text.lower()) else "en"
+
+
+def _alternatives(source: str, locale: str) -> str:
+    others = [topic for task, topic in TOPICS[locale].items() if task != source]
+    joiner = " o " if locale == "es" else " or "
+    return ", ".join(others[:-1]) + joiner + others[-1]
+
+
+def _status_key(status: int) -> str:
+    if status in (401, 403):
+        return "auth_error"
+    if status == 429:
+        return "rate_limited"
+    if status >= 500:
+        return "service_down"
+    return "http_error"
+
+
+def render_error(source: str, raw_error: str, locale: str) -> Optional[str]:
+    """
+    User-facing explanation of `raw_error` from the catalog, or None if the error is unknown.
+
+    Parameters:
+    source (str): Task that produced the error ("weather", "exchange" or "news").
+    raw_error (str): Error message recorded in `state["error"]`.
+    locale (str): "es" or "en".
+    """
+    service = SERVICE_NAMES[locale].get(source)
+    if service is None:
+        return None  # Errores del plan, la clasificación o el orden: los explica el LLM
+    for key, pattern in ERROR_PATTERNS:
+        match = pattern.search(raw_error)
+        if not match:
+            continue
+        fields = match.groupdict()
+        if key == "http_status":
+            key = _status_key(int(fields["status"]))
+        return TEMPLATES[locale][key].format(
+            service=service,
+            Service=service[:1].upper() + service[1:],
+            alternatives=_alternatives(source, locale),
+            city=fields.get("city", ""),
+            currency=(fields.get("currency") or "").upper(),
+            country=(fields.get("country") or "").upper(),
+            status=fields.get("status", ""),
+        )
+    return None
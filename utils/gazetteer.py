@@ -0,0 +1,440 @@
+
+import re
+import threading
+import unicodedata
+from collections import deque
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+
+# ----- Gazetteer data -----
+# Names are written once with accents; matching folds case and accents on both sides,
+# so "México", "mexico" and "MEXICO" all hit the same pattern.
+
+# ISO 4217 code -> Spanish and English names
+CURRENCIES = {
+    "USD": ["dólar", "dólares", "dólar estadounidense", "dólar americano", "dollar", "dollars", "us dollar", "american dollar"],
+    "EUR": ["euro", "euros"],
+    "MXN": ["peso mexicano", "pesos mexicanos", "mexican peso", "mexican pesos"],
+    "GBP": ["libra", "libras", "libra esterlina", "libras esterlinas", "pound", "pounds", "pound sterling", "british pound"],
+    "JPY": ["yen", "yenes", "yen japonés", "japanese yen"],
+    "CAD": ["dólar canadiense", "dólares canadienses", "canadian dollar", "canadian dollars"],
+    "AUD": ["dólar australiano", "dólares australianos", "australian dollar", "australian dollars"],
+    "NZD": ["dólar neozelandés", "new zealand dollar"],
+    "HKD": ["dólar de hong kong", "hong kong dollar"],
+    "SGD": ["dólar de singapur", "singapore dollar"],
+    "CHF": ["franco suizo", "francos suizos", "swiss franc", "swiss francs"],
+    "CNY": ["yuan", "yuanes", "renminbi", "chinese yuan"],
+    "BRL": ["real brasileño", "reales brasileños", "brazilian real", "brazilian reais"],
+    "ARS": ["peso argentino", "pesos argentinos", "argentine peso", "argentine pesos"],
+    "COP": ["peso colombiano", "pesos colombianos", "colombian peso", "colombian pesos"],
+    "CLP": ["peso chileno", "pesos chilenos", "chilean peso", "chilean pesos"],
+    "PEN": ["sol peruano", "soles peruanos", "peruvian sol", "peruvian soles"],
+    "INR": ["rupia india", "rupias indias", "indian rupee", "indian rupees"],
+    "KRW": ["won surcoreano", "won coreano", "south korean won", "korean won"],
+    "RUB": ["rublo", "rublos", "russian ruble", "russian rubles"],
+    "SEK": ["corona sueca", "coronas suecas", "swedish krona"],
+    "NOK": ["corona noruega", "coronas noruegas", "norwegian krone"],
+    "DKK": ["corona danesa", "coronas danesas", "danish krone"],
+    "ZAR": ["rand sudafricano", "south african rand"],
+    "TRY": ["lira turca", "liras turcas", "turkish lira"],
+}
+
+# Codes that are also everyday words ("cop", "pen", "try"...) only match when written in uppercase
+UPPERCASE_ONLY_CODES = {"ARS", "CAD", "COP", "PEN", "RUB", "TRY"}
+
+# Quantity words between "por/per" and the priced currency: "por un dólar", "por cada 1 euro"
+PRICED_UNIT_WORDS = {"un", "una", "uno", "1", "cada", "el", "la", "a", "one", "each", "every"}
+
+# ISO 3166-1 alpha-2 code (lowercase, as NewsAPI expects) -> Spanish and English names and aliases
+COUNTRIES = {
+    "ar": ["argentina"],
+    "at": ["austria"],
+    "au": ["australia"],
+    "be": ["bélgica", "belgium"],
+    "br": ["brasil", "brazil"],
+    "ca": ["canadá"],
+    "ch": ["suiza", "switzerland"],
+    "cl": ["chile"],
+    "cn": ["china"],
+    "co": ["colombia"],
+    "cu": ["cuba"],
+    "cz": ["república checa", "chequia", "czech republic", "czechia"],
+    "de": ["alemania", "germany"],
+    "eg": ["egipto", "egypt"],
+    "es": ["españa", "spain"],
+    "fr": ["francia", "france"],
+    "gb": ["reino unido", "gran bretaña", "inglaterra", "united kingdom", "great britain", "england", "uk"],
+    "gr": ["grecia", "greece"],
+    "hk": ["hong kong"],
+    "hu": ["hungría", "hungary"],
+    "id": ["indonesia"],
+    "ie": ["irlanda", "ireland"],
+    "il": ["israel"],
+    "in": ["india"],
+    "it": ["italia", "italy"],
+    "jp": ["japón", "japan"],
+    "kr": ["corea del sur", "south korea"],
+    "ma": ["marruecos", "morocco"],
+    "mx": ["méxico"],
+    "my": ["malasia", "malaysia"],
+    "ng": ["nigeria"],
+    "nl": ["países bajos", "holanda", "netherlands", "holland"],
+    "no": ["noruega", "norway"],
+    "nz": ["nueva zelanda", "new zealand"],
+    "pe": ["perú"],
+    "ph": ["filipinas", "philippines"],
+    "pl": ["polonia", "poland"],
+    "pt": ["portugal"],
+    "ro": ["rumania", "rumanía", "romania"],
+    "ru": ["rusia", "russia"],
+    "sa": ["arabia saudita", "arabia saudí", "saudi arabia"],
+    "se": ["suecia", "sweden"],
+    "sg": ["singapur", "singapore"],
+    "th": ["tailandia", "thailand"],
+    "tr": ["turquía", "turkey"],
+    "tw": ["taiwán"],
+    "ua": ["ucrania", "ukraine"],
+    "us": ["estados unidos", "ee.uu.", "eeuu", "ee uu", "usa", "u.s.", "united states"],
+    "ve": ["venezuela"],
+    "za": ["sudáfrica", "south africa"],
+}
+
+# City name in American English (as OpenWeatherMap expects) -> (ISO country, OpenWeatherMap city ID,
+# Spanish and English aliases). The ID lets several cities share one call to the group endpoint.
+CITIES = {
+    "New York": ("us", 5128581, ["nueva york", "new york", "nyc"]),
+    "Los Angeles": ("us", 5368361, ["los ángeles"]),
+    "Chicago": ("us", 4887398, ["chicago"]),
+    "Houston": ("us", 4699066, ["houston"]),
+    "Miami": ("us", 4164138, ["miami"]),
+    "San Francisco": ("us", 5391959, ["san francisco"]),
+    "Boston": ("us", 4930956, ["boston"]),
+    "Seattle": ("us", 5809844, ["seattle"]),
+    "Las Vegas": ("us", 5506956, ["las vegas"]),
+    "Washington": ("us", 4140963, ["washington d.c.", "washington dc"]),
+    "Mexico City": ("mx", 3530597, ["ciudad de méxico", "cdmx", "mexico city"]),
+    "Guadalajara": ("mx", 4005539, ["guadalajara"]),
+    "Monterrey": ("mx", 3995465, ["monterrey"]),
+    "Cancun": ("mx", 3531673, ["cancún"]),
+    "Tijuana": ("mx", 3981609, ["tijuana"]),
+    "Puebla": ("mx", 3521081, ["puebla"]),
+    "Toronto": ("ca", 6167865, ["toronto"]),
+    "Vancouver": ("ca", 6173331, ["vancouver"]),
+    "Montreal": ("ca", 6077243, ["montreal", "montréal"]),
+    "London": ("gb", 2643743, ["londres", "london"]),
+    "Paris": ("fr", 2988507, ["parís"]),
+    "Madrid": ("es", 3117735, ["madrid"]),
+    "Barcelona": ("es", 3128760, ["barcelona"]),
+    "Rome": ("it", 3169070, ["roma", "rome"]),
+    "Milan": ("it", 3173435, ["milán"]),
+    "Berlin": ("de", 2950159, ["berlín"]),
+    "Munich": ("de", 2867714, ["múnich", "munich"]),
+    "Amsterdam": ("nl", 2759794, ["ámsterdam"]),
+    "Brussels": ("be", 2800866, ["bruselas", "brussels"]),
+    "Lisbon": ("pt", 2267057, ["lisboa", "lisbon"]),
+    "Vienna": ("at", 2761369, ["viena", "vienna"]),
+    "Zurich": ("ch", 2657896, ["zúrich"]),
+    "Geneva": ("ch", 2660646, ["ginebra", "geneva"]),
+    "Prague": ("cz", 3067696, ["praga", "prague"]),
+    "Warsaw": ("pl", 756135, ["varsovia", "warsaw"]),
+    "Moscow": ("ru", 524901, ["moscú", "moscow"]),
+    "Athens": ("gr", 264371, ["atenas", "athens"]),
+    "Istanbul": ("tr", 745044, ["estambul", "istanbul"]),
+    "Dublin": ("ie", 2964574, ["dublín"]),
+    "Stockholm": ("se", 2673730, ["estocolmo", "stockholm"]),
+    "Oslo": ("no", 3143244, ["oslo"]),
+    "Copenhagen": ("dk", 2618425, ["copenhague", "copenhagen"]),
+    "Tokyo": ("jp", 1850147, ["tokio", "tokyo"]),
+    "Beijing": ("cn", 1816670, ["pekín", "beijing"]),
+    "Shanghai": ("cn", 1796236, ["shanghái"]),
+    "Seoul": ("kr", 1835848, ["seúl"]),
+    "Bangkok": ("th", 1609350, ["bangkok"]),
+    "Dubai": ("ae", 292223, ["dubái"]),
+    "Mumbai": ("in", 1275339, ["bombay", "mumbai"]),
+    "New Delhi": ("in", 1261481, ["nueva delhi", "new delhi"]),
+    "Sydney": ("au", 2147714, ["sídney", "sydney"]),
+    "Melbourne": ("au", 2158177, ["melbourne"]),
+    "Cairo": ("eg", 360630, ["el cairo", "cairo"]),
+    "Johannesburg": ("za", 993800, ["johannesburgo", "johannesburg"]),
+    "Buenos Aires": ("ar", 3435910, ["buenos aires"]),
+    "Santiago": ("cl", 3871336, ["santiago de chile"]),
+    "Lima": ("pe", 3936456, ["lima"]),
+    "Bogota": ("co", 3688689, ["bogotá"]),
+    "Medellin": ("co", 3674962, ["medellín"]),
+    "Caracas": ("ve", 3646738, ["caracas"]),
+    "Quito": ("ec", 3652462, ["quito"]),
+    "Montevideo": ("uy", 3441575, ["montevideo"]),
+    "Sao Paulo": ("br", 3448439, ["são paulo", "sao paulo"]),
+    "Rio de Janeiro": ("br", 3451190, ["río de janeiro"]),
+    "Havana": ("cu", 3553478, ["la habana", "havana"]),
+}
+
+
+# Capitalized words right after a connector or a comma ("en Valladolid", "y Eslovenia",
+# ", Lyon") are probably places. If one of them matches no entry, the gazetteer only knows
+# part of the query and the caller should ask the LLM for the full list.
+_UPPER = "A-ZÁÉÍÓÚÜÑÇÃÕÂÊÔÀÈÌÒÙ"
+CANDIDATE_NAME_RE = re.compile(
+    rf"(?:(?<!\w)(?i:en|de|del|y|e|a|in|from|and|of|to|para|for|at)\s+|,\s*)"
+    rf"([{_UPPER}][\w'-]+(?:\s+[{_UPPER}][\w'-]+)*)"
+)
+
+
+def fold(text: str) -> str:
+    """
+    Lowercases and strips accents character by character, so offsets in the folded
+    text are the same as in the original text.
+    """
+    folded = []
+    for ch in text:
+        decomposed = unicodedata.normalize("NFD", ch)
+        folded.append(decomposed[0].lower() if decomposed else ch)
+    return "".join(folded)
+
+
+# ----- Multi-pattern matcher -----
+class AhoCorasick:
+    """
+    Aho–Corasick automaton: finds every occurrence of every pattern in a single pass over the text.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[str, Any]]):
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list[tuple[int, Any]]] = [[]]
+
+        for pattern, payload in patterns:
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append((len(pattern), payload))
+
+        # Breadth-first construction of the failure links
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt].extend(self._out[self._fail[nxt]])
+
+    def iter_matches(self, text: str) -> Iterator[tuple[int, int, Any]]:
+        """
+        Yields (start, end, payload) for every pattern occurrence, overlaps included.
+        """
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for length, payload in out[node]:
+                yield i - length + 1, i + 1, payload
+
+    def iter_word_matches(self, folded: str) -> Iterator[tuple[int, int, Any]]:
+        """
+        Like `iter_matches`, but only yields occurrences that are whole words in `folded`.
+        """
+        for start, end, payload in self.iter_matches(folded):
+            if start > 0 and folded[start - 1].isalnum():
+                continue
+            if end < len(folded) and folded[end].isalnum():
+                continue
+            yield start, end, payload
+
+
+def leftmost_longest(candidates: list) -> list:
+    """
+    Keeps the leftmost-longest non-overlapping items among objects with `start`/`end`.
+    """
+    candidates = sorted(candidates, key=lambda m: (m.start, m.start - m.end))
+    selected, last_end = [], 0
+    for candidate in candidates:
+        if candidate.start >= last_end:
+            selected.append(candidate)
+            last_end = candidate.end
+    return selected
+
+
+# ----- Entity mentions -----
+class Mention(NamedTuple):
+    kind: str  # "currency", "country" or "city"
+    value: str  # ISO 4217 code, ISO 3166 code or city name
+    start: int
+    end: int
+
+
+class Gazetteer:
+    """
+    Resolves currencies, countries and cities from text without calling the LLM.
+
+    The automaton is built once at import time. Lookups only return a value when the
+    match is unambiguous; otherwise the caller falls back to the LLM extractor.
+    `stats()` reports how often the fast path answered.
+    """
+
+    def __init__(self):
+        patterns = []
+        for code, names in CURRENCIES.items():
+            patterns.append((fold(code), ("currency", code, code in UPPERCASE_ONLY_CODES)))
+            patterns.extend((fold(name), ("currency", code, False)) for name in names)
+        for code, names in COUNTRIES.items():
+            patterns.extend((fold(name), ("country", code, False)) for name in names)
+        for city, (_, _, aliases) in CITIES.items():
+            names = {fold(city)} | {fold(alias) for alias in aliases}
+            patterns.extend((name, ("city", city, False)) for name in names)
+
+        self._automaton = AhoCorasick(patterns)
+        self._city_ids = {fold(city): city_id for city, (_, city_id, _) in CITIES.items()}
+        self._lock = threading.Lock()
+        self._stats = {kind: {"lookups": 0, "hits": 0} for kind in ("currency", "country", "city")}
+
+    def scan(self, text: str) -> list[Mention]:
+        """
+        Returns the leftmost-longest, non-overlapping, whole-word mentions found in `text`.
+        """
+        folded = fold(text)
+        candidates = []
+        for start, end, (kind, value, upper_only) in self._automaton.iter_word_matches(folded):
+            if upper_only and not text[start:end].isupper():
+                continue
+            candidates.append(Mention(kind, value, start, end))
+        return leftmost_longest(candidates)
+
+    def unmatched_names(self, text: str) -> list[str]:
+        """
+        Candidate names (see CANDIDATE_NAME_RE) that overlap no known mention:
+        "Clima en Madrid y en Valladolid" -> ["Valladolid"].
+        """
+        mentions = self.scan(text)
+        return [
+            match.group(1)
+            for match in CANDIDATE_NAME_RE.finditer(text)
+            if not any(m.start < match.end(1) and match.start(1) < m.end for m in mentions)
+        ]
+
+    def _record(self, kind: str, hit: bool) -> None:
+        with self._lock:
+            self._stats[kind]["lookups"] += 1
+            if hit:
+                self._stats[kind]["hits"] += 1
+
+    def _distinct(self, text: str, kind: str, strict: bool = False) -> list[Mention]:
+        # With `strict`, an unknown name in the text voids a partial match
+        if strict and self.unmatched_names(text):
+            return []
+        seen, mentions = set(), []
+        for mention in self.scan(text):
+            if mention.kind == kind and mention.value not in seen:
+                seen.add(mention.value)
+                mentions.append(mention)
+        return mentions
+
+    def _order_pair(self, text: str, first: Mention, second: Mention) -> tuple[Mention, Mention]:
+        """
+        The first mention is the base ("un dólar en pesos mexicanos" -> USD, MXN), except
+        for "X por/per Y" phrasings where Y is the unit being priced ("por un dólar" too).
+        """
+        between = fold(text[first.end:second.start]).split()
+        while between and between[-1] in PRICED_UNIT_WORDS:
+            between.pop()
+        if between[-1:] in (["por"], ["per"]):
+            return second, first
+        return first, second
+
+    def match_currencies(self, text: str) -> Optional[tuple[str, str]]:
+        """
+        Returns (base, target) when exactly two distinct currencies are mentioned
+        (ordered as in `_order_pair`).
+        """
+        mentions = self._distinct(text, "currency")
+        if len(mentions) != 2:
+            self._record("currency", False)
+            return None
+
+        first, second = self._order_pair(text, *mentions)
+        self._record("currency", True)
+        return first.value, second.value
+
+    def match_exchange(self, text: str, strict: bool = False) -> Optional[tuple[str, list[str]]]:
+        """
+        Returns (base, [targets]) when two or more distinct currencies are mentioned:
+        "USD to MXN, EUR and JPY" -> ("USD", ["MXN", "EUR", "JPY"]). With more than two,
+        the first mention is the base. With `strict`, returns None if the text also has
+        names the gazetteer does not know (`unmatched_names`).
+        """
+        mentions = self._distinct(text, "currency", strict)
+        if len(mentions) < 2:
+            self._record("currency", False)
+            return None
+
+        if len(mentions) == 2:
+            mentions = list(self._order_pair(text, *mentions))
+        self._record("currency", True)
+        return mentions[0].value, [mention.value for mention in mentions[1:]]
+
+    def match_country(self, text: str) -> Optional[str]:
+        """
+        Returns the ISO 3166-1 alpha-2 code when exactly one country is mentioned.
+        """
+        mentions = self._distinct(text, "country")
+        hit = len(mentions) == 1
+        self._record("country", hit)
+        return mentions[0].value if hit else None
+
+    def match_countries(self, text: str, strict: bool = False) -> list[str]:
+        """
+        Returns the ISO 3166-1 alpha-2 codes of every country mentioned, in order of appearance.
+        With `strict`, returns [] if the text also has names the gazetteer does not know.
+        """
+        mentions = self._distinct(text, "country", strict)
+        self._record("country", bool(mentions))
+        return [mention.value for mention in mentions]
+
+    def match_city(self, text: str) -> Optional[str]:
+        """
+        Returns the city name in English when exactly one known city is mentioned.
+        """
+        mentions = self._distinct(text, "city")
+        hit = len(mentions) == 1
+        self._record("city", hit)
+        return mentions[0].value if hit else None
+
+    def match_cities(self, text: str, strict: bool = False) -> list[str]:
+        """
+        Returns the English names of every known city mentioned, in order of appearance.
+        With `strict`, returns [] if the text also has names the gazetteer does not know
+        ("Clima en Madrid y en Valladolid"), so the caller asks the LLM for the whole list.
+        """
+        mentions = self._distinct(text, "city", strict)
+        self._record("city", bool(mentions))
+        return [mention.value for mention in mentions]
+
+    def city_id(self, city: str) -> Optional[int]:
+        """
+        OpenWeatherMap ID of a known city (matched without case or accents), or None.
+        """
+        return self._city_ids.get(fold(city.strip()))
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Returns lookups, hits and fast-path hit ratio per entity kind.
+        """
+        with self._lock:
+            return {
+                kind: {**counts, "hit_ratio": counts["hits"] / counts["lookups"] if counts["lookups"] else 0.0}
+                for kind, counts in self._stats.items()
+            }
+
+
+# Built once at import time and shared by every agent
+gazetteer = Gazetteer()
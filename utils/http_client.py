@@ -0,0 +1,318 @@
+
+import os
+import time
+import threading
+import asyncio
+import weakref
+from typing import Awaitable, Optional, TypeVar
+
+import httpx
+
+from utils import cassette
+from utils.circuit_breaker import breaker_for_host
+from utils.logging import setup_logging
+from utils.metrics import observe_http
+from utils.rate_limit import (
+    HTTP_MAX_RETRIES, RETRY_STATUSES, UPSTREAM_HOSTS, backoff_delay, limiter_for_host, retry_after,
+)
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# Every upstream (openweathermap.org, exchangerate-api.com, newsapi.org) gets its own pooled
+# client, so a slow or saturated host cannot starve the connection pool of the others.
+# All values can be overridden through environment variables.
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.0"))  # Seconds to establish TCP + TLS
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "10.0"))  # Seconds to wait for response bytes
+POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5.0"))  # Seconds to wait for a free pooled connection
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))  # Max open connections per host
+POOL_KEEPALIVE = int(os.getenv("HTTP_POOL_KEEPALIVE", "10"))  # Idle connections kept alive per host
+KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))  # Seconds an idle connection is kept
+
+# Ask upstreams for compressed payloads; httpx decodes them transparently.
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT, write=READ_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=POOL_MAXSIZE,
+        max_keepalive_connections=POOL_KEEPALIVE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+# ----- Connection reuse counters -----
+class UpstreamStats:
+    """
+    Thread-safe per-host counters of requests and newly opened connections.
+
+    Every request that did not open a new TCP connection was served by a pooled
+    keep-alive connection, so `reused = requests - new_connections`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests: dict[str, int] = {}
+        self._new_connections: dict[str, int] = {}
+
+    def record_request(self, host: str) -> None:
+        with self._lock:
+            self._requests[host] = self._requests.get(host, 0) + 1
+
+    def record_new_connection(self, host: str) -> None:
+        with self._lock:
+            self._new_connections[host] = self._new_connections.get(host, 0) + 1
+
+    def snapshot(self) -> dict[str, dict[str, int]]:
+        """
+        Returns {host: {"requests", "new_connections", "reused_connections"}}.
+        """
+        with self._lock:
+            return {
+                host: {
+                    "requests": total,
+                    "new_connections": self._new_connections.get(host, 0),
+                    "reused_connections": max(total - self._new_connections.get(host, 0), 0),
+                }
+                for host, total in self._requests.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._new_connections.clear()
+
+
+stats = UpstreamStats()
+
+
+def _sync_trace(host: str):
+    # httpcore emits "connection.connect_tcp.complete" only when a new socket is opened.
+    def trace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            stats.record_new_connection(host)
+    return trace
+
+
+def _async_trace(host: str):
+    async def trace(event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            stats.record_new_connection(host)
+    return trace
+
+
+# ----- Pooled clients -----
+_clients_lock = threading.Lock()
+_clients: dict[str, httpx.Client] = {}
+
+# Async connections are bound to the event loop that opened them, so async clients
+# are kept per (loop, host) and dropped together with their loop.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, httpx.AsyncClient]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_client(host: str) -> httpx.Client:
+    """
+    Returns the shared keep-alive client for `host`, creating it on first use.
+    """
+    client = _clients.get(host)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(host)
+            if client is None:
+                logger.debug("Opening pooled HTTP client for %s", host)
+                client = httpx.Client(timeout=_timeout(), limits=_limits(), headers=DEFAULT_HEADERS)
+                _clients[host] = client
+    return client
+
+
+def get_async_client(host: str) -> httpx.AsyncClient:
+    """
+    Returns the shared keep-alive async client for `host` on the running event loop.
+    """
+    loop = asyncio.get_running_loop()
+    per_loop = _async_clients.setdefault(loop, {})
+    client = per_loop.get(host)
+    if client is None:
+        logger.debug("Opening pooled async HTTP client for %s", host)
+        client = httpx.AsyncClient(timeout=_timeout(), limits=_limits(), headers=DEFAULT_HEADERS)
+        per_loop[host] = client
+    return client
+
+
+# ----- Request helpers used by the agents -----
+def _retry_delay(response: httpx.Response, attempt: int, limiter) -> Optional[float]:
+    """
+    Seconds to wait before retrying `response`, or None if it should be returned as is
+    (not retryable, retries exhausted, or the server asks for a longer pause than we queue).
+    """
+    if response.status_code not in RETRY_STATUSES or attempt >= HTTP_MAX_RETRIES:
+        return None
+    server_wait = retry_after(response.headers)
+    max_wait = limiter.max_wait if limiter is not None else None
+    if server_wait is not None and max_wait is not None and server_wait > max_wait:
+        return None
+    return backoff_delay(attempt, server_wait)
+
+
+def _record_exception(breaker, e: BaseException) -> None:
+    """
+    Connection errors and timeouts count against the upstream's breaker; anything else
+    (rate limited, cancelled) means the call never reached it.
+    """
+    if breaker is None:
+        return
+    if isinstance(e, httpx.TransportError):
+        breaker.record(failed=True)
+    else:
+        breaker.cancel()
+
+
+def http_get(url: str, params: Optional[dict] = None) -> httpx.Response:
+    """
+    Performs a GET through the pooled client of the URL's host.
+
+    The call first checks the host's circuit breaker (see utils.circuit_breaker), then takes a
+    slot from its rate limiter (see utils.rate_limit), waiting briefly if the quota is
+    momentarily used up, and retries 429 / 5xx responses with jittered exponential backoff.
+    Every attempt is timed into the HTTP metrics (see utils.metrics). With CASSETTE_MODE set,
+    the final response is recorded to or replayed from the cassette (see utils.cassette).
+
+    Parameters:
+    url (str): Absolute URL of the upstream endpoint.
+    params (dict, optional): Query string parameters.
+
+    Returns:
+    httpx.Response: The upstream response. Timeouts raise `httpx.TimeoutException`; a quota
+    that stays exhausted raises `utils.rate_limit.RateLimitExceeded`; an open breaker raises
+    `utils.circuit_breaker.CircuitOpenError` without touching the network.
+    """
+    return cassette.http_get(url, params, lambda: _http_get(url, params))
+
+
+def _http_get(url: str, params: Optional[dict]) -> httpx.Response:
+    host = httpx.URL(url).host
+    limiter = limiter_for_host(host)
+    breaker = breaker_for_host(host)
+    upstream = UPSTREAM_HOSTS.get(host, host)
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        start = None
+        try:
+            if limiter is not None:
+                limiter.acquire()
+            stats.record_request(host)
+            start = time.perf_counter()
+            response = get_client(host).get(url, params=params, extensions={"trace": _sync_trace(host)})
+        except BaseException as e:
+            if start is not None:
+                observe_http(upstream, time.perf_counter() - start, type(e).__name__)
+            _record_exception(breaker, e)
+            raise
+        observe_http(upstream, time.perf_counter() - start, str(response.status_code))
+        if breaker is not None:
+            breaker.record_status(response.status_code)
+        if limiter is not None:
+            limiter.observe(response.status_code, response.headers)
+        delay = _retry_delay(response, attempt, limiter)
+        if delay is None:
+            return response
+        logger.warning("%s returned %s; retry %s in %.2fs", host, response.status_code, attempt + 1, delay)
+        response.close()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def ahttp_get(url: str, params: Optional[dict] = None) -> httpx.Response:
+    """
+    Async version of `http_get`, using the pooled async client of the URL's host.
+    """
+    return await cassette.ahttp_get(url, params, lambda: _ahttp_get(url, params))
+
+
+async def _ahttp_get(url: str, params: Optional[dict]) -> httpx.Response:
+    host = httpx.URL(url).host
+    limiter = limiter_for_host(host)
+    breaker = breaker_for_host(host)
+    upstream = UPSTREAM_HOSTS.get(host, host)
+    attempt = 0
+    while True:
+        if breaker is not None:
+            breaker.before_call()
+        start = None
+        try:
+            if limiter is not None:
+                await limiter.aacquire()
+            stats.record_request(host)
+            client = get_async_client(host)
+            start = time.perf_counter()
+            response = await client.get(url, params=params, extensions={"trace": _async_trace(host)})
+        except BaseException as e:
+            if start is not None:
+                observe_http(upstream, time.perf_counter() - start, type(e).__name__)
+            _record_exception(breaker, e)
+            raise
+        observe_http(upstream, time.perf_counter() - start, str(response.status_code))
+        if breaker is not None:
+            breaker.record_status(response.status_code)
+        if limiter is not None:
+            limiter.observe(response.status_code, response.headers)
+        delay = _retry_delay(response, attempt, limiter)
+        if delay is None:
+            return response
+        logger.warning("%s returned %s; retry %s in %.2fs", host, response.status_code, attempt + 1, delay)
+        await response.aclose()
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+def upstream_stats() -> dict[str, dict[str, int]]:
+    """
+    Returns the connection reuse counters per upstream host.
+    """
+    return stats.snapshot()
+
+
+def close_clients() -> None:
+    """
+    Closes every pooled sync client (e.g. on process shutdown).
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
+
+
+async def aclose_clients() -> None:
+    """
+    Closes the pooled async clients that belong to the running event loop.
+    """
+    per_loop = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in per_loop.values():
+        await client.aclose()
+
+
+T = TypeVar("T")
+
+
+def run_closing_clients(main: Awaitable[T]) -> T:
+    """
+    `asyncio.run(main)` that closes the loop's pooled async clients before the loop shuts
+    down. Use it for one-shot loops (batch runs, benchmarks) so their connection pools are
+    not left open when the loop goes away.
+    """
+    async def runner() -> T:
+        try:
+            return await main
+        finally:
+            await aclose_clients()
+
+    return asyncio.run(runner())
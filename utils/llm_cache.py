@@ -0,0 +1,401 @@
+
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict, defaultdict
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+
+from utils import cassette
+from utils.logging import setup_logging
+from utils.metrics import observe_llm, observe_llm_cache_hit
+from utils.rate_limit import get_limiter
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# Only deterministic calls (temperature 0) are cached. Entries live in a small in-memory LRU
+# tier in front of an on-disk SQLite tier that survives restarts and is shared by processes.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "True").strip().lower() == "true"
+# A relative LLM_CACHE_PATH is resolved against the project root, not the working directory,
+# so the API, the batch runner and scripts started from elsewhere share one file.
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LLM_CACHE_PATH = os.path.join(PROJECT_ROOT, os.getenv("LLM_CACHE_PATH", os.path.join(".cache", "llm_cache.sqlite")))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))  # Seconds an answer is reused
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv("LLM_CACHE_MEMORY_ENTRIES", "1024"))
+LLM_CACHE_DISK_ENTRIES = int(os.getenv("LLM_CACHE_DISK_ENTRIES", "100000"))
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _llm_string(llm: Any) -> str:
+    """
+    Identifies the model and its parameters (model name, temperature, ...).
+    """
+    if hasattr(llm, "_get_llm_string"):
+        return llm._get_llm_string()
+    return repr(llm)
+
+
+def _cacheable(llm: Any) -> bool:
+    # With a cassette every call must reach it, so recordings hold the whole session.
+    # A missing or None temperature means the provider's default (not deterministic), so it is not cached
+    temperature = getattr(llm, "temperature", None)
+    return LLM_CACHE_ENABLED and not cassette.active() and temperature is not None and temperature == 0
+
+
+def cache_key(llm: Any, messages: list[BaseMessage]) -> str:
+    """
+    Hash of the model, its parameters and the whitespace-normalized prompt.
+    """
+    payload = json.dumps(
+        {
+            "llm": _llm_string(llm),
+            "messages": [(message.type, _normalize(str(message.content))) for message in messages],
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Two-tier cache of LLM answers: an in-memory LRU over an SQLite table, both with TTLs.
+
+    Hit rates are tracked per node ("weather", "classify", "aggregator", ...).
+    """
+
+    def __init__(
+        self,
+        path: str = LLM_CACHE_PATH,
+        ttl: float = LLM_CACHE_TTL,
+        memory_entries: int = LLM_CACHE_MEMORY_ENTRIES,
+        disk_entries: int = LLM_CACHE_DISK_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self._memory: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes = 0
+        self._stats = defaultdict(lambda: {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+
+    # ----- SQLite tier -----
+    def _connection(self) -> sqlite3.Connection:
+        # Opened lazily so importing the project never touches the disk
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, content TEXT NOT NULL, expires_at REAL NOT NULL, last_access REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+            self._db = db
+        return self._db
+
+    def _disk_get(self, key: str) -> Optional[tuple[str, float]]:
+        now = time.time()
+        with self._lock:
+            db = self._connection()
+            row = db.execute("SELECT content, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            db.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            return row[0], row[1]
+
+    def _disk_put(self, key: str, content: str, expires_at: float) -> None:
+        with self._lock:
+            db = self._connection()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, content, expires_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, content, expires_at, time.time()),
+            )
+            self._writes += 1
+            # Trim every 100 writes: drop expired rows, then the least recently used overflow
+            if self._writes % 100 == 0:
+                db.execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),))
+                db.execute(
+                    "DELETE FROM llm_cache WHERE key IN ("
+                    "SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_entries,),
+                )
+
+    # ----- Memory tier -----
+    def _memory_get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return entry[0]
+
+    def _memory_put(self, key: str, content: str, expires_at: float) -> None:
+        with self._lock:
+            self._memory[key] = (content, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    # ----- Public API -----
+    def get(self, key: str, node: str) -> Optional[str]:
+        content = self._memory_get(key)
+        if content is not None:
+            self._count(node, "memory_hits")
+            return content
+
+        try:
+            entry = self._disk_get(key)
+        except sqlite3.Error:
+            logger.exception("LLM cache disk lookup failed")
+            entry = None
+        if entry is not None:
+            self._memory_put(key, entry[0], entry[1])
+            self._count(node, "disk_hits")
+            return entry[0]
+
+        self._count(node, "misses")
+        return None
+
+    def put(self, key: str, content: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._memory_put(key, content, expires_at)
+        try:
+            self._disk_put(key, content, expires_at)
+        except sqlite3.Error:
+            logger.exception("LLM cache disk write failed")
+
+    def _count(self, node: str, counter: str) -> None:
+        with self._lock:
+            self._stats[node][counter] += 1
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """
+        Returns memory hits, disk hits, misses and hit rate per node.
+        """
+        with self._lock:
+            result = {}
+            for node, counts in self._stats.items():
+                total = sum(counts.values())
+                hits = counts["memory_hits"] + counts["disk_hits"]
+                result[node] = {**counts, "hit_rate": hits / total if total else 0.0}
+            return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._stats.clear()
+            if self._db is not None or os.path.exists(self.path):
+                self._connection().execute("DELETE FROM llm_cache")
+
+
+# Shared by every node in the process
+llm_cache = LLMCache()
+
+
+# ----- Rate limiting of real model calls -----
+# Cache hits never reach the provider, so only misses take a slot from the "openai" limiter.
+# ChatOpenAI returns the provider's x-ratelimit-* headers in response_metadata when created
+# with include_response_headers=True (see core.llm), which keeps the limiter in sync.
+def _observe(response: Any) -> None:
+    limiter = get_limiter("openai")
+    headers = (getattr(response, "response_metadata", None) or {}).get("headers")
+    if limiter is not None and headers:
+        limiter.observe(200, {k.lower(): v for k, v in headers.items()})
+
+
+def _observe_error(e: Exception) -> None:
+    # openai.APIStatusError lleva la respuesta HTTP (429 incluido)
+    limiter = get_limiter("openai")
+    response = getattr(e, "response", None)
+    if limiter is not None and response is not None and hasattr(response, "status_code"):
+        limiter.observe(response.status_code, response.headers)
+
+
+def _model_name(llm: Any) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+
+
+def _add_usage(total: Optional[dict], chunk: Any) -> Optional[dict]:
+    # Con stream_usage=True el proveedor manda el uso en el último chunk
+    usage = getattr(chunk, "usage_metadata", None)
+    if not usage:
+        return total
+    total = dict(total or {})
+    for field in ("input_tokens", "output_tokens"):
+        total[field] = total.get(field, 0) + usage.get(field, 0)
+    return total
+
+
+def _limiter():
+    # Replayed answers never reach the provider
+    return None if cassette.replaying() else get_limiter("openai")
+
+
+def _invoke(llm: Any, messages: list[BaseMessage], node: str) -> AIMessage:
+    limiter = _limiter()
+    if limiter is not None:
+        limiter.acquire()
+    start = time.perf_counter()
+    try:
+        response = cassette.invoke(llm, messages)
+    except Exception as e:
+        _observe_error(e)
+        raise
+    observe_llm(node, _model_name(llm), time.perf_counter() - start, getattr(response, "usage_metadata", None))
+    _observe(response)
+    return response
+
+
+async def _ainvoke(llm: Any, messages: list[BaseMessage], node: str) -> AIMessage:
+    limiter = _limiter()
+    if limiter is not None:
+        await limiter.aacquire()
+    start = time.perf_counter()
+    try:
+        response = await cassette.ainvoke(llm, messages)
+    except Exception as e:
+        _observe_error(e)
+        raise
+    observe_llm(node, _model_name(llm), time.perf_counter() - start, getattr(response, "usage_metadata", None))
+    _observe(response)
+    return response
+
+
+def _stream(llm: Any, messages: list[BaseMessage], node: str) -> Iterator[AIMessageChunk]:
+    limiter = _limiter()
+    if limiter is not None:
+        limiter.acquire()
+    start = time.perf_counter()
+    usage = None
+    try:
+        for chunk in cassette.stream(llm, messages):
+            _observe(chunk)
+            usage = _add_usage(usage, chunk)
+            yield chunk
+    except Exception as e:
+        _observe_error(e)
+        raise
+    observe_llm(node, _model_name(llm), time.perf_counter() - start, usage)
+
+
+async def _astream(llm: Any, messages: list[BaseMessage], node: str) -> AsyncIterator[AIMessageChunk]:
+    limiter = _limiter()
+    if limiter is not None:
+        await limiter.aacquire()
+    start = time.perf_counter()
+    usage = None
+    try:
+        async for chunk in cassette.astream(llm, messages):
+            _observe(chunk)
+            usage = _add_usage(usage, chunk)
+            yield chunk
+    except Exception as e:
+        _observe_error(e)
+        raise
+    observe_llm(node, _model_name(llm), time.perf_counter() - start, usage)
+
+
+# ----- Cached invocation helpers used by every node -----
+def invoke_cached(llm: Any, messages: list[BaseMessage], node: str) -> AIMessage:
+    """
+    `llm.invoke(messages)` through the cache. `node` only labels the hit-rate and latency metrics.
+    """
+    if not _cacheable(llm):
+        return _invoke(llm, messages, node)
+
+    key = cache_key(llm, messages)
+    content = llm_cache.get(key, node)
+    if content is not None:
+        logger.debug("LLM cache hit for node '%s'", node)
+        observe_llm_cache_hit(node)
+        return AIMessage(content=content)
+
+    response = _invoke(llm, messages, node)
+    llm_cache.put(key, response.content)
+    return response
+
+
+async def ainvoke_cached(llm: Any, messages: list[BaseMessage], node: str) -> AIMessage:
+    """
+    Async version of `invoke_cached`; SQLite access runs in a worker thread.
+    """
+    if not _cacheable(llm):
+        return await _ainvoke(llm, messages, node)
+
+    key = cache_key(llm, messages)
+    content = await asyncio.to_thread(llm_cache.get, key, node)
+    if content is not None:
+        logger.debug("LLM cache hit for node '%s'", node)
+        observe_llm_cache_hit(node)
+        return AIMessage(content=content)
+
+    response = await _ainvoke(llm, messages, node)
+    await asyncio.to_thread(llm_cache.put, key, response.content)
+    return response
+
+
+def stream_cached(llm: Any, messages: list[BaseMessage], node: str) -> Iterator[AIMessageChunk]:
+    """
+    `llm.stream(messages)` through the cache: a hit is replayed as a single chunk,
+    a miss is streamed and stored once complete.
+    """
+    if not _cacheable(llm):
+        yield from _stream(llm, messages, node)
+        return
+
+    key = cache_key(llm, messages)
+    content = llm_cache.get(key, node)
+    if content is not None:
+        observe_llm_cache_hit(node)
+        yield AIMessageChunk(content=content)
+        return
+
+    parts = []
+    for chunk in _stream(llm, messages, node):
+        parts.append(chunk.content)
+        yield chunk
+    llm_cache.put(key, "".join(parts))
+
+
+async def astream_cached(llm: Any, messages: list[BaseMessage], node: str) -> AsyncIterator[AIMessageChunk]:
+    """
+    Async version of `stream_cached`.
+    """
+    if not _cacheable(llm):
+        async for chunk in _astream(llm, messages, node):
+            yield chunk
+        return
+
+    key = cache_key(llm, messages)
+    content = await asyncio.to_thread(llm_cache.get, key, node)
+    if content is not None:
+        observe_llm_cache_hit(node)
+        yield AIMessageChunk(content=content)
+        return
+
+    parts = []
+    async for chunk in _astream(llm, messages, node):
+        parts.append(chunk.content)
+        yield chunk
+    await asyncio.to_thread(llm_cache.put, key, "".join(parts))
@@ -1,40 +1,193 @@
 # logging_config.py
 
 import os
+import json
+import copy
+import queue
+import atexit
+import random
 import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Iterator, Optional
+
+# ----- Configuration -----
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").strip().lower()  # "text" or "json" (one JSON object per line)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))  # Records waiting for the writer thread
+LOG_PROMPT_SAMPLE_RATE = float(os.getenv("LOG_PROMPT_SAMPLE_RATE", "0.1"))  # Share of DEBUG prompt dumps kept
+
+# Request ID of the query being processed, attached to every record logged while handling it
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_setup_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Copies the current request ID into the record. Runs in the caller's thread, where the
+    context variable is set, before the record is handed to the writer thread.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the record is dropped
+    and counted in `dropped`.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now (they may change after the call) but leave the layout and
+        # the traceback text to the writer's formatter
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, message, request_id and exc_info if any.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("[%(asctime)s][%(name)s][%(levelname)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        request_id = getattr(record, "request_id", None)
+        return f"[{request_id}] {line}" if request_id else line
+
 
 def setup_logging():
     """
     Configures the logging system based on environment variables.
-    This function is called once during the program's startup to configure logging settings.
+    This function is called once during the program's startup to configure logging settings;
+    later calls (one per module) return the already configured logger.
+
+    Records are put on a queue by the calling thread and written to stderr by a background
+    listener thread, so request threads never wait on stderr.
     """
-    # Get the DISABLE_LOGGING flag from environment variables
-    disable_logging_str = os.getenv("DISABLE_LOGGING", "False").strip().lower()
-    disable_logging = disable_logging_str == "true"  # Convert the string to a boolean
+    global _listener
 
-    # Initialize logger
     logger = logging.getLogger("WeatherAgent")
-    logger.setLevel(logging.CRITICAL)  # Default to CRITICAL to suppress logs if disabled
-
-    # Remove all existing handlers to prevent duplicate logs
-    if logger.hasHandlers():
-        logger.handlers.clear()
-
-    if disable_logging:
-        # Disable all logging by setting the log level to CRITICAL
-        logger.setLevel(logging.CRITICAL)  # This will suppress all logs
-    else:
-        # Get the VERBOSE_LOGGING flag from the environment variables
-        verbose_logging = os.getenv("VERBOSE_LOGGING", "False").strip().lower() == "true"
-        
-        # Set logging level based on verbose flag
-        log_level = logging.DEBUG if verbose_logging else logging.INFO
-        logger.setLevel(log_level)
-
-    # Set up the logging handler and formatter
-    handler = logging.StreamHandler()
-    formatter = logging.Formatter("[%(asctime)s][%(name)s][%(levelname)s] %(message)s")
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    if getattr(logger, "_configured", False):
+        return logger
+
+    with _setup_lock:
+        if getattr(logger, "_configured", False):
+            return logger
+
+        # Get the DISABLE_LOGGING flag from environment variables
+        disable_logging_str = os.getenv("DISABLE_LOGGING", "False").strip().lower()
+        disable_logging = disable_logging_str == "true"  # Convert the string to a boolean
+
+        # Initialize logger
+        logger.setLevel(logging.CRITICAL)  # Default to CRITICAL to suppress logs if disabled
+
+        # Remove all existing handlers to prevent duplicate logs
+        if logger.hasHandlers():
+            logger.handlers.clear()
+
+        if disable_logging:
+            # Disable all logging by setting the log level to CRITICAL
+            logger.setLevel(logging.CRITICAL)  # This will suppress all logs
+        else:
+            # Get the VERBOSE_LOGGING flag from the environment variables
+            verbose_logging = os.getenv("VERBOSE_LOGGING", "False").strip().lower() == "true"
+
+            # Set logging level based on verbose flag
+            log_level = logging.DEBUG if verbose_logging else logging.INFO
+            logger.setLevel(log_level)
+
+        # The writer handler runs in the listener thread
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+        queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+        queue_handler.addFilter(RequestIdFilter())
+        logger.addHandler(queue_handler)
+        logger.propagate = False
+
+        _listener = QueueListener(queue_handler.queue, handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+        logger._configured = True
 
     return logger
+
+
+def shutdown_logging() -> None:
+    """
+    Writes the queued records and stops the listener thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    """
+    Records discarded because the queue was full.
+    """
+    logger = logging.getLogger("WeatherAgent")
+    return sum(getattr(handler, "dropped", 0) for handler in logger.handlers)
+
+
+# ----- Request IDs -----
+@contextmanager
+def request_context(request_id: str) -> Iterator[str]:
+    """
+    Tags every record logged inside the block (including other tasks/threads started with a
+    copy of the context) with `request_id`.
+    """
+    token = request_id_var.set(request_id)
+    try:
+        yield request_id
+    finally:
+        request_id_var.reset(token)
+
+
+# ----- Sampled prompt dumps -----
+def log_prompt(logger: logging.Logger, msg: str, *args: Any) -> None:
+    """
+    DEBUG dump of a prompt or model response, kept for `LOG_PROMPT_SAMPLE_RATE` of the calls.
+    Nothing is formatted when DEBUG is off or the call is not sampled.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PROMPT_SAMPLE_RATE:
+        logger.debug(msg, *args)
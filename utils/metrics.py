@@ -0,0 +1,283 @@
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, Optional
+
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # Port of the batch runner's /metrics server; 0 disables it
+
+# Seconds; the same buckets for nodes, LLM calls and HTTP calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# USD per 1M (prompt, completion) tokens, matched by model-name prefix (longest wins).
+# LLM_PRICES='{"my-model": [1.0, 2.0]}' adds or overrides entries.
+LLM_PRICES = {
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4-turbo": (10.00, 30.00),
+}
+LLM_PRICES.update({model: tuple(price) for model, price in json.loads(os.getenv("LLM_PRICES", "{}")).items()})
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    Estimated cost in USD of one call, or 0.0 for a model missing from LLM_PRICES.
+    """
+    matches = [name for name in LLM_PRICES if model.startswith(name)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = LLM_PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+# ----- Process-wide metrics -----
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            return [("", labels, value) for labels, value in self._values.items()]
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram per label set, in the Prometheus layout.
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._values: dict[tuple, list] = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            data = self._values.get(labels)
+            if data is None:
+                data = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                data[index] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def samples(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            values = {labels: list(data) for labels, data in self._values.items()}
+        samples = []
+        for labels, data in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                samples.append(("_bucket", labels + (("le", repr(bound)),), cumulative))
+            samples.append(("_bucket", labels + (("le", "+Inf"),), data[-1]))
+            samples.append(("_sum", labels, data[-2]))
+            samples.append(("_count", labels, data[-1]))
+        return samples
+
+
+NODE_SECONDS = Histogram("agent_node_duration_seconds", "Wall time of each graph node.")
+LLM_SECONDS = Histogram("agent_llm_duration_seconds", "Wall time of LLM calls that reached the provider.")
+LLM_CALLS = Counter("agent_llm_calls_total", "LLM calls by node and cache outcome.")
+LLM_TOKENS = Counter("agent_llm_tokens_total", "LLM tokens by node, model and kind (prompt/completion).")
+LLM_COST = Counter("agent_llm_cost_usd_total", "Estimated LLM cost in USD by node and model.")
+HTTP_SECONDS = Histogram("agent_http_duration_seconds", "Wall time of upstream HTTP attempts.")
+HTTP_REQUESTS = Counter("agent_http_requests_total", "Upstream HTTP attempts by upstream and status.")
+
+_METRICS = (NODE_SECONDS, LLM_SECONDS, LLM_CALLS, LLM_TOKENS, LLM_COST, HTTP_SECONDS, HTTP_REQUESTS)
+
+
+# ----- Per-request breakdown -----
+class RequestMetrics:
+    """
+    Timing, token and cost breakdown of one query, filled by the same hooks as the
+    process-wide metrics while the query runs inside `track_request()`.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.llm: dict[str, dict[str, float]] = {}
+        self.http: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def add_llm(self, node: str, seconds: float, prompt_tokens: int, completion_tokens: int,
+                cost: float, cache_hit: bool) -> None:
+        with self._lock:
+            entry = self.llm.setdefault(node, {
+                "calls": 0, "cache_hits": 0, "seconds": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+            })
+            entry["calls"] += 1
+            entry["cache_hits"] += int(cache_hit)
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+
+    def add_http(self, upstream: str, seconds: float, status: str) -> None:
+        with self._lock:
+            entry = self.http.setdefault(upstream, {"calls": 0, "seconds": 0.0, "statuses": {}})
+            entry["calls"] += 1
+            entry["seconds"] += seconds
+            entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+
+    def as_dict(self, node_timings: Optional[dict[str, float]] = None) -> dict[str, Any]:
+        """
+        The breakdown as plain data: wall time, per-node seconds (from `state["timings"]`) with
+        their share of the wall time, LLM calls per node and HTTP calls per upstream.
+        """
+        wall = time.perf_counter() - self.started
+        nodes = {
+            node: {"seconds": seconds, "share": seconds / wall if wall else 0.0}
+            for node, seconds in (node_timings or {}).items()
+        }
+        with self._lock:
+            llm = {node: dict(entry) for node, entry in self.llm.items()}
+            http = {upstream: {**entry, "statuses": dict(entry["statuses"])} for upstream, entry in self.http.items()}
+        return {
+            "wall_seconds": wall,
+            "nodes": nodes,
+            "llm": llm,
+            "http": http,
+            "totals": {
+                "llm_seconds": sum(entry["seconds"] for entry in llm.values()),
+                "prompt_tokens": sum(entry["prompt_tokens"] for entry in llm.values()),
+                "completion_tokens": sum(entry["completion_tokens"] for entry in llm.values()),
+                "cost_usd": sum(entry["cost_usd"] for entry in llm.values()),
+                "http_seconds": sum(entry["seconds"] for entry in http.values()),
+            },
+        }
+
+
+_current: contextvars.ContextVar[Optional[RequestMetrics]] = contextvars.ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def track_request() -> Iterator[RequestMetrics]:
+    """
+    Collects the breakdown of the calls made inside the block (LangGraph copies the context
+    into the threads and tasks that run the nodes, so they all report here).
+    """
+    breakdown = RequestMetrics()
+    token = _current.set(breakdown)
+    try:
+        yield breakdown
+    finally:
+        _current.reset(token)
+
+
+# ----- Hooks called by record_history, utils.llm_cache and utils.http_client -----
+def observe_node(node: str, seconds: float) -> None:
+    NODE_SECONDS.observe((("node", node),), seconds)
+
+
+def observe_llm(node: str, model: str, seconds: float, usage: Optional[dict]) -> None:
+    """
+    One LLM call that reached the provider. `usage` is the message's `usage_metadata`.
+    """
+    prompt_tokens = int((usage or {}).get("input_tokens", 0))
+    completion_tokens = int((usage or {}).get("output_tokens", 0))
+    cost = estimate_cost(model, prompt_tokens, completion_tokens)
+    LLM_SECONDS.observe((("node", node),), seconds)
+    LLM_CALLS.inc((("node", node), ("cache", "miss")))
+    LLM_TOKENS.inc((("node", node), ("model", model), ("kind", "prompt")), prompt_tokens)
+    LLM_TOKENS.inc((("node", node), ("model", model), ("kind", "completion")), completion_tokens)
+    LLM_COST.inc((("node", node), ("model", model)), cost)
+    breakdown = _current.get()
+    if breakdown is not None:
+        breakdown.add_llm(node, seconds, prompt_tokens, completion_tokens, cost, cache_hit=False)
+
+
+def observe_llm_cache_hit(node: str) -> None:
+    LLM_CALLS.inc((("node", node), ("cache", "hit")))
+    breakdown = _current.get()
+    if breakdown is not None:
+        breakdown.add_llm(node, 0.0, 0, 0, 0.0, cache_hit=True)
+
+
+def observe_http(upstream: str, seconds: float, status: str) -> None:
+    """
+    One upstream HTTP attempt; `status` is the status code or the exception class name.
+    """
+    HTTP_SECONDS.observe((("upstream", upstream),), seconds)
+    HTTP_REQUESTS.inc((("upstream", upstream), ("status", status)))
+    breakdown = _current.get()
+    if breakdown is not None:
+        breakdown.add_http(upstream, seconds, status)
+
+
+# ----- Prometheus text export -----
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus() -> str:
+    """
+    Every metric in the Prometheus text exposition format (version 0.0.4).
+    """
+    lines = []
+    for metric in _METRICS:
+        kind = "histogram" if isinstance(metric, Histogram) else "counter"
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        for suffix, labels, value in metric.samples():
+            lines.append(f"{metric.name}{suffix}{_labels(labels)} {_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("metrics: " + format, *args)
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves GET /metrics from a daemon thread and returns the server (call `shutdown()` to stop).
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info("Metrics available at http://%s:%s/metrics", host, port)
+    return server
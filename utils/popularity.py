@@ -0,0 +1,112 @@
+
+import os
+import json
+import math
+import time
+import heapq
+import threading
+from typing import Optional
+
+from utils.gazetteer import gazetteer
+from utils.logging import setup_logging
+from utils.response_cache import normalize_key
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+POPULARITY_HALF_LIFE = float(os.getenv("POPULARITY_HALF_LIFE", "3600"))  # Seconds for a hit to weigh half
+POPULARITY_MAX_KEYS = int(os.getenv("POPULARITY_MAX_KEYS", "5000"))  # Keys tracked per kind
+
+
+class PopularityTracker:
+    """
+    Exponentially decayed hit counts per kind of key ("weather" -> cities, "exchange" -> base
+    currencies, "news" -> country codes). Recent hits weigh more, so the ranking follows the
+    traffic as it shifts during the day. Thread-safe.
+    """
+
+    def __init__(self, half_life: float = POPULARITY_HALF_LIFE, max_keys: int = POPULARITY_MAX_KEYS):
+        self.half_life = half_life
+        self.max_keys = max_keys
+        # kind -> key -> [score, last update, value to query upstream]
+        self._scores: dict[str, dict[str, list]] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, score: float, since: float, now: float) -> float:
+        return score * math.pow(0.5, (now - since) / self.half_life)
+
+    def record(self, kind: str, key: str, value: Optional[str] = None, weight: float = 1.0) -> None:
+        """
+        Counts one hit of `key`. `value` is what the prefetcher sends upstream (e.g. the city as
+        written, while `key` is its normalized form); it defaults to the key.
+        """
+        now = time.monotonic()
+        with self._lock:
+            keys = self._scores.setdefault(kind, {})
+            entry = keys.get(key)
+            if entry is None:
+                if len(keys) >= self.max_keys:
+                    self._evict(keys, now)
+                keys[key] = [weight, now, value or key]
+            else:
+                entry[0] = self._decayed(entry[0], entry[1], now) + weight
+                entry[1] = now
+
+    def _evict(self, keys: dict[str, list], now: float) -> None:
+        # Drop the coldest tenth so evictions stay rare
+        coldest = heapq.nsmallest(
+            max(1, len(keys) // 10), keys.items(), key=lambda item: self._decayed(item[1][0], item[1][1], now)
+        )
+        for key, _ in coldest:
+            del keys[key]
+
+    def top(self, kind: str, k: int) -> list[tuple[str, str, float]]:
+        """
+        The `k` most popular keys of `kind` as (key, value, decayed score), hottest first.
+        """
+        now = time.monotonic()
+        with self._lock:
+            items = [
+                (key, entry[2], self._decayed(entry[0], entry[1], now))
+                for key, entry in self._scores.get(kind, {}).items()
+            ]
+        return heapq.nlargest(k, items, key=lambda item: item[2])
+
+    def clear(self) -> None:
+        with self._lock:
+            self._scores.clear()
+
+
+# Shared by the agents (which record hits) and the prefetcher (which reads the ranking)
+popularity = PopularityTracker()
+
+
+def seed_from_log(path: str, query_field: str = "query") -> int:
+    """
+    Counts the cities, base currencies and countries mentioned in a JSONL query log (one JSON
+    object with the query under `query_field`, or a bare JSON string, per line). Entities are
+    resolved with the gazetteer only, so seeding makes no LLM calls. Returns the queries read.
+    """
+    count = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            text = record if isinstance(record, str) else record.get(query_field) if isinstance(record, dict) else None
+            if not isinstance(text, str):
+                continue
+            count += 1
+            for city in gazetteer.match_cities(text):
+                popularity.record("weather", normalize_key(city), city)
+            currencies = gazetteer.match_exchange(text)
+            if currencies:
+                popularity.record("exchange", currencies[0])
+            for country in gazetteer.match_countries(text):
+                popularity.record("news", normalize_key(country))
+    logger.info("Popularidad inicial cargada desde %s (%s consultas)", path, count)
+    return count
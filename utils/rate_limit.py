@@ -0,0 +1,263 @@
+
+import os
+import re
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Mapping, Optional
+
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+# ----- Configuration -----
+# Quotas per upstream as "<count>/<unit>" separated by commas (units: s, min, hour, day, month).
+# Each quota is a token bucket; a request waits until every bucket of its upstream has a token.
+# Override with RATE_LIMIT_<NAME> (e.g. RATE_LIMIT_NEWSAPI="500/day" on a paid plan);
+# an empty value disables the limiter for that upstream.
+DEFAULT_LIMITS = {
+    "openweathermap": "60/min",  # Free plan
+    "exchangerate": "30/min,1500/month",  # Free plan
+    "newsapi": "100/day",  # Developer plan
+    "openai": "500/min",
+}
+
+# Host -> upstream name
+UPSTREAM_HOSTS = {
+    "api.openweathermap.org": "openweathermap",
+    "v6.exchangerate-api.com": "exchangerate",
+    "newsapi.org": "newsapi",
+    "api.openai.com": "openai",
+}
+
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10.0"))  # Max seconds a caller is queued
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))  # Retries on 429 / 5xx
+HTTP_BACKOFF_BASE = float(os.getenv("HTTP_BACKOFF_BASE", "0.5"))  # First backoff ceiling in seconds
+HTTP_BACKOFF_MAX = float(os.getenv("HTTP_BACKOFF_MAX", "8.0"))  # Backoff ceiling in seconds
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_UNITS = {"s": 1, "sec": 1, "min": 60, "hour": 3600, "day": 86400, "month": 30 * 86400}
+
+
+class RateLimitExceeded(Exception):
+    """
+    Raised when a caller would have to wait longer than RATE_LIMIT_MAX_WAIT for its upstream.
+    """
+
+    def __init__(self, upstream: str, wait: float):
+        super().__init__(f"Rate limit for {upstream} reached; next slot in {wait:.1f}s")
+        self.upstream = upstream
+        self.wait = wait
+
+
+def parse_limits(spec: str) -> list[tuple[float, float]]:
+    """
+    "60/min,1000/day" -> [(rate per second, capacity), ...]
+    """
+    limits = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        count, unit = part.split("/")
+        period = _UNITS[unit.strip().lower()]
+        limits.append((float(count) / period, float(count)))
+    return limits
+
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `capacity`. Reservations may drive the level
+    negative: the deficit is the time the caller has to wait for its slot.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def cancel(self) -> None:
+        self.tokens += 1
+
+    def cap(self, remaining: float, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, remaining)
+
+
+# ----- Rate-limit response headers -----
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def _header(headers: Mapping[str, str], *names: str) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+def _seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a reset/retry value: seconds ("30"), a Unix timestamp, an HTTP date, or an
+    OpenAI-style duration ("6m0s", "20ms").
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    try:
+        seconds = float(value)
+        # Large numbers are absolute Unix timestamps
+        return max(0.0, seconds - time.time()) if seconds > 10 ** 9 else seconds
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if parts:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    return _seconds(_header(headers, "retry-after", "Retry-After"))
+
+
+def backoff_delay(attempt: int, retry_after_seconds: Optional[float] = None) -> float:
+    """
+    Exponential backoff with full jitter, never shorter than the server's Retry-After.
+    """
+    delay = random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * 2 ** attempt))
+    return max(delay, retry_after_seconds or 0.0)
+
+
+class UpstreamLimiter:
+    """
+    Token buckets of one upstream plus what its rate-limit headers say. Callers are queued
+    (sleep until their reserved slot) for up to `max_wait` seconds instead of failing.
+    """
+
+    def __init__(self, name: str, limits: list[tuple[float, float]], max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.name = name
+        self.max_wait = max_wait
+        self._buckets = [TokenBucket(rate, capacity) for rate, capacity in limits]
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._stats = {"acquired": 0, "delayed": 0, "wait_seconds": 0.0, "rejected": 0, "throttled": 0}
+
+    def _reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._blocked_until - now)
+            for bucket in self._buckets:
+                wait = max(wait, bucket.reserve(now))
+            if wait > self.max_wait:
+                for bucket in self._buckets:
+                    bucket.cancel()
+                self._stats["rejected"] += 1
+                raise RateLimitExceeded(self.name, wait)
+            self._stats["acquired"] += 1
+            if wait:
+                self._stats["delayed"] += 1
+                self._stats["wait_seconds"] += wait
+            return wait
+
+    def acquire(self) -> None:
+        wait = self._reserve()
+        if wait:
+            logger.debug("Rate limit for %s: waiting %.2fs", self.name, wait)
+            time.sleep(wait)
+
+    async def aacquire(self) -> None:
+        wait = self._reserve()
+        if wait:
+            logger.debug("Rate limit for %s: waiting %.2fs", self.name, wait)
+            await asyncio.sleep(wait)
+
+    def block_for(self, seconds: float) -> None:
+        """
+        Holds every caller of this upstream for `seconds` (e.g. after a 429).
+        """
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> None:
+        """
+        Adjusts the limiter to the upstream's own view of the quota.
+        """
+        remaining = _header(headers, "x-ratelimit-remaining", "x-ratelimit-remaining-requests", "ratelimit-remaining")
+        reset = _seconds(_header(headers, "x-ratelimit-reset", "x-ratelimit-reset-requests", "ratelimit-reset"))
+
+        if status_code == 429:
+            with self._lock:
+                self._stats["throttled"] += 1
+            pause = retry_after(headers) or reset or HTTP_BACKOFF_BASE
+            logger.warning("%s returned 429; pausing its requests for %.1fs", self.name, pause)
+            self.block_for(pause)
+            return
+
+        if remaining is None:
+            return
+        try:
+            remaining_count = float(remaining)
+        except ValueError:
+            return
+        if remaining_count <= 0 and reset:
+            self.block_for(reset)
+            return
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._buckets:
+                bucket.cap(remaining_count, now)
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            return dict(self._stats)
+
+
+# ----- Registry -----
+_limiters: dict[str, Optional[UpstreamLimiter]] = {}
+_limiters_lock = threading.Lock()
+
+
+def upstream_limits(name: str) -> list[tuple[float, float]]:
+    """
+    Configured quotas of an upstream as [(rate per second, capacity), ...].
+    """
+    return parse_limits(os.getenv(f"RATE_LIMIT_{name.upper()}", DEFAULT_LIMITS.get(name, "")))
+
+
+def get_limiter(name: str) -> Optional[UpstreamLimiter]:
+    """
+    Returns the limiter of an upstream by name, or None if it has no configured quota.
+    """
+    if name not in _limiters:
+        with _limiters_lock:
+            if name not in _limiters:
+                limits = upstream_limits(name)
+                _limiters[name] = UpstreamLimiter(name, limits) if limits else None
+    return _limiters[name]
+
+
+def limiter_for_host(host: str) -> Optional[UpstreamLimiter]:
+    name = UPSTREAM_HOSTS.get(host)
+    return get_limiter(name) if name else None
+
+
+def rate_limit_stats() -> dict[str, dict[str, float]]:
+    """
+    Returns acquired / delayed / rejected / throttled counters and total wait per upstream.
+    """
+    return {name: limiter.stats() for name, limiter in _limiters.items() if limiter is not None}
@@ -0,0 +1,369 @@
+
+import re
+import time
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from utils.logging import setup_logging
+
+# Initialize logger using the setup_logging function
+logger = setup_logging()
+
+
+class LoadAbortedError(RuntimeError):
+    """
+    Raised to callers that were waiting on a shared upstream load that got cancelled.
+    """
+
+
+def normalize_key(text: str) -> str:
+    """
+    Normalizes a free-text key ("  New   York " -> "new york") so equivalent queries share an entry.
+    """
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class _Entry:
+    __slots__ = ("value", "stored_at", "size")
+
+    def __init__(self, value: Any, stored_at: float, size: int):
+        self.value = value
+        self.stored_at = stored_at
+        self.size = size
+
+
+class _Call:
+    """
+    A sync upstream load in flight; concurrent misses for the same key wait on it.
+    """
+    __slots__ = ("event", "value", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Bounded LRU cache for upstream responses with stale-while-revalidate and single-flight loads.
+
+    - Entries younger than `ttl` seconds are served as fresh.
+    - Entries younger than `ttl + stale_ttl` are served immediately while one background
+      load refreshes them.
+    - Concurrent misses for the same key share a single upstream load.
+    - Expired entries are not served by `get_or_load`, but `peek` still returns them.
+    - The cache holds at most `max_entries` entries and roughly `max_bytes` of values
+      (measured as the length of their repr); least recently used entries are evicted first.
+
+    Values are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        stale_ttl: float = 0.0,
+        max_entries: int = 1024,
+        max_bytes: int = 1_000_000,
+        cache_if: Callable[[Any], bool] = lambda value: True,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_if = cache_if
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight: dict[Hashable, _Call] = {}
+        self._ainflight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+        self._refreshing: set = set()
+        self._background_tasks: set = set()
+        self._stats = {
+            "hits": 0, "stale_hits": 0, "misses": 0, "coalesced": 0,
+            "refreshes": 0, "evictions": 0, "load_errors": 0,
+        }
+        _caches[name] = self
+
+    # ----- Lookup and storage -----
+    def _lookup(self, key: Hashable) -> tuple[Optional[_Entry], Optional[str]]:
+        """
+        Returns (entry, "fresh" | "stale" | None) and updates the hit/miss counters.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry.stored_at
+                if age <= self.ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry, "fresh"
+                if age <= self.ttl + self.stale_ttl:
+                    self._entries.move_to_end(key)
+                    self._stats["stale_hits"] += 1
+                    return entry, "stale"
+                # Expired entries stay (until replaced or evicted) as the last known value
+                # that `peek` hands to agents that miss their deadline.
+            self._stats["misses"] += 1
+            return None, None
+
+    def _drop(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _store(self, key: Hashable, value: Any) -> None:
+        if not self.cache_if(value):
+            return
+        size = len(repr(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = _Entry(value, time.monotonic(), size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def peek(self, key: Hashable) -> Optional[tuple[Any, bool]]:
+        """
+        Returns (value, is_stale) for any entry still held, without loading or counting a hit.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return entry.value, time.monotonic() - entry.stored_at > self.ttl
+
+    def expires_in(self, key: Hashable) -> Optional[float]:
+        """
+        Seconds until the entry stops being fresh (negative once it has), or None if not held.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return self.ttl - (time.monotonic() - entry.stored_at)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the hit/miss/coalesce counters plus the current size of the cache.
+        """
+        with self._lock:
+            return {**self._stats, "entries": len(self._entries), "bytes": self._bytes}
+
+    # ----- Sync API -----
+    def get_or_load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Returns the cached value for `key`, calling `loader()` at most once per key on a miss.
+        """
+        entry, freshness = self._lookup(key)
+        if freshness == "fresh":
+            return entry.value
+        if freshness == "stale":
+            self._refresh_in_thread(key, loader)
+            return entry.value
+        return self._load(key, loader)
+
+    def refresh(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        Loads `key` now, regardless of its age, and stores the result (e.g. to prefetch it).
+        Shares the load with any concurrent miss for the same key.
+        """
+        return self._load(key, loader)
+
+    def get_many_or_load(self, keys: list, load_many: Callable[[list], dict]) -> dict:
+        """
+        `get_or_load` for several keys: cached values are served as usual and every miss is
+        loaded by one `load_many(missing_keys)` call, which returns {key: value}. Stale entries
+        are refreshed one key at a time in the background. Batch loads are not shared with
+        concurrent misses for the same keys.
+        """
+        values, missing = {}, []
+        for key in keys:
+            entry, freshness = self._lookup(key)
+            if freshness is None:
+                missing.append(key)
+                continue
+            values[key] = entry.value
+            if freshness == "stale":
+                self._refresh_in_thread(key, lambda key=key: load_many([key])[key])
+        if missing:
+            try:
+                loaded = load_many(missing)
+            except BaseException:
+                with self._lock:
+                    self._stats["load_errors"] += 1
+                raise
+            values.update(self._store_many(missing, loaded))
+        return values
+
+    def _store_many(self, keys: list, loaded: dict) -> dict:
+        for key in keys:
+            if key in loaded:
+                self._store(key, loaded[key])
+        return loaded
+
+    def _load(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _Call()
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+            self._store(key, call.value)
+            return call.value
+        except BaseException as e:
+            call.error = e
+            with self._lock:
+                self._stats["load_errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            call.event.set()
+
+    def _claim_refresh(self, key: Hashable) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._stats["refreshes"] += 1
+            return True
+
+    def _refresh_in_thread(self, key: Hashable, loader: Callable[[], Any]) -> None:
+        if not self._claim_refresh(key):
+            return
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception:
+                logger.exception("Background refresh failed for %s cache key %r", self.name, key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+    # ----- Async API -----
+    async def aget_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Async version of `get_or_load`; `loader` is a coroutine function.
+        """
+        entry, freshness = self._lookup(key)
+        if freshness == "fresh":
+            return entry.value
+        if freshness == "stale":
+            self._refresh_in_task(key, loader)
+            return entry.value
+        return await self._aload(key, loader)
+
+    async def aget_many_or_load(self, keys: list, load_many: Callable[[list], Awaitable[dict]]) -> dict:
+        """
+        Async version of `get_many_or_load`; `load_many` is a coroutine function.
+        """
+        values, missing = {}, []
+        for key in keys:
+            entry, freshness = self._lookup(key)
+            if freshness is None:
+                missing.append(key)
+                continue
+            values[key] = entry.value
+            if freshness == "stale":
+                async def refresh_one(key=key):
+                    return (await load_many([key]))[key]
+                self._refresh_in_task(key, refresh_one)
+        if missing:
+            try:
+                loaded = await load_many(missing)
+            except BaseException:
+                with self._lock:
+                    self._stats["load_errors"] += 1
+                raise
+            values.update(self._store_many(missing, loaded))
+        return values
+
+    async def _aload(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        loop = asyncio.get_running_loop()
+        inflight = self._ainflight.setdefault(loop, {})
+        future = inflight.get(key)
+        if future is not None:
+            with self._lock:
+                self._stats["coalesced"] += 1
+            return await asyncio.shield(future)
+
+        future = inflight[key] = loop.create_future()
+        try:
+            value = await loader()
+            self._store(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Waiters must not see a CancelledError that belongs to the leader's task.
+            future.set_exception(LoadAbortedError(f"{self.name} load for {key!r} was cancelled"))
+            future.exception()
+            raise
+        except BaseException as e:
+            with self._lock:
+                self._stats["load_errors"] += 1
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else is waiting
+            raise
+        finally:
+            inflight.pop(key, None)
+
+    def _refresh_in_task(self, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> None:
+        if not self._claim_refresh(key):
+            return
+
+        async def refresh():
+            try:
+                await self._aload(key, loader)
+            except Exception:
+                logger.exception("Background refresh failed for %s cache key %r", self.name, key)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+
+# ----- Registry of every response cache in the process -----
+_caches: dict[str, ResponseCache] = {}
+
+
+def cache_stats() -> dict[str, dict[str, int]]:
+    """
+    Returns the counters of every response cache, keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
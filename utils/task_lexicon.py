@@ -0,0 +1,75 @@
+
+from typing import NamedTuple
+
+from utils.gazetteer import AhoCorasick, fold, gazetteer, leftmost_longest
+
+# ----- Task lexicon -----
+# Trigger words per task, in Spanish and English, with a weight: 1.0 means the word alone
+# identifies the task, lower weights need support from other words. Multi-word entries win
+# over their parts ("tipo de cambio" over "cambio").
+TASK_KEYWORDS = {
+    "weather": {
+        "clima": 1.0, "el tiempo": 0.6, "qué tiempo hace": 1.0, "tiempo": 0.3, "temperatura": 1.0,
+        "pronóstico": 1.0, "llover": 1.0, "lloverá": 1.0, "llueve": 1.0, "lluvia": 1.0, "nieve": 0.8,
+        "calor": 0.6, "frío": 0.6, "soleado": 0.8, "nublado": 0.8, "humedad": 0.8, "grados": 0.5,
+        "weather": 1.0, "forecast": 1.0, "temperature": 1.0, "rain": 0.8, "raining": 1.0,
+        "snow": 0.8, "sunny": 0.8, "cloudy": 0.8, "humidity": 0.8, "degrees": 0.5,
+    },
+    "exchange": {
+        "tipo de cambio": 1.0, "tasa de cambio": 1.0, "cambio": 0.4, "divisa": 1.0, "divisas": 1.0,
+        "moneda": 0.6, "monedas": 0.6, "cotización": 0.8, "convertir": 0.6, "conversión": 0.6,
+        "exchange rate": 1.0, "exchange": 0.6, "currency": 1.0, "currencies": 1.0, "convert": 0.6,
+        "conversion": 0.6, "forex": 1.0,
+    },
+    "news": {
+        "noticias": 1.0, "noticia": 1.0, "titulares": 1.0, "encabezados": 0.8, "actualidad": 0.8,
+        "últimas": 0.3, "periódico": 0.8, "prensa": 0.6, "news": 1.0, "headlines": 1.0,
+        "headline": 1.0, "latest": 0.3, "newspaper": 0.8,
+    },
+}
+
+# Each currency mentioned adds this much to "exchange"; two currencies settle it
+CURRENCY_MENTION_WEIGHT = 0.5
+
+
+class TaskMention(NamedTuple):
+    task: str
+    weight: float
+    start: int
+    end: int
+
+
+_automaton = AhoCorasick(
+    (fold(keyword), (task, weight))
+    for task, keywords in TASK_KEYWORDS.items()
+    for keyword, weight in keywords.items()
+)
+
+
+def scan_tasks(text: str) -> list[TaskMention]:
+    """
+    Finds the task trigger words in `text`, plus currency mentions as "exchange" evidence.
+
+    Returns:
+        list[TaskMention]: Non-overlapping mentions sorted by their character offset.
+    """
+    folded = fold(text)
+    mentions = leftmost_longest([
+        TaskMention(task, weight, start, end)
+        for start, end, (task, weight) in _automaton.iter_word_matches(folded)
+    ])
+    mentions.extend(
+        TaskMention("exchange", CURRENCY_MENTION_WEIGHT, m.start, m.end)
+        for m in gazetteer.scan(text) if m.kind == "currency"
+    )
+    return sorted(mentions, key=lambda m: m.start)
+
+
+def score_tasks(text: str) -> dict[str, float]:
+    """
+    Sums the evidence for each task, capped at 1.0.
+    """
+    scores = {task: 0.0 for task in TASK_KEYWORDS}
+    for mention in scan_tasks(text):
+        scores[mention.task] = min(scores[mention.task] + mention.weight, 1.0)
+    return scores